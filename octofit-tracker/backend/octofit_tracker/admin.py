@@ -1,28 +1,46 @@
+from bson import ObjectId
 from django.contrib import admin
+from .changelists import CachedValuesFilter, LargeCollectionAdmin
 from .models import User, Team, Activity, Leaderboard, Workout
+from .search import search
+
+
+class IndexedSearchMixin:
+    """Answer the changelist search box from the in-memory index (search.py) instead of regex scans."""
+    search_kind = None
+    
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        # Every match, as the changelist pages and counts the filtered queryset itself
+        results = search(search_term, kinds={self.search_kind}, limit=None)
+        return queryset.filter(pk__in=[ObjectId(result['id']) for result in results]), False
 
 
 @admin.register(User)
-class UserAdmin(admin.ModelAdmin):
+class UserAdmin(IndexedSearchMixin, LargeCollectionAdmin):
+    search_kind = 'users'
+    keyset_ordering = ('-created_at', '_id')
     list_display = ['name', 'email', 'team', 'fitness_level', 'created_at']
-    list_filter = ['team', 'fitness_level', 'created_at']
+    list_filter = [('team', CachedValuesFilter), ('fitness_level', CachedValuesFilter), 'created_at']
     search_fields = ['name', 'email']
-    ordering = ['-created_at']
 
 
 @admin.register(Team)
-class TeamAdmin(admin.ModelAdmin):
-    list_display = ['name', 'members_count', 'created_at']
+class TeamAdmin(IndexedSearchMixin, admin.ModelAdmin):
+    search_kind = 'teams'
+    list_display = ['name', 'members_count', 'total_calories', 'rank', 'created_at']
     search_fields = ['name']
+    readonly_fields = ['members_count', 'total_calories', 'total_distance', 'rank']
     ordering = ['-created_at']
 
 
 @admin.register(Activity)
-class ActivityAdmin(admin.ModelAdmin):
+class ActivityAdmin(LargeCollectionAdmin):
+    keyset_ordering = ('-date', '_id')
     list_display = ['user_email', 'activity_type', 'duration_minutes', 'calories_burned', 'distance_km', 'date']
-    list_filter = ['activity_type', 'date']
+    list_filter = [('activity_type', CachedValuesFilter), 'date']
     search_fields = ['user_email']
-    ordering = ['-date']
 
 
 @admin.register(Leaderboard)
@@ -34,7 +52,8 @@ class LeaderboardAdmin(admin.ModelAdmin):
 
 
 @admin.register(Workout)
-class WorkoutAdmin(admin.ModelAdmin):
+class WorkoutAdmin(IndexedSearchMixin, admin.ModelAdmin):
+    search_kind = 'workouts'
     list_display = ['name', 'fitness_level', 'duration_minutes', 'category']
     list_filter = ['fitness_level', 'category']
     search_fields = ['name', 'description']
@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class OctofitTrackerConfig(AppConfig):
+    name = 'octofit_tracker'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .instrumentation import install
+        # pymongo only reports to listeners registered before a client exists
+        install()
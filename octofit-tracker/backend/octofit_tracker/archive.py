@@ -0,0 +1,336 @@
+"""
+Cold storage for old activities.
+
+``archive_activities(older_than)`` moves activities dated before a cutoff
+out of the hot collection into column files under ``OCTOFIT_ARCHIVE_DIR``:
+one directory per month, holding one immutable chunk per archive batch.
+A chunk stores each field as a ``.npy`` array: ids as 12-byte values,
+dates as int64 milliseconds, numbers as int32 or float64 (NaN for no
+distance) and strings dictionary-encoded as uint32 codes into
+``dictionaries.json``. Dictionary encoding and narrow types are the only
+compression, so readers ``np.load(mmap_mode='r')`` the columns and scan
+them with vectorised masks, paging in only the columns a query touches.
+
+The leaderboard, team, rollup and window totals already include archived
+activities; removing them from the hot collection leaves those alone. The
+rebuilds read activities, though, so each chunk's per-user daily totals
+go into ``archived_days`` and ``union_stage()`` adds them to the rebuild
+pipelines.
+
+A chunk is moved in steps that are each safe to repeat: the columns are
+written to a temporary directory and renamed into place with a
+``PENDING`` marker, the daily totals are upserted by ``(chunk, user,
+day)``, the rows are deleted from the hot collection, then the marker is
+removed. The next run completes interrupted moves (``finish_pending()``)
+and readers skip pending chunks.
+
+Exports read the archive through ``archived_documents()`` and the
+historical per-type stats through ``activity_summary()``.
+"""
+import heapq
+import json
+import os
+import shutil
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from bson import ObjectId
+from django.conf import settings
+from pymongo import ASCENDING, UpdateOne
+
+from .indexes import ensure_indexes
+from .models import Activity, ArchivedDay
+from .mongo import get_collection
+from .versions import reset
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+DAY_MS = 24 * 60 * 60 * 1000
+PENDING = 'PENDING'
+DICTIONARIES = 'dictionaries.json'
+NUMERIC_COLUMNS = {'duration_minutes': np.int32, 'calories_burned': np.int32, 'distance_km': np.float64}
+STRING_COLUMNS = ('user_email', 'activity_type', 'notes')
+DELETE_BATCH = 10000
+
+
+def archive_root():
+    return settings.OCTOFIT_ARCHIVE_DIR
+
+
+def union_stage(match=None):
+    """``$unionWith`` stage adding the archived daily totals to a rebuild over activities."""
+    return {'$unionWith': {'coll': ArchivedDay._meta.db_table, 'pipeline': [{'$match': match}] if match else []}}
+
+
+def to_millis(date):
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return (date - EPOCH) // timedelta(milliseconds=1)
+
+
+def from_millis(value):
+    return EPOCH + timedelta(milliseconds=int(value))
+
+
+def month_key(date):
+    date = date.astimezone(timezone.utc) if date.tzinfo else date
+    return f'{date.year:04d}-{date.month:02d}'
+
+
+class Chunk:
+    """One archived chunk; columns are memory-mapped on first use."""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.month = os.path.basename(os.path.dirname(path))
+        self._columns = {}
+        with open(os.path.join(path, DICTIONARIES)) as handle:
+            self.dictionaries = json.load(handle)
+
+    def __getitem__(self, name):
+        if name not in self._columns:
+            self._columns[name] = np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode='r')
+        return self._columns[name]
+
+    def __len__(self):
+        return len(self['date'])
+
+    @property
+    def pending(self):
+        return os.path.exists(os.path.join(self.path, PENDING))
+
+    def mask(self, since=None, until=None, user_email=None):
+        """Boolean mask of the rows in ``[since, until]`` for a user, or ``None`` if no row can match."""
+        dates = self['date']
+        mask = np.ones(len(dates), dtype=bool)
+        if since is not None:
+            mask &= dates >= to_millis(since)
+        if until is not None:
+            mask &= dates <= to_millis(until)
+        if user_email is not None:
+            emails = self.dictionaries['user_email']
+            if user_email not in emails:
+                return None
+            mask &= self['user_email'] == emails.index(user_email)
+        return mask if mask.any() else None
+
+
+def chunks(since=None, until=None, root=None, include_pending=False):
+    """Chunks of the months overlapping ``[since, until]``, oldest month first."""
+    root = root or archive_root()
+    if not os.path.isdir(root):
+        return
+    first = month_key(since) if since is not None else None
+    last = month_key(until) if until is not None else None
+    for month in sorted(os.listdir(root)):
+        if (first and month < first) or (last and month > last):
+            continue
+        for name in sorted(os.listdir(os.path.join(root, month))):
+            if name.startswith('.'):
+                continue
+            chunk = Chunk(os.path.join(root, month, name))
+            if include_pending or not chunk.pending:
+                yield chunk
+
+
+def _write_chunk(root, month, documents):
+    """Write documents (sorted by date) as a new pending chunk; returns it."""
+    name = str(ObjectId())
+    staging = os.path.join(root, month, f'.{name}.tmp')
+    os.makedirs(staging)
+    columns = {
+        '_id': np.array([document['_id'].binary for document in documents], dtype='V12'),
+        'date': np.array([to_millis(document['date']) for document in documents], dtype=np.int64),
+    }
+    for column, dtype in NUMERIC_COLUMNS.items():
+        missing = np.nan if dtype is np.float64 else 0
+        values = [document.get(column) for document in documents]
+        columns[column] = np.array([missing if value is None else value for value in values], dtype=dtype)
+    dictionaries = {}
+    for column in STRING_COLUMNS:
+        codes = {}
+        columns[column] = np.array([codes.setdefault(document.get(column) or '', len(codes)) for document in documents],
+                                   dtype=np.uint32)
+        dictionaries[column] = list(codes)
+
+    for column, values in columns.items():
+        np.save(os.path.join(staging, f'{column}.npy'), values)
+    with open(os.path.join(staging, DICTIONARIES), 'w') as handle:
+        json.dump(dictionaries, handle)
+    open(os.path.join(staging, PENDING), 'w').close()
+    path = os.path.join(root, month, name)
+    os.rename(staging, path)
+    return Chunk(path)
+
+
+def _complete(chunk):
+    """Fold a pending chunk's daily totals in, drop its rows from the hot collection and unmark it."""
+    totals = defaultdict(lambda: [0, 0, 0.0, 0])
+    emails = chunk.dictionaries['user_email']
+    days = (chunk['date'] // DAY_MS).tolist()
+    rows = zip(chunk['user_email'].tolist(), days, chunk['calories_burned'].tolist(),
+               np.nan_to_num(chunk['distance_km']).tolist(), chunk['duration_minutes'].tolist())
+    for code, day, calories, distance, duration in rows:
+        total = totals[(emails[code], day)]
+        total[0] += 1
+        total[1] += calories
+        total[2] += distance
+        total[3] += duration
+    get_collection(ArchivedDay).bulk_write([
+        UpdateOne({'chunk': chunk.name, 'user_email': email, 'date': from_millis(day * DAY_MS)}, {'$set': {
+            'activities': activities,
+            'calories_burned': calories,
+            'distance_km': round(distance, 2),
+            'duration_minutes': duration,
+        }}, upsert=True)
+        for (email, day), (activities, calories, distance, duration) in totals.items()
+    ], ordered=False)
+
+    ids = [ObjectId(value.tobytes()) for value in chunk['_id']]
+    activities = get_collection(Activity)
+    for offset in range(0, len(ids), DELETE_BATCH):
+        activities.delete_many({'_id': {'$in': ids[offset:offset + DELETE_BATCH]}})
+    os.remove(os.path.join(chunk.path, PENDING))
+
+
+def finish_pending(root=None):
+    """Complete chunks whose move was interrupted and clear half-written ones; returns the number completed."""
+    root = root or archive_root()
+    if not os.path.isdir(root):
+        return 0
+    for month in os.listdir(root):
+        for name in os.listdir(os.path.join(root, month)):
+            if name.startswith('.') and name.endswith('.tmp'):
+                shutil.rmtree(os.path.join(root, month, name))
+    completed = 0
+    for chunk in chunks(root=root, include_pending=True):
+        if chunk.pending:
+            _complete(chunk)
+            completed += 1
+    return completed
+
+
+def clear_archive(root=None):
+    """Drop every archived activity: the chunk files and their ``ArchivedDay`` totals."""
+    root = root or archive_root()
+    if os.path.isdir(root):
+        for month in os.listdir(root):
+            shutil.rmtree(os.path.join(root, month))
+    get_collection(ArchivedDay).delete_many({})
+
+
+def archive_activities(older_than, batch_size=50000, root=None):
+    """
+    Move activities dated before ``older_than`` from the hot collection into the archive.
+
+    Activities are read in date order and written in chunks of at most
+    ``batch_size`` rows that never straddle a month. Delta pollers of the
+    activities are sent to refetch, since the moved rows leave no
+    tombstones. Returns ``{'archived', 'chunks', 'resumed'}``.
+    """
+    root = root or archive_root()
+    ensure_indexes(ArchivedDay)
+    resumed = finish_pending(root)
+    activities = get_collection(Activity)
+    archived = written = 0
+    month, batch = None, []
+    for document in activities.find({'date': {'$lt': older_than}}).sort('date', ASCENDING).batch_size(batch_size):
+        key = month_key(document['date'])
+        if batch and (key != month or len(batch) >= batch_size):
+            _complete(_write_chunk(root, month, batch))
+            archived, written, batch = archived + len(batch), written + 1, []
+        month = key
+        batch.append(document)
+    if batch:
+        _complete(_write_chunk(root, month, batch))
+        archived, written = archived + len(batch), written + 1
+    if archived:
+        reset(activities.name)
+    return {'archived': archived, 'chunks': written, 'resumed': resumed}
+
+
+def _chunk_documents(chunk, since, user_email):
+    mask = chunk.mask(since=since, user_email=user_email)
+    if mask is None:
+        return
+    strings = {column: chunk.dictionaries[column] for column in STRING_COLUMNS}
+    for index in np.flatnonzero(mask).tolist():
+        distance = float(chunk['distance_km'][index])
+        yield {
+            '_id': ObjectId(chunk['_id'][index].tobytes()),
+            'user_email': strings['user_email'][chunk['user_email'][index]],
+            'activity_type': strings['activity_type'][chunk['activity_type'][index]],
+            'duration_minutes': int(chunk['duration_minutes'][index]),
+            'calories_burned': int(chunk['calories_burned'][index]),
+            'distance_km': None if np.isnan(distance) else distance,
+            'date': from_millis(chunk['date'][index]),
+            'notes': strings['notes'][chunk['notes'][index]],
+        }
+
+
+def archived_documents(since=None, user_email=None, root=None):
+    """Archived activities as Mongo-shaped documents, oldest first."""
+    streams = [_chunk_documents(chunk, since, user_email) for chunk in chunks(since=since, root=root)]
+    return heapq.merge(*streams, key=lambda document: document['date'])
+
+
+def archived_summary(since=None, until=None, user_email=None, root=None):
+    """``{activity_type: [activities, calories, distance, duration]}`` over the archive."""
+    totals = defaultdict(lambda: [0, 0, 0.0, 0])
+    for chunk in chunks(since, until, root=root):
+        mask = chunk.mask(since, until, user_email)
+        if mask is None:
+            continue
+        types = chunk.dictionaries['activity_type']
+        codes = chunk['activity_type'][mask]
+        columns = [
+            np.bincount(codes, minlength=len(types)),
+            np.bincount(codes, weights=chunk['calories_burned'][mask], minlength=len(types)),
+            np.bincount(codes, weights=np.nan_to_num(chunk['distance_km'][mask]), minlength=len(types)),
+            np.bincount(codes, weights=chunk['duration_minutes'][mask], minlength=len(types)),
+        ]
+        for code, activity_type in enumerate(types):
+            if columns[0][code]:
+                total = totals[activity_type]
+                total[0] += int(columns[0][code])
+                total[1] += int(columns[1][code])
+                total[2] += float(columns[2][code])
+                total[3] += int(columns[3][code])
+    return totals
+
+
+def activity_summary(since=None, until=None, user_email=None):
+    """
+    Per-activity-type totals over hot and archived activities, most calories first.
+
+    The hot collection is grouped on the server; the archive is scanned
+    with ``archived_summary()``.
+    """
+    match = {}
+    if since is not None or until is not None:
+        match['date'] = {**({'$gte': since} if since else {}), **({'$lte': until} if until else {})}
+    if user_email:
+        match['user_email'] = user_email
+    totals = archived_summary(since, until, user_email)
+    for row in get_collection(Activity).aggregate([
+        {'$match': match},
+        {'$group': {
+            '_id': '$activity_type',
+            'activities': {'$sum': 1},
+            'calories': {'$sum': '$calories_burned'},
+            'distance': {'$sum': {'$ifNull': ['$distance_km', 0]}},
+            'duration_minutes': {'$sum': '$duration_minutes'},
+        }},
+    ]):
+        total = totals[row['_id']]
+        total[0] += row['activities']
+        total[1] += row['calories']
+        total[2] += row['distance']
+        total[3] += row['duration_minutes']
+    rows = [
+        {'activity_type': activity_type, 'activities': activities, 'calories': calories,
+         'distance': round(distance, 2), 'duration_minutes': duration}
+        for activity_type, (activities, calories, distance, duration) in totals.items()
+    ]
+    return sorted(rows, key=lambda row: (-row['calories'], row['activity_type']))
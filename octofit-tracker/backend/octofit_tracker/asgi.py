@@ -12,5 +12,11 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
+os.environ.setdefault('OCTOFIT_ASYNC_READS', '1')
 
 application = get_asgi_application()
+
+# Build the search index now rather than on the first search
+from octofit_tracker.search import warm_in_background  # noqa: E402
+
+warm_in_background()
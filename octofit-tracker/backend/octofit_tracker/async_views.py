@@ -0,0 +1,300 @@
+"""
+Async read endpoints for ASGI deployments.
+
+With ``OCTOFIT_ASYNC_READS`` enabled (the default under ``asgi.py``) these
+views are routed ahead of the DRF router for list, retrieve, ``top``,
+``recent``, ``by_user`` and ``by_team``. GET requests are answered by
+coroutines that query MongoDB through Motor, so a worker's event loop can
+keep many dashboard polls in flight instead of parking a thread on each
+one. Responses match the sync viewsets: the same keyset pagination and
+cursors, the same serializers (via ``repositories.model_instances``) and
+the same response cache for ``top``/``by_team``.
+
+Everything else (writes, the browsable API, ``?format=`` and MessagePack
+requests, other actions) is handed to the unchanged sync viewset with
+``sync_to_async``.
+
+Motor runs commands on its own thread pool, so the instrumentation
+middleware's Mongo timings only cover the delegated sync requests.
+"""
+import asyncio
+import functools
+
+from asgiref.sync import sync_to_async
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.db import connections
+from django.http import HttpResponse
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+
+from .cache import etag_matches, get_cache, response_key
+from .changes import not_modified, set_validators, validators
+from .fieldsets import projected_fields
+from .models import Activity, Leaderboard
+from .pagination import KeysetPagination
+from .renderers import orjson_dumps
+from .repositories import model_instance, model_instances, model_projection
+from .serializers import ActivitySerializer, LeaderboardSerializer
+from .versions import VERSIONS_COLLECTION, state_from
+from .views import UserViewSet, TeamViewSet, ActivityViewSet, LeaderboardViewSet, WorkoutViewSet
+
+VIEWSETS = {
+    'users': UserViewSet,
+    'teams': TeamViewSet,
+    'activities': ActivityViewSet,
+    'leaderboard': LeaderboardViewSet,
+    'workouts': WorkoutViewSet,
+}
+
+_clients = {}
+
+
+def close_stale_clients():
+    """Close and forget the clients of event loops that have closed, e.g. after each ``asyncio.run()``."""
+    for key, client in list(_clients.items()):
+        if key[1].is_closed():
+            client.close()
+            del _clients[key]
+
+
+def get_async_db(alias='default'):
+    """Motor database for the running event loop; one pooled client per loop."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get((alias, loop))
+    if client is None:
+        # A client is bound to its loop, so one left by a finished loop would keep its pool open
+        close_stale_clients()
+        client_settings = connections[alias].settings_dict.get('CLIENT', {})
+        client = AsyncIOMotorClient(tz_aware=True, io_loop=loop, **client_settings)
+        _clients[(alias, loop)] = client
+    return client[connections[alias].settings_dict['NAME']]
+
+
+def get_async_collection(model, alias='default'):
+    return get_async_db(alias)[model._meta.db_table]
+
+
+class JSONDataResponse(HttpResponse):
+    """JSON rendered like the sync views' ``ORJSONRenderer``, keeping ``data`` for the cache."""
+
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(orjson_dumps(data), **kwargs)
+        self.data = data
+
+
+def async_view(view):
+    """Mark a coroutine view CSRF-exempt; ``csrf_exempt`` itself wraps it in a sync function on Django 4.1."""
+    view.csrf_exempt = True
+    return view
+
+
+def _sync_view(viewset, actions, detail):
+    view = viewset.as_view(actions, basename=viewset.queryset.model._meta.model_name, detail=detail)
+    return sync_to_async(view)
+
+
+SYNC_LIST_VIEWS = {
+    name: _sync_view(viewset, {'get': 'list', 'post': 'create'}, detail=False)
+    for name, viewset in VIEWSETS.items()
+}
+SYNC_DETAIL_VIEWS = {
+    name: _sync_view(viewset, {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update',
+                               'delete': 'destroy'}, detail=True)
+    for name, viewset in VIEWSETS.items()
+}
+
+
+def _action_view(viewset, action_name):
+    method = getattr(viewset, action_name)
+    view = viewset.as_view({'get': action_name}, basename=viewset.queryset.model._meta.model_name,
+                           detail=False, **method.kwargs)
+    return sync_to_async(view)
+
+
+def _wants_sync(request):
+    """Requests the async path does not serve: writes, browsable API, other formats, windows."""
+    if request.method != 'GET' or 'format' in request.GET or 'window' in request.GET:
+        return True
+    accept = request.headers.get('Accept', '')
+    if 'application/msgpack' in accept:
+        return True
+    return 'text/html' in accept and 'application/json' not in accept
+
+
+def not_found():
+    return JSONDataResponse({'detail': 'Not found.'}, status=404)
+
+
+async def collection_state(model):
+    """``versions.collection_state()`` of a model's collection, read with Motor."""
+    return state_from(await get_async_db()[VERSIONS_COLLECTION].find_one({'_id': model._meta.db_table}))
+
+
+async def collection_versions(collections):
+    """``cache.collection_versions()``, read with Motor."""
+    documents = await get_async_db()[VERSIONS_COLLECTION].find({'_id': {'$in': list(collections)}}).to_list(None)
+    found = {document['_id']: document for document in documents}
+    return [state_from(found.get(collection))[0] for collection in collections]
+
+
+async def conditional(request, model, respond):
+    """Answer with a 304 if the client holds the current version, else ``await respond()``; add validators."""
+    state = await collection_state(model)
+    etag, modified = validators(request, state)
+    if not_modified(request, etag, modified):
+        response = HttpResponse(status=304)
+    else:
+        response = await respond()
+        if response.status_code != 200:
+            return response
+    return set_validators(response, state, etag, modified)
+
+
+@async_view
+async def collection(request, resource):
+    """``/api/<resource>/``: async keyset-paginated list; other methods and deltas go to the viewset."""
+    if _wants_sync(request) or 'since_version' in request.GET:
+        return await SYNC_LIST_VIEWS[resource](request)
+    viewset = VIEWSETS[resource]
+    return await conditional(request, viewset.queryset.model, lambda: _list_page(request, viewset))
+
+
+async def _list_page(request, viewset):
+    model = viewset.queryset.model
+    drf_request = Request(request)
+    paginator = KeysetPagination()
+    paginator.page_size = paginator.get_page_size(drf_request)
+    try:
+        cursor = paginator.prepare(drf_request, model, viewset)
+    except NotFound as exc:
+        return JSONDataResponse({'detail': exc.detail}, status=exc.status_code)
+    reverse = cursor is not None and cursor.reverse
+
+    context = {'request': drf_request}
+    names = projected_fields(viewset.serializer_class(context=context), paginator.ordering)
+    query = paginator.mongo_after(cursor.keys, reverse) if cursor is not None else {}
+    documents = await get_async_collection(model).find(query, model_projection(model, names)) \
+        .sort(paginator.mongo_sort(reverse)).limit(paginator.page_size + 1).to_list(None)
+    page = paginator.finish_page(model_instances(model, documents), cursor)
+    return JSONDataResponse({
+        'next': paginator.get_next_link(),
+        'previous': paginator.get_previous_link(),
+        'results': viewset.serializer_class(page, many=True, context=context).data,
+    })
+
+
+@async_view
+async def item(request, resource, pk):
+    """``/api/<resource>/<id>/``: async retrieve; other methods go to the viewset."""
+    if _wants_sync(request):
+        return await SYNC_DETAIL_VIEWS[resource](request, pk=pk)
+    viewset = VIEWSETS[resource]
+    return await conditional(request, viewset.queryset.model, lambda: _detail(request, viewset, pk))
+
+
+async def _detail(request, viewset, pk):
+    model = viewset.queryset.model
+    try:
+        object_id = ObjectId(pk)
+    except InvalidId:
+        return not_found()
+    context = {'request': request}
+    names = projected_fields(viewset.serializer_class(context=context))
+    document = await get_async_collection(model).find_one({'_id': object_id}, model_projection(model, names))
+    if document is None:
+        return not_found()
+    return JSONDataResponse(viewset.serializer_class(model_instance(model, document), context=context).data)
+
+
+def async_cached_response(*collections):
+    """Async counterpart of ``cache.cached_response`` sharing its keys and entries."""
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request):
+            if _wants_sync(request):
+                return await view(request)
+            key = response_key(request, await collection_versions(collections))
+            etag = f'W/"{key}"'
+            if etag_matches(request.headers.get('If-None-Match', ''), etag):
+                return HttpResponse(status=304, headers={'ETag': etag})
+            cache = get_cache()
+            data = cache.get(f'response:{key}')
+            if data is None:
+                response = await view(request)
+                if response.status_code != 200:
+                    return response
+                data = list(response.data) if isinstance(response.data, list) else dict(response.data)
+                cache.set(f'response:{key}', data, timeout=None)
+            return JSONDataResponse(data, headers={'ETag': etag})
+        return async_view(wrapper)
+    return decorator
+
+
+def _limit(request):
+    return int(request.GET.get('limit', 10))
+
+
+def _names(request, serializer_class):
+    """Model fields to load for the request's sparse fieldset, or ``None`` for all of them."""
+    return projected_fields(serializer_class(context={'request': request}))
+
+
+def _rows(request, serializer_class, model, documents):
+    serializer = serializer_class(model_instances(model, documents), many=True, context={'request': request})
+    return JSONDataResponse(serializer.data)
+
+
+SYNC_TOP = _action_view(LeaderboardViewSet, 'top')
+SYNC_BY_TEAM = _action_view(LeaderboardViewSet, 'by_team')
+SYNC_RECENT = _action_view(ActivityViewSet, 'recent')
+SYNC_BY_USER = _action_view(ActivityViewSet, 'by_user')
+
+
+@async_cached_response('leaderboard')
+async def leaderboard_top(request):
+    """Top N users from the leaderboard."""
+    if _wants_sync(request):
+        return await SYNC_TOP(request)
+    projection = model_projection(Leaderboard, _names(request, LeaderboardSerializer))
+    documents = await get_async_collection(Leaderboard).find({}, projection) \
+        .sort([('total_calories', DESCENDING), ('user_email', ASCENDING)]).limit(_limit(request)).to_list(None)
+    return _rows(request, LeaderboardSerializer, Leaderboard, documents)
+
+
+@async_cached_response('leaderboard')
+async def leaderboard_by_team(request):
+    """Leaderboard filtered by team."""
+    team = request.GET.get('team', None)
+    if _wants_sync(request) or not team:
+        return await SYNC_BY_TEAM(request)
+    projection = model_projection(Leaderboard, _names(request, LeaderboardSerializer))
+    documents = await get_async_collection(Leaderboard).find({'team': team}, projection) \
+        .sort([('total_calories', DESCENDING), ('user_email', ASCENDING)]).to_list(None)
+    return _rows(request, LeaderboardSerializer, Leaderboard, documents)
+
+
+@async_view
+async def activities_recent(request):
+    """Most recent activities across all users."""
+    if _wants_sync(request):
+        return await SYNC_RECENT(request)
+    projection = model_projection(Activity, _names(request, ActivitySerializer))
+    documents = await get_async_collection(Activity).find({}, projection) \
+        .sort([('date', DESCENDING), ('_id', ASCENDING)]).limit(_limit(request)).to_list(None)
+    return _rows(request, ActivitySerializer, Activity, documents)
+
+
+@async_view
+async def activities_by_user(request):
+    """All activities of one user, newest first."""
+    email = request.GET.get('email', None)
+    if _wants_sync(request) or not email:
+        return await SYNC_BY_USER(request)
+    projection = model_projection(Activity, _names(request, ActivitySerializer))
+    documents = await get_async_collection(Activity).find({'user_email': email}, projection) \
+        .sort('date', DESCENDING).to_list(None)
+    return _rows(request, ActivitySerializer, Activity, documents)
@@ -0,0 +1,94 @@
+"""
+Response caching for read-mostly endpoints.
+
+Cached responses are keyed by request path, query parameters and the current
+change version of every collection the endpoint reads (``versions.py``).
+Writes never delete entries; they bump the collection's version, which
+changes the key so stale entries are simply never looked up again and age
+out of the backend. Entries therefore need no TTL and are dropped exactly
+when the underlying documents change.
+
+The versions are the MongoDB counters every stamped write already bumps, so
+a write from any process (another worker, a management command, a raw
+pymongo script) retires this process's entries. Writes to collections that
+are not stamped, such as the leaderboard windows, call ``invalidate()``.
+
+The key also doubles as the response ``ETag``, so a poller that sends
+``If-None-Match`` gets a bodiless 304 without querying the collection.
+
+The entries live in the ``api`` entry of ``settings.CACHES``: the default
+locmem cache keeps them per process, a shared backend (file-based,
+memcached, redis) lets workers reuse each other's.
+"""
+import functools
+import hashlib
+
+from django.core.cache import caches
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .versions import collection_states, next_version, release
+
+CACHE_ALIAS = 'api'
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def collection_versions(collections):
+    """Current change version of each collection, read with one query."""
+    return [version for version, _, _ in collection_states(collections).values()]
+
+
+def collection_version(collection):
+    return collection_versions([collection])[0]
+
+
+def invalidate(*collections):
+    """Bump the version of each collection, retiring every response cached on it in every process."""
+    for collection in collections:
+        release(collection, next_version(collection))
+
+
+def response_key(request, versions):
+    """Digest identifying a response: endpoint, query parameters and data ``collection_versions()``."""
+    params = sorted((name, values) for name, values in request.GET.lists())
+    raw = f'{request.path}|{params}|{versions}'
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison of an ``If-None-Match`` header against ``etag``."""
+    tags = parse_etags(if_none_match)
+    return '*' in tags or any(tag.removeprefix('W/') == etag.removeprefix('W/') for tag in tags)
+
+
+def cached_response(*collections):
+    """
+    Cache a viewset action's successful responses until ``collections`` change.
+
+    Place it under ``@action``. Answers ``If-None-Match`` with 304 when the
+    client already holds the current version.
+    """
+    def decorator(view_method):
+        @functools.wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            key = response_key(request, collection_versions(collections))
+            etag = f'W/"{key}"'
+            if etag_matches(request.headers.get('If-None-Match', ''), etag):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+            cache = get_cache()
+            data = cache.get(f'response:{key}')
+            if data is None:
+                response = view_method(self, request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                # Drop the ReturnList/ReturnDict wrapper, which holds the serializer.
+                data = list(response.data) if isinstance(response.data, list) else dict(response.data)
+                cache.set(f'response:{key}', data, timeout=None)
+            return Response(data, headers={'ETag': etag})
+        return wrapper
+    return decorator
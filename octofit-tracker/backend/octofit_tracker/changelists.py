@@ -0,0 +1,130 @@
+"""
+Admin changelists that stay fast on large collections.
+
+Django's stock changelist counts the filtered and the unfiltered queryset,
+pages with OFFSET, offers "Show all", sorts by any clicked column, and
+lists the choices of a value filter with a DISTINCT over the whole
+collection. Through djongo each of those is a collection scan. A
+``LargeCollectionAdmin`` instead:
+
+* counts an unfiltered list with ``estimated_document_count()``, read from
+  collection metadata, and skips the separate total count;
+* pages by keyset on ``keyset_ordering`` (``?cursor=``, the same tokens as
+  the API's ``KeysetPagination``), so every page is an indexed range scan
+  however deep, and always orders by that key;
+* lists filter values through ``CachedValuesFilter``: one ``distinct`` on
+  the collection, cached for ``OCTOFIT_ADMIN_FACET_SECONDS``.
+
+Declare an index matching ``keyset_ordering`` in the model's ``Meta``.
+``list_editable`` is not supported, as the page is a list, not a queryset.
+"""
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+
+from .cache import get_cache
+from .mongo import get_collection
+from .pagination import Cursor, KeysetPagination
+
+CURSOR_VAR = 'cursor'
+
+
+def distinct_values(model, field):
+    """Sorted distinct values of ``field``, read with one ``distinct`` and cached for a while."""
+    key = f'admin-facets:{model._meta.db_table}:{field.column}'
+    cache = get_cache()
+    values = cache.get(key)
+    if values is None:
+        values = sorted(get_collection(model).distinct(field.column), key=lambda value: (value is None, value))
+        cache.set(key, values, settings.OCTOFIT_ADMIN_FACET_SECONDS)
+    return values
+
+
+class CachedValuesFilter(admin.AllValuesFieldListFilter):
+    """``AllValuesFieldListFilter`` with its choices from ``distinct_values()``; for fields of the model itself."""
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        super().__init__(field, request, params, model, model_admin, field_path)
+        # Replaces the parent's DISTINCT queryset before it is ever evaluated
+        self.lookup_choices = distinct_values(model, field)
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that counts an unfiltered queryset from collection metadata instead of a scan."""
+    estimated = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if queryset.query.where:
+            return super().count
+        self.estimated = True
+        return get_collection(queryset.model).estimated_document_count()
+
+
+class KeysetChangeList(ChangeList):
+    """Changelist paged by keyset on ``model_admin.keyset_ordering`` rather than by page number."""
+    keyset_paged = True
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # Changing a filter, the search or the page starts from a fresh cursor
+        return super().get_query_string(new_params, [*(remove or []), CURSOR_VAR])
+
+    def get_results(self, request):
+        keyset = KeysetPagination()
+        keyset.configure(self.model, self.model_admin.keyset_ordering)
+        keyset.page_size = self.list_per_page
+        try:
+            cursor = keyset.decode_token(request.GET.get(CURSOR_VAR))
+        except NotFound:
+            raise IncorrectLookupParameters
+        rows = keyset.page_of(self.queryset, cursor)
+
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.result_count = paginator.count
+        self.show_full_result_count = self.model_admin.show_full_result_count
+        if self.show_full_result_count:
+            self.full_result_count = EstimatedCountPaginator(self.root_queryset, self.list_per_page).count
+        else:
+            self.full_result_count = None
+        self.show_admin_actions = not self.show_full_result_count or bool(self.full_result_count)
+        self.result_list = rows
+        self.can_show_all = False
+        self.multi_page = keyset.has_next or keyset.has_previous
+        self.paginator = paginator
+
+        self.next_url = self.previous_url = None
+        if keyset.has_next and rows:
+            self.next_url = self.get_query_string({
+                CURSOR_VAR: keyset.encode_token(Cursor(keyset.row_keys(rows[-1]), reverse=False)),
+            })
+        if keyset.has_previous and rows:
+            self.previous_url = self.get_query_string({
+                CURSOR_VAR: keyset.encode_token(Cursor(keyset.row_keys(rows[0]), reverse=True)),
+            })
+        elif keyset.has_previous:
+            self.previous_url = self.get_query_string()
+
+
+class LargeCollectionAdmin(admin.ModelAdmin):
+    """``ModelAdmin`` for collections too large to count, scan or page by offset."""
+    keyset_ordering = ('_id',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # Only the keyset ordering is backed by an index
+    sortable_by = ()
+
+    def get_ordering(self, request):
+        return list(self.keyset_ordering)
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
@@ -0,0 +1,132 @@
+"""
+Per-collection change versions, for conditional GETs and delta polling.
+
+Each tracked collection has a counter document in ``change_versions``
+(``{_id: <collection>, version, modified, ...}``) that every write bumps
+atomically. Written documents carry the new value in ``change_version``
+and deletions leave a ``ChangeTombstone``. From that:
+
+* list and detail responses get an ``ETag`` and ``Last-Modified`` from the
+  counter (plus ``X-Change-Version``), and a client that already holds the
+  current version gets a 304 before any query runs;
+* ``?since_version=<n>`` on a list returns only the documents written and
+  the ids deleted after version ``n``, through the ``change_version``
+  index. The reported version is the watermark below any write still in
+  flight (see ``versions.py``) and is read before the changes, so a write
+  racing the request may be returned again on the next poll, never
+  skipped.
+
+The counters and stamping live in ``versions.py``. After a bulk reload
+(``versions.reset()``) deltas from older versions get a 410 and clients
+refetch the collection.
+"""
+import hashlib
+
+from django.utils.http import http_date, parse_http_date_safe
+from pymongo import ASCENDING
+from rest_framework import status
+from rest_framework.response import Response
+
+from .cache import etag_matches
+from .models import ChangeTombstone
+from .mongo import get_collection
+from .repositories import model_instances, model_projection
+from .versions import collection_state
+
+# Deltas larger than this are refused with a 410; refetching is cheaper
+MAX_DELTA_ROWS = 1000
+
+
+def changes_since(model, version, names=None):
+    """
+    ``(instances, deleted ids)`` written after ``version``, oldest first.
+
+    ``names`` limits the fields loaded, as for ``model_projection()``.
+    Returns ``None`` when there are more than ``MAX_DELTA_ROWS`` changes.
+    """
+    table = model._meta.db_table
+    newer = {'change_version': {'$gt': version}}
+    documents = list(get_collection(model).find(newer, model_projection(model, names))
+                     .sort('change_version', ASCENDING).limit(MAX_DELTA_ROWS + 1))
+    tombstones = list(get_collection(ChangeTombstone).find({'collection_name': table, **newer}, {'doc_id': 1})
+                      .sort('change_version', ASCENDING).limit(MAX_DELTA_ROWS + 1))
+    if len(documents) + len(tombstones) > MAX_DELTA_ROWS:
+        return None
+    return model_instances(model, documents), [tombstone['doc_id'] for tombstone in tombstones]
+
+
+def validators(request, state):
+    """``(etag, last_modified)`` for a response to ``request`` at a collection ``state``."""
+    version, modified, _ = state
+    params = sorted((name, values) for name, values in request.GET.lists())
+    digest = hashlib.sha1(f'{request.path}|{params}'.encode('utf-8')).hexdigest()[:16]
+    return f'W/"v{version}-{digest}"', modified
+
+
+def not_modified(request, etag, modified):
+    """Whether the client's conditional headers show it holds the current representation."""
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return since is not None and modified is not None and int(modified.timestamp()) <= since
+
+
+def set_validators(response, state, etag, modified):
+    response['ETag'] = etag
+    response['X-Change-Version'] = str(state[0])
+    if modified is not None:
+        response['Last-Modified'] = http_date(modified.timestamp())
+    return response
+
+
+class ChangeVersionMixin:
+    """Viewset mixin adding validators, 304s and ``?since_version=`` to list and retrieve."""
+
+    def list(self, request, *args, **kwargs):
+        state = self.change_state()
+        response = self.not_modified_response(request, state)
+        if response is None:
+            if 'since_version' in request.query_params:
+                response = self.changes(request, state)
+            else:
+                response = super().list(request, *args, **kwargs)
+        return self.with_validators(request, response, state)
+
+    def retrieve(self, request, *args, **kwargs):
+        state = self.change_state()
+        response = self.not_modified_response(request, state)
+        if response is None:
+            response = super().retrieve(request, *args, **kwargs)
+        return self.with_validators(request, response, state)
+
+    def change_state(self):
+        return collection_state(self.queryset.model._meta.db_table)
+
+    def not_modified_response(self, request, state):
+        if not_modified(request, *validators(request, state)):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        return None
+
+    def with_validators(self, request, response, state):
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            set_validators(response, state, *validators(request, state))
+        return response
+
+    def changes(self, request, state):
+        """What was written or deleted since ``?since_version=``."""
+        version, _, floor = state
+        try:
+            since = int(request.query_params['since_version'])
+        except ValueError:
+            return Response({'error': 'since_version must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        found = changes_since(self.queryset.model, since, self.sparse_fields()) if since >= floor else None
+        if found is None:
+            return Response({'error': 'since_version is too old or too far behind; refetch the collection',
+                             'version': version}, status=status.HTTP_410_GONE)
+        instances, deleted = found
+        return Response({
+            'version': version,
+            'changed': self.get_serializer(instances, many=True).data,
+            'deleted': deleted,
+        })
@@ -0,0 +1,80 @@
+"""
+Streaming exports of the activities collection.
+
+Rows come from a server-side pymongo cursor and are encoded and yielded a
+batch at a time, so memory stays flat regardless of export size and the
+first bytes go out as soon as the first batch arrives. Archived activities
+(``archive.py``) are merged in by date from their memory-mapped columns.
+Rows carry the same keys and value formats as ``ActivitySerializer``.
+"""
+import csv
+import heapq
+import io
+import json
+
+from pymongo import ASCENDING
+
+from .archive import archived_documents
+from .models import Activity
+from .mongo import get_collection
+from .serializers import ActivitySerializer, datetime_conversion
+
+EXPORT_FIELDS = ActivitySerializer.Meta.fields
+BATCH_SIZE = 1000
+
+
+def activity_rows(since=None, user_email=None, batch_size=BATCH_SIZE):
+    """Yield activities as serializer-shaped dicts, oldest first."""
+    query = {}
+    if since is not None:
+        query['date'] = {'$gte': since}
+    if user_email:
+        query['user_email'] = user_email
+    projection = {field: 1 for field in EXPORT_FIELDS if field != 'id'}
+    format_date = datetime_conversion(ActivitySerializer().fields['date'])
+
+    cursor = get_collection(Activity).find(query, projection).sort('date', ASCENDING).batch_size(batch_size)
+    for doc in heapq.merge(archived_documents(since, user_email), cursor, key=lambda doc: doc['date']):
+        date = doc.get('date')
+        yield {
+            'id': str(doc['_id']),
+            'user_email': doc.get('user_email'),
+            'activity_type': doc.get('activity_type'),
+            'duration_minutes': doc.get('duration_minutes'),
+            'calories_burned': doc.get('calories_burned'),
+            'distance_km': doc.get('distance_km'),
+            'date': format_date(date) if date is not None else None,
+            'notes': doc.get('notes'),
+        }
+
+
+def _batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ndjson_stream(rows, batch_size=BATCH_SIZE):
+    """Encode rows as NDJSON, one chunk per batch."""
+    encoder = json.JSONEncoder(separators=(',', ':'))
+    for batch in _batches(rows, batch_size):
+        yield ''.join(encoder.encode(row) + '\n' for row in batch)
+
+
+def csv_stream(rows, batch_size=BATCH_SIZE):
+    """Encode rows as CSV with a header, one chunk per batch."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for batch in _batches(rows, batch_size):
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,96 @@
+"""
+Sparse fieldsets: ``?fields=`` and ``?omit=`` on every endpoint.
+
+``?fields=id,name`` keeps only the listed keys of each serialized object and
+``?omit=notes`` drops keys; both take comma-separated field names and
+unknown names are ignored. Only the output is affected, so writes still
+validate every field.
+
+The selection is also pushed down into the query: ``projected_fields()``
+names the model fields the remaining serializer fields read, for
+``QuerySet.only()`` or a raw Mongo projection, so unused fields are never
+read from MongoDB nor decoded from BSON.
+"""
+from rest_framework.permissions import SAFE_METHODS
+
+
+def parse_fieldset(params):
+    """``(fields, omit)`` from query parameters, each a set of names or ``None``."""
+    def names(key):
+        value = params.get(key)
+        if value is None:
+            return None
+        return {name.strip() for name in value.split(',') if name.strip()}
+    return names('fields'), names('omit')
+
+
+class SparseFieldsMixin:
+    """
+    Serializer mixin limiting output to a sparse fieldset.
+
+    The fieldset comes from ``fields``/``omit`` keyword arguments or else from
+    the query of ``context['request']``. With ``many=True`` the arguments
+    reach the child serializer, whose ``_readable_fields`` the list
+    serializer renders.
+    """
+
+    def __init__(self, *args, fields=None, omit=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is None and omit is None:
+            request = self.context.get('request')
+            if request is not None:
+                fields, omit = parse_fieldset(request.GET)
+        self.fieldset = (fields, omit)
+
+    @property
+    def sparse(self):
+        return self.fieldset != (None, None)
+
+    @property
+    def _readable_fields(self):
+        fields, omit = self.fieldset
+        for field in super()._readable_fields:
+            if fields is not None and field.field_name not in fields:
+                continue
+            if omit is not None and field.field_name in omit:
+                continue
+            yield field
+
+
+def projected_fields(serializer, always=()):
+    """
+    Model field names read by a serializer's selected fields, for ``only()``.
+
+    ``always`` adds fields the caller needs regardless (e.g. the keyset
+    ordering, which cursors are built from); the primary key is always
+    included. Returns ``None`` when there is no sparse fieldset or a
+    selected field does not map onto a single model field.
+    """
+    serializer = getattr(serializer, 'child', serializer)
+    if not getattr(serializer, 'sparse', False):
+        return None
+    opts = serializer.Meta.model._meta
+    concrete = {field.name for field in opts.concrete_fields}
+    names = {opts.pk.name}
+    for field in serializer._readable_fields:
+        if field.source == '*' or field.source_attrs[0] not in concrete:
+            return None
+        names.add(field.source_attrs[0])
+    names.update(name.lstrip('-') for name in always)
+    return sorted(names)
+
+
+class SparseFieldsViewMixin:
+    """Viewset mixin pushing the requested fieldset down into read querysets."""
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method in SAFE_METHODS:
+            names = self.sparse_fields()
+            if names is not None:
+                queryset = queryset.only(*names)
+        return queryset
+
+    def sparse_fields(self):
+        """Model fields to load for this request's fieldset, or ``None`` for all of them."""
+        return projected_fields(self.get_serializer(), getattr(self, 'keyset_ordering', ()))
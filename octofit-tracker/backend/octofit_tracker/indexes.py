@@ -0,0 +1,88 @@
+"""
+MongoDB index management for the octofit_tracker models.
+
+Indexes are declared the Django way, in each model's ``Meta.indexes`` (plus
+``unique=True`` fields and ``UniqueConstraint``s, and the indexes a storage
+layout needs, see storage.py), and reconciled against the live collections with
+pymongo. Key specs are compared rather than names, so indexes djongo already
+created under its own names are recognised instead of duplicated.
+"""
+from django.apps import apps
+from django.db.models import UniqueConstraint
+from pymongo import ASCENDING, DESCENDING
+
+from .mongo import get_collection
+from .storage import storage_indexes
+
+
+def declared_indexes(model):
+    """Return ``[(name, keys, unique)]`` for every index a model declares."""
+    opts = model._meta
+    declared = []
+    for field in opts.local_fields:
+        if field.unique and not field.primary_key:
+            declared.append((f'{opts.db_table}_{field.column}_uniq', [(field.column, ASCENDING)], True))
+    for index in opts.indexes:
+        keys = []
+        for name in index.fields:
+            direction = DESCENDING if name.startswith('-') else ASCENDING
+            keys.append((opts.get_field(name.lstrip('-')).column, direction))
+        declared.append((index.name, keys, False))
+    for constraint in opts.constraints:
+        if isinstance(constraint, UniqueConstraint) and constraint.fields and constraint.condition is None:
+            keys = [(opts.get_field(name).column, ASCENDING) for name in constraint.fields]
+            declared.append((constraint.name, keys, True))
+    return declared
+
+
+def _key_spec(info):
+    return [(name, int(direction)) for name, direction in info['key']]
+
+
+def ensure_indexes(model, dry_run=False):
+    """
+    Create or reconcile a model's declared indexes; safe to run repeatedly.
+
+    Returns a report dict with the ``created``, ``rebuilt``, ``present`` and
+    ``undeclared`` index names and the ``unused`` ones (zero accesses since
+    the server started, according to ``$indexStats``).
+    """
+    collection = get_collection(model)
+    existing = collection.index_information()
+    report = {'created': [], 'rebuilt': [], 'present': [], 'undeclared': [], 'unused': []}
+
+    matched = {'_id_'}
+    for name, keys, unique in declared_indexes(model) + storage_indexes(model):
+        same_keys = [
+            existing_name for existing_name, info in existing.items()
+            if _key_spec(info) == keys and bool(info.get('unique')) == unique
+        ]
+        if same_keys:
+            matched.update(same_keys)
+            report['present'].append(same_keys[0])
+            continue
+        if name in existing:
+            report['rebuilt'].append(name)
+            if not dry_run:
+                collection.drop_index(name)
+        else:
+            report['created'].append(name)
+        matched.add(name)
+        if not dry_run:
+            collection.create_index(keys, name=name, unique=unique, background=True)
+
+    report['undeclared'] = sorted(set(existing) - matched)
+    for stats in collection.aggregate([{'$indexStats': {}}]):
+        fresh = stats['name'] in report['created'] or stats['name'] in report['rebuilt']
+        if stats['name'] != '_id_' and not fresh and stats['accesses']['ops'] == 0:
+            report['unused'].append(stats['name'])
+    report['unused'].sort()
+    return report
+
+
+def ensure_all_indexes(dry_run=False):
+    """Run ``ensure_indexes`` for every octofit_tracker model, keyed by table."""
+    return {
+        model._meta.db_table: ensure_indexes(model, dry_run=dry_run)
+        for model in apps.get_app_config('octofit_tracker').get_models()
+    }
@@ -0,0 +1,163 @@
+"""
+Bulk ingestion of activities from device syncs.
+
+A batch is validated in one pass with a single ``ActivitySerializer``,
+written with one unordered ``insert_many``, folded into the leaderboard
+with one delta per user and into the rollups with one ``bulk_write``. Each
+item gets its own result, so one bad record does not fail the rest of the
+sync.
+
+Idempotency: an item may carry an ``idempotency_key``. Its ``_id`` is then
+derived from the key instead of being random: the activity date's timestamp
+followed by a hash of ``(user_email, key)``. A retried sync resends the same
+activities, produces the same ``_id``s and hits the primary-key index, so
+duplicates are rejected atomically by MongoDB with no extra collection or
+index. Those items come back as ``duplicate`` with the id of the stored
+activity. A time-series collection has no unique ``_id`` index (see
+storage.py), so there keyed ids are looked up before the insert instead;
+that check is not atomic, and two concurrent replays may both be stored.
+"""
+import hashlib
+from collections import defaultdict
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+from rest_framework.exceptions import ValidationError
+
+from .leaderboard import apply_delta, record_dated_activities
+from .models import Activity
+from .mongo import get_collection
+from .references import user_ids
+from .serializers import ActivitySerializer
+from .storage import is_timeseries
+from .versions import next_version, writing
+
+MAX_BATCH_SIZE = 10000
+IDEMPOTENCY_KEY_MAX_LENGTH = 200
+DUPLICATE_KEY_ERROR = 11000
+
+
+def idempotent_id(user_email, date, key):
+    """Deterministic ObjectId for an activity submitted with an idempotency key."""
+    digest = hashlib.sha1(f'{user_email}\0{key}'.encode('utf-8')).digest()
+    timestamp = int(date.timestamp()) & 0xFFFFFFFF
+    return ObjectId(timestamp.to_bytes(4, 'big') + digest[:8])
+
+
+def _split_key(item):
+    """Separate the idempotency key from an item; returns ``(item, key, error)``."""
+    if not isinstance(item, dict) or 'idempotency_key' not in item:
+        return item, None, None
+    item = dict(item)
+    key = item.pop('idempotency_key')
+    if key is None:
+        return item, None, None
+    if not isinstance(key, str) or not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        return item, None, {'idempotency_key': [
+            f'Must be a non-empty string of at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters.']}
+    return item, key, None
+
+
+def _skip_replays(documents, positions, keyed, results):
+    """Mark keyed documents already stored, or repeated in the batch, as duplicates; returns the rest."""
+    ids = [document['_id'] for document, index in zip(documents, positions) if keyed[index]]
+    stored = get_collection(Activity).find({'_id': {'$in': ids}}, {'_id': 1}) if ids else []
+    seen = {document['_id'] for document in stored}
+    kept_documents, kept_positions = [], []
+    for document, index in zip(documents, positions):
+        if document['_id'] in seen:
+            results[index] = {'index': index, 'status': 'duplicate', 'id': str(document['_id'])}
+            continue
+        if keyed[index]:
+            seen.add(document['_id'])
+        kept_documents.append(document)
+        kept_positions.append(index)
+    return kept_documents, kept_positions
+
+
+def ingest_activities(items):
+    """
+    Validate and insert a batch of activity payloads.
+
+    Returns one result dict per input item, in input order, with a
+    ``status`` of ``created``, ``duplicate`` or ``invalid``, plus the
+    activity ``id`` or the validation ``errors``.
+    """
+    results = [None] * len(items)
+    payloads, keys = [], []
+    for index, item in enumerate(items):
+        payload, key, key_error = _split_key(item)
+        if key_error:
+            results[index] = {'index': index, 'status': 'invalid', 'errors': key_error}
+        payloads.append(payload)
+        keys.append(key)
+
+    # Validate item by item with one serializer instance: a many=True
+    # ListSerializer would discard every item's validated data if any failed.
+    serializer = ActivitySerializer()
+    documents, positions = [], []
+    for index, payload in enumerate(payloads):
+        if results[index] is not None:
+            continue
+        try:
+            validated = serializer.run_validation(payload)
+        except ValidationError as exc:
+            results[index] = {'index': index, 'status': 'invalid', 'errors': exc.detail}
+            continue
+        document = {
+            'user_email': validated['user_email'],
+            'activity_type': validated['activity_type'],
+            'duration_minutes': validated['duration_minutes'],
+            'calories_burned': validated['calories_burned'],
+            'distance_km': validated.get('distance_km'),
+            'date': validated['date'],
+            'notes': validated.get('notes', ''),
+        }
+        if keys[index]:
+            document['_id'] = idempotent_id(document['user_email'], document['date'], keys[index])
+        else:
+            document['_id'] = ObjectId()
+        documents.append(document)
+        positions.append(index)
+
+    if documents and is_timeseries(Activity):
+        documents, positions = _skip_replays(documents, positions, keys, results)
+
+    failed = {}
+    if documents:
+        references = user_ids({document['user_email'] for document in documents})
+        with writing():
+            version = next_version(Activity._meta.db_table)
+            for document in documents:
+                document['change_version'] = version
+                document['user_id'] = references.get(document['user_email'])
+            try:
+                get_collection(Activity).insert_many(documents, ordered=False)
+            except BulkWriteError as exc:
+                failed = {error['index']: error for error in exc.details.get('writeErrors', [])}
+
+    deltas = defaultdict(lambda: [0, 0, 0.0])
+    created = []
+    for offset, (index, document) in enumerate(zip(positions, documents)):
+        error = failed.get(offset)
+        if error is None:
+            results[index] = {'index': index, 'status': 'created', 'id': str(document['_id'])}
+            delta = deltas[document['user_email']]
+            delta[0] += 1
+            delta[1] += document['calories_burned']
+            delta[2] += document['distance_km'] or 0.0
+            created.append(document)
+        elif error.get('code') == DUPLICATE_KEY_ERROR:
+            results[index] = {'index': index, 'status': 'duplicate', 'id': str(document['_id'])}
+        else:
+            results[index] = {'index': index, 'status': 'invalid',
+                              'errors': {'non_field_errors': [error.get('errmsg', 'Write failed.')]}}
+
+    for user_email, (activities, calories, distance) in deltas.items():
+        apply_delta(user_email, activities=activities, calories=calories, distance=distance)
+    record_dated_activities(
+        (document['user_email'], document['date'], 1, document['calories_burned'],
+         document['distance_km'] or 0.0, document['duration_minutes'])
+        for document in created
+    )
+    return results
@@ -0,0 +1,288 @@
+"""
+Per-request timing and query instrumentation.
+
+``InstrumentationMiddleware`` breaks each sampled request into phases:
+
+* ``orm``: djongo query execution (SQL translation plus the Mongo round
+  trips it makes inside ``execute``), with the query count;
+* ``mongo``: time spent in MongoDB commands from any path, ORM or raw
+  pymongo, measured by a pymongo ``CommandListener``;
+* ``serialize``: serializer ``to_representation`` time;
+* ``render``: response rendering;
+* ``total``: the whole request.
+
+The phases go out as a ``Server-Timing`` header and as one JSON log line on
+the ``octofit_tracker.instrumentation`` logger. Every request, sampled or
+not, also feeds the in-process Prometheus histograms served at
+``/api/_metrics``, labelled by viewset action. ``OCTOFIT_INSTRUMENTATION_SAMPLE_RATE``
+(0.0-1.0, default 0.01) sets the share of requests that get the detailed
+breakdown; raise it while investigating.
+Metrics are per process; scrape each worker.
+"""
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from pymongo import monitoring
+
+logger = logging.getLogger('octofit_tracker.instrumentation')
+
+_current = ContextVar('octofit_request_metrics', default=None)
+
+# Share of requests sampled when settings do not say otherwise
+DEFAULT_SAMPLE_RATE = 0.01
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class RequestMetrics:
+    """Phase timings collected while one sampled request is being handled."""
+
+    def __init__(self):
+        self.orm_queries = 0
+        self.orm_seconds = 0.0
+        self.mongo_commands = 0
+        self.mongo_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.render_seconds = 0.0
+        self.render_started = None
+        self.depth = {}
+
+
+@contextmanager
+def timed(phase):
+    """Add the time spent in the block to the current request's ``phase``; nesting counts once."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    depth = metrics.depth.get(phase, 0)
+    metrics.depth[phase] = depth + 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.depth[phase] = depth
+        if depth == 0:
+            attribute = f'{phase}_seconds'
+            setattr(metrics, attribute, getattr(metrics, attribute) + time.perf_counter() - started)
+
+
+class MongoTimingListener(monitoring.CommandListener):
+    """Adds every MongoDB command's duration to the current request's metrics."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+    def _record(self, event):
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.mongo_commands += 1
+            metrics.mongo_seconds += event.duration_micros / 1e6
+
+
+_installed = False
+
+
+def install():
+    """Register the pymongo listener; must run before any ``MongoClient`` is created."""
+    global _installed
+    if not _installed:
+        monitoring.register(MongoTimingListener())
+        _installed = True
+
+
+def _orm_wrapper(execute, sql, params, many, context):
+    metrics = _current.get()
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.orm_queries += 1
+        metrics.orm_seconds += time.perf_counter() - started
+
+
+class Histogram:
+    """Cumulative Prometheus-style histogram keyed by label value."""
+
+    def __init__(self, name, help_text, buckets, label='view'):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.label = label
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        with self.lock:
+            counts, total = self.series.get(label_value, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self.series[label_value] = (counts, total + value)
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            series = {label: (list(counts), total) for label, (counts, total) in self.series.items()}
+        for label_value, (counts, total) in sorted(series.items()):
+            label = f'{self.label}="{label_value}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label}}} {total}')
+            lines.append(f'{self.name}_count{{{label}}} {cumulative}')
+        return lines
+
+
+REQUEST_SECONDS = Histogram('octofit_request_duration_seconds', 'Request handling time by view action.', BUCKETS)
+ORM_QUERIES = Histogram('octofit_request_orm_queries', 'djongo queries per sampled request.', QUERY_BUCKETS)
+ORM_SECONDS = Histogram('octofit_request_orm_seconds', 'djongo query time per sampled request.', BUCKETS)
+MONGO_SECONDS = Histogram('octofit_request_mongo_seconds', 'MongoDB command time per sampled request.', BUCKETS)
+SERIALIZE_SECONDS = Histogram('octofit_request_serialize_seconds', 'Serializer time per sampled request.', BUCKETS)
+RENDER_SECONDS = Histogram('octofit_request_render_seconds', 'Rendering time per sampled request.', BUCKETS)
+HISTOGRAMS = [REQUEST_SECONDS, ORM_QUERIES, ORM_SECONDS, MONGO_SECONDS, SERIALIZE_SECONDS, RENDER_SECONDS]
+
+
+def view_label(request):
+    """``ViewSet.action`` for viewset routes, the URL name otherwise."""
+    view_func = getattr(request, '_instrumented_view', None)
+    cls = getattr(view_func, 'cls', None)
+    actions = getattr(view_func, 'actions', None)
+    if cls is not None and actions:
+        return f'{cls.__name__}.{actions.get(request.method.lower(), request.method.lower())}'
+    match = getattr(request, 'resolver_match', None)
+    if match is not None and match.url_name:
+        return match.url_name
+    return 'unresolved'
+
+
+class InstrumentationMiddleware:
+    """
+    Measures request phases; list it last in ``MIDDLEWARE`` so that the
+    render phase (between ``process_template_response`` and the response
+    leaving the view layer) is not padded by other middleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'OCTOFIT_INSTRUMENTATION_SAMPLE_RATE', DEFAULT_SAMPLE_RATE)
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Stay on the event loop under ASGI instead of costing a thread per request
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        install()
+
+    def sampled(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        if not self.sampled():
+            response = self.get_response(request)
+            REQUEST_SECONDS.observe(view_label(request), time.perf_counter() - started)
+            return response
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            with connections['default'].execute_wrapper(_orm_wrapper):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.record(request, response, metrics, started)
+
+    async def __acall__(self, request):
+        """
+        ASGI path. ORM queries run on another thread's connection here, so the
+        ``orm`` phase stays empty, and Motor's commands run outside the
+        request context; ``mongo`` only covers views delegated to sync code.
+        """
+        started = time.perf_counter()
+        if not self.sampled():
+            response = await self.get_response(request)
+            REQUEST_SECONDS.observe(view_label(request), time.perf_counter() - started)
+            return response
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.record(request, response, metrics, started)
+
+    def record(self, request, response, metrics, started):
+        """Publish a sampled request's phases to the histograms, header and log."""
+        finished = time.perf_counter()
+        if metrics.render_started is not None:
+            metrics.render_seconds = finished - metrics.render_started
+        total = finished - started
+
+        label = view_label(request)
+        REQUEST_SECONDS.observe(label, total)
+        ORM_QUERIES.observe(label, metrics.orm_queries)
+        ORM_SECONDS.observe(label, metrics.orm_seconds)
+        MONGO_SECONDS.observe(label, metrics.mongo_seconds)
+        SERIALIZE_SECONDS.observe(label, metrics.serialize_seconds)
+        RENDER_SECONDS.observe(label, metrics.render_seconds)
+
+        response['Server-Timing'] = ', '.join([
+            f'orm;dur={metrics.orm_seconds * 1000:.2f};desc="{metrics.orm_queries} queries"',
+            f'mongo;dur={metrics.mongo_seconds * 1000:.2f};desc="{metrics.mongo_commands} commands"',
+            f'serialize;dur={metrics.serialize_seconds * 1000:.2f}',
+            f'render;dur={metrics.render_seconds * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}',
+        ])
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'view': label,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 3),
+            'orm_queries': metrics.orm_queries,
+            'orm_ms': round(metrics.orm_seconds * 1000, 3),
+            'mongo_commands': metrics.mongo_commands,
+            'mongo_ms': round(metrics.mongo_seconds * 1000, 3),
+            'serialize_ms': round(metrics.serialize_seconds * 1000, 3),
+            'render_ms': round(metrics.render_seconds * 1000, 3),
+        }))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._instrumented_view = view_func
+
+    def process_template_response(self, request, response):
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.render_started = time.perf_counter()
+        return response
+
+
+def metrics_view(request):
+    """Prometheus text exposition of the instrumentation histograms."""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.exposition())
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
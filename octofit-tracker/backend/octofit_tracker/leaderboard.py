@@ -0,0 +1,221 @@
+"""
+Incremental maintenance of the leaderboard collection.
+
+Leaderboard rows are ordered by ``-total_calories`` with ``user_email`` as a
+tie-breaker, and ``rank`` is the 1-based position in that order. Every
+activity write is folded in as a delta: the owner's totals move with one
+atomic ``$inc`` and only the rows the owner overtakes (or falls behind) get
+their rank shifted (see ``ranking.py``), so the cost of a write does not
+depend on how much activity history exists. The same delta is folded into
+the owner's team aggregates (``teams.py``), and the activity itself into the
+time-bucketed rollups (``rollups.py``) and windowed leaderboards
+(``windows.py``).
+
+``rebuild_leaderboard()`` recomputes the collection from scratch (or for the
+users touched since a timestamp) with one server-side aggregation over the
+activities and the archived daily totals (``archive.py``), for seeding and
+for repairing drift, then recomputes the team aggregates.
+"""
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from .archive import union_stage
+from .cache import invalidate
+from .models import Activity, Leaderboard, User
+from .mongo import get_collection
+from .ranking import rank_stage, rerank, shift_ranks, slot_in
+from .rollups import record_activities
+from .teams import rebuild_team_stats, team_delta
+from .versions import next_version, reset, stamped, version_stages, writes
+from .windows import record_window_activities
+
+
+def activity_totals(activity):
+    """Return the fields of an activity that contribute to the leaderboard and rollups."""
+    return (activity.user_email, activity.calories_burned or 0, activity.distance_km or 0.0,
+            activity.date, activity.duration_minutes or 0)
+
+
+def activity_created(activity):
+    """Fold a newly created activity into its owner's totals."""
+    email, calories, distance, date, duration = activity_totals(activity)
+    apply_delta(email, activities=1, calories=calories, distance=distance)
+    record_dated_activities([(email, date, 1, calories, distance, duration)])
+
+
+def activity_updated(previous, current):
+    """Fold an edit into the totals given before/after ``activity_totals()`` tuples."""
+    old_email, old_calories, old_distance, old_date, old_duration = previous
+    new_email, new_calories, new_distance, new_date, new_duration = current
+    if old_email != new_email:
+        apply_delta(old_email, activities=-1, calories=-old_calories, distance=-old_distance)
+        apply_delta(new_email, activities=1, calories=new_calories, distance=new_distance)
+    else:
+        apply_delta(new_email, calories=new_calories - old_calories,
+                    distance=new_distance - old_distance)
+    record_dated_activities([
+        (old_email, old_date, -1, -old_calories, -old_distance, -old_duration),
+        (new_email, new_date, 1, new_calories, new_distance, new_duration),
+    ])
+
+
+def activity_deleted(previous):
+    """Remove a deleted activity's ``activity_totals()`` from its owner's totals."""
+    email, calories, distance, date, duration = previous
+    apply_delta(email, activities=-1, calories=-calories, distance=-distance)
+    record_dated_activities([(email, date, -1, -calories, -distance, -duration)])
+
+
+def record_dated_activities(entries):
+    """Fold dated activity deltas into the rollups and the windowed leaderboards."""
+    entries = list(entries)
+    # Windows first: rolling them forward may rebuild them from the rollups,
+    # which must not already hold these deltas.
+    record_window_activities(entries)
+    record_activities(entries)
+
+
+@writes
+def apply_delta(user_email, activities=0, calories=0, distance=0.0):
+    """
+    Apply a delta to one user's leaderboard totals and fix up ranks.
+
+    Creates the user's row on first use and folds the same delta into the
+    user's team aggregates. Returns nothing; ranks of rows that did not
+    change position are left untouched.
+    """
+    if not (activities or calories or distance):
+        return
+    team = _apply_delta(user_email, activities, calories, distance)
+    invalidate('leaderboard')
+    team_delta(team, calories=calories, distance=distance)
+
+
+def _apply_delta(user_email, activities, calories, distance):
+    """Returns the team the user's row is counted under."""
+    leaderboard = get_collection(Leaderboard)
+    before = leaderboard.find_one_and_update(
+        {'user_email': user_email},
+        stamped(leaderboard.name, {'$inc': {
+            'total_activities': activities,
+            'total_calories': calories,
+            'total_distance': distance,
+        }}),
+        projection={'total_calories': 1, 'team': 1},
+        return_document=ReturnDocument.BEFORE,
+    )
+    if before is None:
+        return _insert_entry(leaderboard, user_email, activities, calories, distance)
+
+    old_calories = before['total_calories']
+    shift_ranks(leaderboard, before['_id'], 'user_email', user_email, old_calories, old_calories + calories)
+    return before.get('team', '')
+
+
+def _insert_entry(leaderboard, user_email, activities, calories, distance):
+    """Insert a first leaderboard row for a user and slot it into the ranking."""
+    user = get_collection(User).find_one({'email': user_email}, {'name': 1, 'team': 1}) or {}
+    entry = {
+        'user_email': user_email,
+        'user_name': user.get('name', user_email),
+        'team': user.get('team', ''),
+        'total_activities': activities,
+        'total_calories': calories,
+        'total_distance': distance,
+        'rank': 0,
+        'change_version': next_version(leaderboard.name),
+    }
+    try:
+        leaderboard.insert_one(entry)
+    except DuplicateKeyError:
+        # Another writer created the row first; fold into it instead.
+        return _apply_delta(user_email, activities, calories, distance)
+    slot_in(leaderboard, entry['_id'], 'user_email', user_email, calories)
+    return entry['team']
+
+
+def _totals_pipeline(match=None):
+    """Aggregation stages that turn activities, archived ones included, into leaderboard rows (unranked)."""
+    users = User._meta.db_table
+    stages = [{'$match': match}] if match else []
+    stages += [
+        union_stage(match),
+        {'$group': {
+            '_id': '$user_email',
+            # Archived days carry their activity count, activities count once
+            'total_activities': {'$sum': {'$ifNull': ['$activities', 1]}},
+            'total_calories': {'$sum': '$calories_burned'},
+            'total_distance': {'$sum': {'$ifNull': ['$distance_km', 0]}},
+        }},
+        {'$lookup': {
+            'from': users,
+            'localField': '_id',
+            'foreignField': 'email',
+            'pipeline': [{'$project': {'_id': 0, 'name': 1, 'team': 1}}],
+            'as': 'user',
+        }},
+        {'$set': {'user': {'$ifNull': [{'$arrayElemAt': ['$user', 0]}, {}]}}},
+        {'$project': {
+            '_id': 0,
+            'user_email': '$_id',
+            'user_name': {'$ifNull': ['$user.name', '$_id']},
+            'team': {'$ifNull': ['$user.team', '']},
+            'total_activities': 1,
+            'total_calories': 1,
+            'total_distance': {'$round': ['$total_distance', 2]},
+        }},
+    ]
+    return stages
+
+
+@writes
+def rebuild_leaderboard(since=None):
+    """
+    Recompute leaderboard rows from the activities collection on the server.
+
+    With no ``since`` the whole collection is replaced by a single
+    ``$group``/``$lookup``/``$setWindowFields``/``$out`` pipeline. With a
+    ``since`` datetime only users with activities dated or inserted after it
+    are recomputed and ``$merge``d in, followed by a rank-only pass over the
+    leaderboard itself. Returns the number of leaderboard rows rewritten.
+    """
+    db_leaderboard = get_collection(Leaderboard)
+    activities = get_collection(Activity)
+
+    if since is None:
+        activities.aggregate(_totals_pipeline() + [
+            rank_stage('user_email'),
+            {'$out': db_leaderboard.name},
+        ], allowDiskUse=True)
+        # $out replaced every row without tombstones: pollers must refetch
+        reset(db_leaderboard.name)
+        invalidate('leaderboard')
+        rebuild_team_stats()
+        return db_leaderboard.estimated_document_count()
+
+    touched = activities.distinct('user_email', {'$or': [
+        {'date': {'$gte': since}},
+        {'_id': {'$gte': ObjectId.from_datetime(since)}},
+    ]})
+    if not touched:
+        return 0
+    stages = _totals_pipeline({'user_email': {'$in': touched}}) + version_stages(db_leaderboard.name)
+    activities.aggregate(stages + [
+        {'$merge': {
+            'into': db_leaderboard.name,
+            'on': 'user_email',
+            'whenMatched': 'merge',
+            'whenNotMatched': 'insert',
+        }},
+    ], allowDiskUse=True)
+    rerank_leaderboard()
+    rebuild_team_stats()
+    return len(touched)
+
+
+@writes
+def rerank_leaderboard():
+    """Renumber ``rank`` across the leaderboard in one server-side pass."""
+    rerank(get_collection(Leaderboard), 'user_email')
+    invalidate('leaderboard')
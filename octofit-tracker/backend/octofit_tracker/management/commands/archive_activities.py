@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date, parse_datetime
+from octofit_tracker.archive import archive_activities, archive_root
+from datetime import datetime, timedelta, timezone
+import re
+import time
+
+
+class Command(BaseCommand):
+    help = 'Move activities older than a cutoff from MongoDB into the column-file archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than',
+            required=True,
+            help='Age such as 365d, or an ISO date or timestamp; activities dated before it are archived',
+        )
+        parser.add_argument('--batch-size', type=int, default=50000, help='Most activities per archive chunk')
+
+    def handle(self, *args, **options):
+        cutoff = self.parse_cutoff(options['older_than'])
+        self.stdout.write(f'Archiving activities dated before {cutoff.isoformat()} into {archive_root()}...')
+        started = time.perf_counter()
+        result = archive_activities(cutoff, batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        
+        if result['resumed']:
+            self.stdout.write(f"Completed {result['resumed']} chunks left pending by an interrupted run")
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['archived']} activities archived in {result['chunks']} chunks in {elapsed:.2f}s"))
+
+    def parse_cutoff(self, value):
+        match = re.fullmatch(r'(\d+)d', value)
+        if match:
+            return datetime.now(timezone.utc) - timedelta(days=int(match.group(1)))
+        day = parse_date(value)
+        moment = datetime.combine(day, datetime.min.time()) if day else parse_datetime(value)
+        if moment is None:
+            raise CommandError(f'Invalid --older-than value: {value}')
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        return moment
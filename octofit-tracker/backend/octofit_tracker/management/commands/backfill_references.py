@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.references import backfill_references
+import time
+
+
+class Command(BaseCommand):
+    help = 'Set the user and team ObjectId references from the email and team-name copies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Updates per bulk write')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Backfilling user and team references...')
+        started = time.perf_counter()
+        updated = backfill_references(batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        
+        self.stdout.write(self.style.SUCCESS(
+            f"{updated['users']} users and {updated['activities']} activities updated in {elapsed:.2f}s"))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from octofit_tracker.rollups import rebuild_rollups
+from octofit_tracker.windows import rebuild_windows
+from datetime import timezone
+import time
+
+
+class Command(BaseCommand):
+    help = 'Build the activity rollups and windowed leaderboards from activity history'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            help='Only rebuild buckets from the one containing this ISO timestamp onwards',
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError(f"Invalid --since timestamp: {options['since']}")
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+        
+        self.stdout.write('Backfilling activity rollups...')
+        started = time.perf_counter()
+        rows = rebuild_rollups(since=since)
+        # Windowed leaderboards are derived from the rollups
+        windows = rebuild_windows()
+        elapsed = time.perf_counter() - started
+        
+        self.stdout.write(self.style.SUCCESS(
+            f'{rows} rollup buckets and {windows} window rows in place after {elapsed:.2f}s'))
@@ -0,0 +1,97 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from bson import ObjectId
+from octofit_tracker import synthetic
+from octofit_tracker.indexes import declared_indexes
+from octofit_tracker.models import Activity
+from octofit_tracker.mongo import get_db
+from octofit_tracker.storage import (LAYOUTS, PLAIN, TIMESERIES, create_collection, server_supports_timeseries,
+                                     storage_indexes)
+from datetime import timedelta
+import random
+import statistics
+import time
+
+
+class Command(BaseCommand):
+    help = ('Compare storage size, insert throughput and query latency of the plain and time-series activity '
+            'layouts on scratch collections loaded with the same synthetic activities')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=500, help='Synthetic users')
+        parser.add_argument('--activities-per-user', type=int, default=200, help='Synthetic activities per user')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic activities')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Documents per insert_many batch')
+        parser.add_argument('--queries', type=int, default=200, help='Timed queries per query shape')
+        parser.add_argument('--keep', action='store_true', help='Keep the scratch collections afterwards')
+
+    def handle(self, *args, **options):
+        if not server_supports_timeseries():
+            raise CommandError('The time-series layout needs MongoDB 7.0 or later')
+        users = options['users']
+        now = timezone.now()
+        activities = []
+        for index in range(users):
+            activities.extend(synthetic.make_activities(options['seed'], index, options['activities_per_user'], now))
+        for activity in activities:
+            activity['_id'] = ObjectId()
+        
+        db = get_db()
+        rng = random.Random(options['seed'])
+        emails = [synthetic.user_email(rng.randrange(users)) for _ in range(options['queries'])]
+        ids = [rng.choice(activities)['_id'] for _ in range(options['queries'])]
+        shapes = {
+            'user last 90 days': lambda i, c: list(c.find(
+                {'user_email': emails[i], 'date': {'$gte': now - timedelta(days=90)}}).sort('date', -1)),
+            'user recent 20': lambda i, c: list(c.find({'user_email': emails[i]}).sort('date', -1).limit(20)),
+            'global recent 10': lambda i, c: list(c.find().sort('date', -1).limit(10)),
+            'by id': lambda i, c: c.find_one({'_id': ids[i]}),
+        }
+        
+        self.stdout.write(f'{len(activities):,} activities for {users:,} users')
+        self.stdout.write(f'{"layout":<12} {"insert docs/s":>14} {"storage MB":>11} {"index MB":>9}')
+        latencies = {}
+        for layout in LAYOUTS:
+            name = f'bench_activities_{layout}'
+            db.drop_collection(name)
+            create_collection(db, name, layout)
+            collection = db[name]
+            
+            started = time.perf_counter()
+            for offset in range(0, len(activities), options['batch_size']):
+                batch = [dict(activity) for activity in activities[offset:offset + options['batch_size']]]
+                collection.insert_many(batch, ordered=False)
+            rate = len(activities) / (time.perf_counter() - started)
+            for index_name, keys, unique in declared_indexes(Activity) + storage_indexes(Activity, layout):
+                collection.create_index(keys, name=index_name, unique=unique)
+            
+            stats = db.command('collStats', name)
+            self.stdout.write(f'{layout:<12} {rate:>14,.0f} {stats.get("storageSize", 0) / 2 ** 20:>11.1f} '
+                              f'{stats.get("totalIndexSize", 0) / 2 ** 20:>9.1f}')
+            latencies[layout] = {shape: self.latency(query, collection, options['queries'])
+                                 for shape, query in shapes.items()}
+            if not options['keep']:
+                db.drop_collection(name)
+        
+        header = f'{"query (p50/p95 ms)":<20}'
+        for layout in LAYOUTS:
+            header += f' {layout:>17}'
+        self.stdout.write(header)
+        for shape in shapes:
+            line = f'{shape:<20}'
+            for layout in LAYOUTS:
+                p50, p95 = latencies[layout][shape]
+                line += f' {p50:>8.2f}/{p95:<8.2f}'
+            self.stdout.write(line)
+        if options['keep']:
+            self.stdout.write(f'Kept bench_activities_{PLAIN} and bench_activities_{TIMESERIES}')
+
+    def latency(self, query, collection, count):
+        """Median and 95th percentile wall time of ``query`` in milliseconds, after a warm-up call."""
+        query(0, collection)
+        samples = []
+        for index in range(count):
+            started = time.perf_counter()
+            query(index, collection)
+            samples.append((time.perf_counter() - started) * 1000)
+        return statistics.median(samples), statistics.quantiles(samples, n=20)[-1]
@@ -0,0 +1,246 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import monitoring
+from octofit_tracker.cache import CACHE_ALIAS, invalidate
+from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
+import json
+import statistics
+import threading
+import time
+import urllib.request
+
+# Endpoints behind the 'api' response cache, with the collections they are cached on.
+# They are timed with the cache cold, then again as "<name> (cached)" with it warm.
+CACHED_ENDPOINTS = {
+    'leaderboard-top': ('leaderboard',),
+    'leaderboard-top-week': ('leaderboard',),
+    'leaderboard-around': ('leaderboard',),
+    'leaderboard-by_team': ('leaderboard',),
+    'workouts-by_fitness_level': ('workouts',),
+    'workouts-by_category': ('workouts',),
+}
+NO_RESPONSE_CACHE = {**settings.CACHES, CACHE_ALIAS: {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+class MongoCommandCounter(monitoring.CommandListener):
+    """Counts MongoDB commands, including the ones raw pymongo paths issue."""
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def started(self, event):
+        with self.lock:
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+class Command(BaseCommand):
+    help = ('Benchmark every API endpoint and report latency percentiles, throughput and DB queries per request. '
+            'Seeds a synthetic dataset first (replacing existing data) unless --no-seed is given.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Synthetic users to seed')
+        parser.add_argument('--activities-per-user', type=int, default=20, help='Synthetic activities per user to seed')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic dataset')
+        parser.add_argument('--no-seed', action='store_true', help='Benchmark the data already in the database')
+        parser.add_argument('--requests', type=int, default=100, help='Timed requests per endpoint')
+        parser.add_argument('--url', help='Drive a running server at this base URL instead of the in-process client')
+        parser.add_argument('--concurrency', type=int, default=1, help='Concurrent clients when using --url')
+        parser.add_argument('--save', help='Write the results to this JSON baseline file')
+        parser.add_argument('--compare', help='Compare against a JSON baseline and fail on regressions')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Allowed relative p95 slowdown before --compare flags a regression')
+
+    def handle(self, *args, **options):
+        # Registered before any client connects so every MongoClient reports to it
+        counter = MongoCommandCounter()
+        monitoring.register(counter)
+
+        if not options['no_seed']:
+            call_command('populate_db', users=options['users'], activities_per_user=options['activities_per_user'],
+                         seed=options['seed'], stdout=self.stdout)
+
+        results = self.measure(self.endpoints(), options, counter)
+
+        self.report(results)
+        baseline = {
+            'dataset': {
+                'users': User.objects.count(),
+                'activities': Activity.objects.count(),
+            },
+            'mode': 'remote' if options['url'] else 'in-process',
+            'concurrency': options['concurrency'] if options['url'] else 1,
+            # Each endpoint's "response_cache": null when it has none, else "cold" or "warm"
+            'response_cache': {
+                'cold': 'api cache bypassed in-process, its collections invalidated before each request with --url',
+                'warm': 'api cache filled by a warm-up request, so every timed request is a hit',
+            },
+            'endpoints': results,
+        }
+        if options['save']:
+            with open(options['save'], 'w') as baseline_file:
+                json.dump(baseline, baseline_file, indent=2)
+            self.stdout.write(f"Saved baseline to {options['save']}")
+        if options['compare']:
+            self.compare(results, options['compare'], options['threshold'])
+
+    def endpoints(self):
+        """Every router endpoint and custom action, with parameters taken from the data."""
+        user = User.objects.first()
+        team = Team.objects.first()
+        activity = Activity.objects.first()
+        entry = Leaderboard.objects.first()
+        workout = Workout.objects.first()
+        if not all([user, team, activity, entry, workout]):
+            raise CommandError('Every collection needs at least one document; run without --no-seed')
+
+        return {
+            'api-root': '/api/',
+            'users-list': '/api/users/',
+            'users-detail': f'/api/users/{user._id}/',
+            'users-by_email': f'/api/users/by_email/?email={user.email}',
+            'teams-list': '/api/teams/',
+            'teams-detail': f'/api/teams/{team._id}/',
+            'teams-members': f'/api/teams/{team._id}/members/',
+            'teams-stats': f'/api/teams/{team._id}/stats/',
+            'teams-standings': '/api/teams/standings/',
+            'activities-list': '/api/activities/',
+            'activities-detail': f'/api/activities/{activity._id}/',
+            'activities-by_user': f'/api/activities/by_user/?email={user.email}',
+            'activities-recent': '/api/activities/recent/?limit=10',
+            'activities-enriched': '/api/activities/enriched/',
+            'leaderboard-list': '/api/leaderboard/',
+            'leaderboard-detail': f'/api/leaderboard/{entry._id}/',
+            'leaderboard-top': '/api/leaderboard/top/?limit=10',
+            'leaderboard-top-week': '/api/leaderboard/top/?limit=10&window=week',
+            'leaderboard-around': f'/api/leaderboard/around/?email={entry.user_email}&radius=5',
+            'leaderboard-by_team': f'/api/leaderboard/by_team/?team={entry.team}',
+            'workouts-list': '/api/workouts/',
+            'workouts-detail': f'/api/workouts/{workout._id}/',
+            'workouts-by_fitness_level': f'/api/workouts/by_fitness_level/?fitness_level={workout.fitness_level}',
+            'workouts-by_category': f'/api/workouts/by_category/?category={workout.category}',
+            'stats-timeseries': f'/api/stats/timeseries/?scope=user&key={user.email}&granularity=week',
+        }
+
+    def measure(self, endpoints, options, counter):
+        """Time every endpoint with the response cache cold, then the cached ones again with it warm."""
+        warm = {f'{name} (cached)': endpoints[name] for name in CACHED_ENDPOINTS}
+        if options['url']:
+            base_url = options['url'].rstrip('/')
+            results = self.run_remote(endpoints, base_url, options['requests'], options['concurrency'], cold=True)
+            results.update(self.run_remote(warm, base_url, options['requests'], options['concurrency']))
+        else:
+            with override_settings(CACHES=NO_RESPONSE_CACHE):
+                results = self.run_in_process(endpoints, options['requests'], counter)
+            results.update(self.run_in_process(warm, options['requests'], counter))
+
+        for name, result in results.items():
+            if name in warm:
+                result['response_cache'] = 'warm'
+            else:
+                result['response_cache'] = 'cold' if name in CACHED_ENDPOINTS else None
+        return results
+
+    def run_in_process(self, endpoints, requests, counter):
+        client = Client(HTTP_HOST='localhost')
+        results = {}
+        for name, path in endpoints.items():
+            client.get(path)  # warm-up
+            latencies = []
+            orm_queries = 0
+            mongo_commands = counter.count
+            started = time.perf_counter()
+            for _ in range(requests):
+                with CaptureQueriesContext(connection) as queries:
+                    request_started = time.perf_counter()
+                    response = client.get(path)
+                    latencies.append((time.perf_counter() - request_started) * 1000)
+                orm_queries += len(queries)
+                if response.status_code >= 400:
+                    raise CommandError(f'{name}: GET {path} returned {response.status_code}')
+            elapsed = time.perf_counter() - started
+            results[name] = self.summarise(latencies, elapsed, requests)
+            results[name]['orm_queries_per_request'] = orm_queries / requests
+            results[name]['mongo_commands_per_request'] = (counter.count - mongo_commands) / requests
+        return results
+
+    def run_remote(self, endpoints, base_url, requests, concurrency, cold=False):
+        def fetch(url, collections=()):
+            # Retires the server's cached responses; a concurrent client may still refill one in between
+            invalidate(*collections)
+            request_started = time.perf_counter()
+            with urllib.request.urlopen(url) as response:
+                response.read()
+            return (time.perf_counter() - request_started) * 1000
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for name, path in endpoints.items():
+                url = base_url + path
+                collections = CACHED_ENDPOINTS.get(name, ()) if cold else ()
+                fetch(url)  # warm-up
+                started = time.perf_counter()
+                latencies = list(pool.map(fetch, [url] * requests, [collections] * requests))
+                elapsed = time.perf_counter() - started
+                results[name] = self.summarise(latencies, elapsed, requests)
+                # Query counts are only observable in-process
+                results[name]['orm_queries_per_request'] = None
+                results[name]['mongo_commands_per_request'] = None
+        return results
+
+    def summarise(self, latencies, elapsed, requests):
+        if len(latencies) > 1:
+            percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+            p50, p95, p99 = percentiles[49], percentiles[94], percentiles[98]
+        else:
+            p50 = p95 = p99 = latencies[0]
+        return {
+            'p50_ms': round(p50, 3),
+            'p95_ms': round(p95, 3),
+            'p99_ms': round(p99, 3),
+            'requests_per_second': round(requests / elapsed, 1),
+        }
+
+    def report(self, results):
+        self.stdout.write(f'{"endpoint":<36} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"req/s":>9} {"orm q/req":>10} {"mongo/req":>10}')
+        for name, result in results.items():
+            orm = result['orm_queries_per_request']
+            mongo = result['mongo_commands_per_request']
+            self.stdout.write(
+                f'{name:<36} {result["p50_ms"]:>8.2f} {result["p95_ms"]:>8.2f} {result["p99_ms"]:>8.2f} '
+                f'{result["requests_per_second"]:>9.1f} '
+                f'{"-" if orm is None else f"{orm:.1f}":>10} {"-" if mongo is None else f"{mongo:.1f}":>10}'
+            )
+
+    def compare(self, results, baseline_path, threshold):
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)['endpoints']
+
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            # Older baselines timed the cached endpoints warm under their plain names
+            if before is None or before.get('response_cache') != result['response_cache']:
+                continue
+            if result['p95_ms'] > before['p95_ms'] * (1 + threshold):
+                regressions.append(f'{name}: p95 {before["p95_ms"]:.2f}ms -> {result["p95_ms"]:.2f}ms')
+            for key in ['orm_queries_per_request', 'mongo_commands_per_request']:
+                if None not in (result.get(key), before.get(key)) and result[key] > before[key]:
+                    regressions.append(f'{name}: {key} {before[key]:.1f} -> {result[key]:.1f}')
+
+        if regressions:
+            for regression in regressions:
+                self.stdout.write(self.style.ERROR(f'REGRESSION {regression}'))
+            raise CommandError(f'{len(regressions)} regression(s) against {baseline_path}')
+        self.stdout.write(self.style.SUCCESS(f'No regressions against {baseline_path}'))
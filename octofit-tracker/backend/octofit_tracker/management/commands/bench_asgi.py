@@ -0,0 +1,147 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client, override_settings
+from concurrent.futures import ThreadPoolExecutor
+from octofit_tracker.cache import CACHE_ALIAS
+from octofit_tracker.models import User, Activity, Leaderboard
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Behind the 'api' response cache: timed with it bypassed, then again as "<name> (cached)" with it warm
+CACHED_ENDPOINTS = ['leaderboard-top']
+NO_RESPONSE_CACHE = {**settings.CACHES, CACHE_ALIAS: {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+class Command(BaseCommand):
+    help = ('Compare the read endpoints under concurrent load served by the sync viewsets through the WSGI '
+            'handler and by the async Motor views through the ASGI handler. Each mode runs in its own process.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Synthetic users to seed')
+        parser.add_argument('--activities-per-user', type=int, default=20, help='Synthetic activities per user to seed')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic dataset')
+        parser.add_argument('--no-seed', action='store_true', help='Benchmark the data already in the database')
+        parser.add_argument('--requests', type=int, default=500, help='Timed requests per endpoint')
+        parser.add_argument('--concurrency', type=int, default=50, help='Requests in flight at once')
+        parser.add_argument('--mode', choices=['wsgi', 'asgi'], help='Run one mode in this process and print JSON')
+
+    def handle(self, *args, **options):
+        if options['mode']:
+            results = self.run_mode(options['mode'], options['requests'], options['concurrency'])
+            self.stdout.write(json.dumps(results))
+            return
+
+        if not options['no_seed']:
+            call_command('populate_db', users=options['users'], activities_per_user=options['activities_per_user'],
+                         seed=options['seed'], stdout=self.stdout)
+
+        # URL routing depends on OCTOFIT_ASYNC_READS, so each mode gets a fresh process
+        results = {}
+        for mode, async_reads in [('wsgi', '0'), ('asgi', '1')]:
+            completed = subprocess.run(
+                [sys.executable, sys.argv[0], 'bench_asgi', '--mode', mode,
+                 '--requests', str(options['requests']), '--concurrency', str(options['concurrency'])],
+                env={**os.environ, 'OCTOFIT_ASYNC_READS': async_reads},
+                capture_output=True, text=True,
+            )
+            if completed.returncode != 0:
+                raise CommandError(f'{mode} run failed:\n{completed.stderr}')
+            results[mode] = json.loads(completed.stdout.strip().splitlines()[-1])
+
+        self.stdout.write(f'concurrency {options["concurrency"]}, {options["requests"]} requests per endpoint')
+        self.stdout.write(f'{"endpoint":<26} {"wsgi req/s":>11} {"asgi req/s":>11} {"wsgi p95":>9} {"asgi p95":>9}')
+        for name, wsgi in results['wsgi'].items():
+            asgi = results['asgi'][name]
+            self.stdout.write(
+                f'{name:<26} {wsgi["requests_per_second"]:>11.1f} {asgi["requests_per_second"]:>11.1f} '
+                f'{wsgi["p95_ms"]:>9.2f} {asgi["p95_ms"]:>9.2f}'
+            )
+
+    def endpoints(self):
+        user = User.objects.first()
+        activity = Activity.objects.first()
+        entry = Leaderboard.objects.first()
+        if not all([user, activity, entry]):
+            raise CommandError('Users, activities and leaderboard need data; run without --no-seed')
+        return {
+            'users-list': '/api/users/',
+            'activities-list': '/api/activities/',
+            'activities-detail': f'/api/activities/{activity._id}/',
+            'activities-recent': '/api/activities/recent/?limit=10',
+            'activities-by_user': f'/api/activities/by_user/?email={user.email}',
+            'leaderboard-list': '/api/leaderboard/',
+            'leaderboard-top': '/api/leaderboard/top/?limit=10',
+        }
+
+    def run_mode(self, mode, requests, concurrency):
+        if (mode == 'asgi') != settings.OCTOFIT_ASYNC_READS:
+            raise CommandError(f'--mode {mode} needs OCTOFIT_ASYNC_READS={int(mode == "asgi")}')
+        endpoints = self.endpoints()
+        # A dummy cache rather than clearing it, which concurrent requests would refill between timings
+        with override_settings(CACHES=NO_RESPONSE_CACHE):
+            results = self.run_endpoints(mode, endpoints, requests, concurrency)
+        warm = {f'{name} (cached)': endpoints[name] for name in CACHED_ENDPOINTS}
+        results.update(self.run_endpoints(mode, warm, requests, concurrency))
+        return results
+
+    def run_endpoints(self, mode, endpoints, requests, concurrency):
+        if mode == 'asgi':
+            return asyncio.run(self.run_asgi(endpoints, requests, concurrency))
+        return self.run_wsgi(endpoints, requests, concurrency)
+
+    def run_wsgi(self, endpoints, requests, concurrency):
+        client = Client(HTTP_HOST='localhost')
+
+        def fetch(path):
+            request_started = time.perf_counter()
+            response = client.get(path)
+            if response.status_code >= 400:
+                raise CommandError(f'GET {path} returned {response.status_code}')
+            return (time.perf_counter() - request_started) * 1000
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for name, path in endpoints.items():
+                fetch(path)  # warm-up
+                started = time.perf_counter()
+                latencies = list(pool.map(fetch, [path] * requests))
+                results[name] = self.summarise(latencies, time.perf_counter() - started, requests)
+        return results
+
+    async def run_asgi(self, endpoints, requests, concurrency):
+        client = AsyncClient(server=('localhost', '80'))
+        slots = asyncio.Semaphore(concurrency)
+
+        async def fetch(path):
+            async with slots:
+                request_started = time.perf_counter()
+                response = await client.get(path)
+                if response.status_code >= 400:
+                    raise CommandError(f'GET {path} returned {response.status_code}')
+                return (time.perf_counter() - request_started) * 1000
+
+        results = {}
+        for name, path in endpoints.items():
+            await fetch(path)  # warm-up
+            started = time.perf_counter()
+            latencies = await asyncio.gather(*[fetch(path) for _ in range(requests)])
+            results[name] = self.summarise(latencies, time.perf_counter() - started, requests)
+        return results
+
+    def summarise(self, latencies, elapsed, requests):
+        if len(latencies) > 1:
+            percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+            p50, p95 = percentiles[49], percentiles[94]
+        else:
+            p50 = p95 = latencies[0]
+        return {
+            'p50_ms': round(p50, 3),
+            'p95_ms': round(p95, 3),
+            'requests_per_second': round(requests / elapsed, 1),
+        }
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+from octofit_tracker.models import User, Activity, Leaderboard
+from octofit_tracker.serializers import UserSerializer, ActivitySerializer, LeaderboardSerializer
+from octofit_tracker import repositories
+import statistics
+import time
+
+
+class Command(BaseCommand):
+    help = 'Compare per-request CPU time of the djongo ORM and direct pymongo read paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200, help='Requests to time per path')
+        parser.add_argument('--limit', type=int, default=10, help='Row limit for top and recent')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        limit = options['limit']
+        
+        user = User.objects.first()
+        if user is None:
+            raise CommandError('No users found; run populate_db first')
+        email = user.email
+        
+        # Each endpoint as (ORM path, repository path), both serialized the way the view does
+        endpoints = {
+            'leaderboard/top': (
+                lambda: LeaderboardSerializer(Leaderboard.objects.all()[:limit], many=True).data,
+                lambda: LeaderboardSerializer(repositories.top_leaderboard(limit), many=True).data,
+            ),
+            'activities/recent': (
+                lambda: ActivitySerializer(Activity.objects.all().order_by('-date')[:limit], many=True).data,
+                lambda: ActivitySerializer(repositories.recent_activities(limit), many=True).data,
+            ),
+            'activities/by_user': (
+                lambda: ActivitySerializer(Activity.objects.filter(user_email=email).order_by('-date'), many=True).data,
+                lambda: ActivitySerializer(repositories.activities_for_user(email), many=True).data,
+            ),
+            'users/by_email': (
+                lambda: UserSerializer(User.objects.get(email=email)).data,
+                lambda: UserSerializer(repositories.user_by_email(email)).data,
+            ),
+        }
+        
+        self.stdout.write(f'{"endpoint":<20} {"orm cpu ms":>11} {"repo cpu ms":>12} {"speedup":>8}')
+        for name, (orm_path, repo_path) in endpoints.items():
+            orm_ms = self.cpu_ms(orm_path, iterations)
+            repo_ms = self.cpu_ms(repo_path, iterations)
+            self.stdout.write(f'{name:<20} {orm_ms:>11.3f} {repo_ms:>12.3f} {orm_ms / repo_ms:>7.1f}x')
+
+    def cpu_ms(self, func, iterations):
+        """Median process CPU time of one call, in milliseconds, after a warm-up call."""
+        func()
+        samples = []
+        for _ in range(iterations):
+            started = time.process_time()
+            func()
+            samples.append((time.process_time() - started) * 1000)
+        return statistics.median(samples)
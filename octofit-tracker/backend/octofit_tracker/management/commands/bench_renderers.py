@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from octofit_tracker.compression import ENCODINGS, compress
+from octofit_tracker.management.commands.bench_serializers import sample_instances
+from octofit_tracker.renderers import MessagePackRenderer, ORJSONRenderer
+from octofit_tracker.serializers import ActivitySerializer, LeaderboardSerializer
+import time
+
+
+class Command(BaseCommand):
+    help = 'Measure encode time and bytes on the wire per renderer and content coding for large lists'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Rows per list')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per measurement (best is reported)')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        repeat = options['repeat']
+
+        # Serialized once up front: this measures rendering and compression only
+        activities, leaderboard = sample_instances(rows)
+        lists = [
+            ('activities', ActivitySerializer(activities, many=True).data),
+            ('leaderboard', LeaderboardSerializer(leaderboard, many=True).data),
+        ]
+        renderers = [('json (drf)', JSONRenderer()), ('orjson', ORJSONRenderer()), ('msgpack', MessagePackRenderer())]
+
+        header = f'{"list":<12} {"renderer":<11} {"encode ms":>10} {"bytes":>11}'
+        for coding in ENCODINGS:
+            header += f' {coding + " ms":>9} {coding + " bytes":>11}'
+        self.stdout.write(header)
+        for name, data in lists:
+            for label, renderer in renderers:
+                encode_time, body = self.best_time(lambda: renderer.render(data), repeat)
+                line = f'{name:<12} {label:<11} {encode_time * 1000:>10.1f} {len(body):>11,}'
+                for coding in ENCODINGS:
+                    compress_time, compressed = self.best_time(lambda: compress(body, coding), repeat)
+                    line += f' {(encode_time + compress_time) * 1000:>9.1f} {len(compressed):>11,}'
+                self.stdout.write(line)
+        self.stdout.write('Compressed timings include the encode.')
+
+    def best_time(self, produce, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = produce()
+            timings.append(time.perf_counter() - started)
+        return min(timings), result
@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand
+from rest_framework import serializers
+from octofit_tracker.models import Activity, Leaderboard
+from octofit_tracker.serializers import ActivitySerializer, LeaderboardSerializer
+from bson import ObjectId
+from datetime import datetime, timedelta, timezone
+import time
+
+
+def sample_instances(rows):
+    """``rows`` unsaved activities and leaderboard rows shaped like real data."""
+    now = datetime.now(timezone.utc)
+    activities = [
+        Activity(
+            _id=ObjectId(),
+            user_email=f'hero{i % 500}@example.com',
+            activity_type='Running',
+            duration_minutes=30 + i % 60,
+            calories_burned=200 + i % 700,
+            distance_km=None if i % 3 else round(i % 150 / 10, 2),
+            date=now - timedelta(minutes=i),
+            notes=f'Session {i}'
+        )
+        for i in range(rows)
+    ]
+    leaderboard = [
+        Leaderboard(
+            _id=ObjectId(),
+            user_email=f'hero{i}@example.com',
+            user_name=f'Hero {i}',
+            team='Team Marvel' if i % 2 else 'Team DC',
+            total_activities=i % 90,
+            total_calories=100000 - i,
+            total_distance=round(i / 7, 2),
+            rank=i + 1
+        )
+        for i in range(rows)
+    ]
+    return activities, leaderboard
+
+
+class Command(BaseCommand):
+    help = 'Measure list serialization throughput of the default and row-plan list serializers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Rows per list')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per serializer (best is reported)')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        repeat = options['repeat']
+        
+        # In-memory instances only: this measures serialization, not the database
+        activities, leaderboard = sample_instances(rows)
+        
+        self.stdout.write(f'{"serializer":<24} {"default rows/s":>15} {"row plan rows/s":>16} {"speedup":>8}')
+        for serializer_class, instances in [(ActivitySerializer, activities), (LeaderboardSerializer, leaderboard)]:
+            default = serializers.ListSerializer(instances, child=serializer_class())
+            fast = serializer_class(instances, many=True)
+            if default.data != fast.data:
+                self.stderr.write(self.style.ERROR(f'{serializer_class.__name__}: outputs differ'))
+                continue
+            
+            default_rate = rows / self.best_time(serializer_class, instances, repeat, fast_path=False)
+            fast_rate = rows / self.best_time(serializer_class, instances, repeat, fast_path=True)
+            self.stdout.write(
+                f'{serializer_class.__name__:<24} {default_rate:>15,.0f} {fast_rate:>16,.0f} {fast_rate / default_rate:>7.1f}x'
+            )
+
+    def best_time(self, serializer_class, instances, repeat, fast_path):
+        timings = []
+        for _ in range(repeat):
+            if fast_path:
+                serializer = serializer_class(instances, many=True)
+            else:
+                serializer = serializers.ListSerializer(instances, child=serializer_class())
+            started = time.perf_counter()
+            serializer.data
+            timings.append(time.perf_counter() - started)
+        return min(timings)
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.indexes import ensure_all_indexes
+
+
+class Command(BaseCommand):
+    help = 'Create or reconcile the MongoDB indexes declared on the octofit_tracker models'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report what would change without creating or dropping indexes',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        if dry_run:
+            self.stdout.write('Dry run: no indexes will be changed')
+        
+        for collection, report in ensure_all_indexes(dry_run=dry_run).items():
+            self.stdout.write(f'{collection}:')
+            for name in report['created']:
+                self.stdout.write(self.style.SUCCESS(f'  created {name}'))
+            for name in report['rebuilt']:
+                self.stdout.write(self.style.SUCCESS(f'  rebuilt {name} (key spec changed)'))
+            for name in report['present']:
+                self.stdout.write(f'  ok      {name}')
+            for name in report['undeclared']:
+                self.stdout.write(self.style.WARNING(f'  undeclared {name} (not in model Meta)'))
+            for name in report['unused']:
+                self.stdout.write(self.style.WARNING(f'  unused  {name} (no accesses in $indexStats)'))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from octofit_tracker.indexes import ensure_indexes
+from octofit_tracker.models import Activity
+from octofit_tracker.storage import (LAYOUTS, MIN_TIMESERIES_SERVER, TIMESERIES, collection_layout,
+                                     migrate_activities, server_supports_timeseries)
+import time
+
+
+class Command(BaseCommand):
+    help = 'Move the activities between a plain and a time-series collection, then rebuild its indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--to', choices=LAYOUTS, required=True, help='Target storage layout')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Documents per insert_many batch')
+
+    def handle(self, *args, **options):
+        layout = options['to']
+        if layout == TIMESERIES and not server_supports_timeseries():
+            minimum = '.'.join(str(part) for part in MIN_TIMESERIES_SERVER)
+            raise CommandError(f'Time-series activities need MongoDB {minimum} or later for single-activity edits')
+        if collection_layout(Activity) == layout:
+            self.stdout.write(f'Activities already use the {layout} layout')
+            return
+        
+        self.stdout.write(f'Moving activities to the {layout} layout...')
+        started = time.perf_counter()
+        result = migrate_activities(layout, batch_size=options['batch_size'])
+        report = ensure_indexes(Activity)
+        elapsed = time.perf_counter() - started
+        
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['copied']} activities copied and {len(report['created'])} indexes built in {elapsed:.2f}s"))
+        if result['backup']:
+            self.stdout.write(f"The previous collection was kept as {result['backup']}; drop it once satisfied")
+        self.stdout.write('Restart the app servers so they pick up the new layout')
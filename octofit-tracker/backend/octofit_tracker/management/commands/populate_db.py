@@ -1,13 +1,37 @@
-from django.core.management.base import BaseCommand
-from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
+from octofit_tracker.archive import clear_archive
+from octofit_tracker.leaderboard import rebuild_leaderboard
+from octofit_tracker.rollups import rebuild_rollups
+from octofit_tracker.windows import rebuild_windows
+from octofit_tracker.cache import invalidate
+from octofit_tracker.versions import TRACKED, reset
+from octofit_tracker.mongo import get_collection
+from octofit_tracker import synthetic
 import random
+import time
 
 
 class Command(BaseCommand):
     help = 'Populate the octofit_db database with test data'
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, help='Load N seeded synthetic users instead of the superhero data')
+        parser.add_argument('--activities-per-user', type=int, default=10, help='Synthetic activities per user')
+        parser.add_argument('--teams', type=int, default=10, help='Synthetic teams')
+        parser.add_argument('--workouts', type=int, default=100, help='Synthetic workouts')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic data generator')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Documents per insert_many batch')
+        parser.add_argument('--workers', type=int, default=1, help='Processes generating and inserting activities')
+
+    def handle(self, *args, **options):
+        if options['users'] is not None:
+            return self.handle_synthetic(**options)
+        
         self.stdout.write('Clearing existing data...')
         
         # Delete existing data
@@ -16,6 +40,8 @@ class Command(BaseCommand):
         Activity.objects.all().delete()
         Leaderboard.objects.all().delete()
         Workout.objects.all().delete()
+        # Archived activities would otherwise rejoin the new data's totals
+        clear_archive()
         
         self.stdout.write('Creating teams...')
         
@@ -24,12 +50,10 @@ class Command(BaseCommand):
             {
                 'name': 'Team Marvel',
                 'description': 'Earth\'s Mightiest Heroes unite for fitness!',
-                'members_count': 6
             },
             {
                 'name': 'Team DC',
                 'description': 'Justice League assembles for peak performance!',
-                'members_count': 6
             }
         ]
         
@@ -88,27 +112,18 @@ class Command(BaseCommand):
         
         self.stdout.write('Creating leaderboard entries...')
         
-        # Create leaderboard entries
-        for user_data in users_data:
-            activities = Activity.objects.filter(user_email=user_data['email'])
-            total_activities = activities.count()
-            total_calories = sum(a.calories_burned for a in activities)
-            total_distance = sum(a.distance_km for a in activities if a.distance_km)
-            
-            Leaderboard.objects.create(
-                user_email=user_data['email'],
-                user_name=user_data['name'],
-                team=user_data['team'],
-                total_activities=total_activities,
-                total_calories=total_calories,
-                total_distance=round(total_distance, 2)
-            )
+        # Create leaderboard entries with one server-side aggregation
+        rebuild_leaderboard()
+        
+        self.stdout.write('Creating activity rollups...')
+        
+        # Bucket the activities by day, week and month
+        rebuild_rollups()
         
-        # Update ranks based on total calories
-        leaderboard_entries = Leaderboard.objects.all().order_by('-total_calories')
-        for rank, entry in enumerate(leaderboard_entries, start=1):
-            entry.rank = rank
-            entry.save()
+        self.stdout.write('Creating windowed leaderboards...')
+        
+        # This week, this month and the last 30 days, from the rollups
+        rebuild_windows()
         
         self.stdout.write('Creating workouts...')
         
@@ -191,9 +206,96 @@ class Command(BaseCommand):
         for workout_data in workouts_data:
             Workout.objects.create(**workout_data)
         
+        # A reload is not a delta: send pollers back to a full fetch
+        reset(*TRACKED)
+        
         self.stdout.write(self.style.SUCCESS('Successfully populated database with superhero test data!'))
         self.stdout.write(f'Created {User.objects.count()} users')
         self.stdout.write(f'Created {Team.objects.count()} teams')
         self.stdout.write(f'Created {Activity.objects.count()} activities')
         self.stdout.write(f'Created {Leaderboard.objects.count()} leaderboard entries')
         self.stdout.write(f'Created {Workout.objects.count()} workouts')
+
+
+    def handle_synthetic(self, users, activities_per_user, teams, workouts, seed, batch_size, workers, **options):
+        """Bulk-load a seeded synthetic dataset straight into MongoDB."""
+        if users < 1 or teams < 1 or activities_per_user < 0 or batch_size < 1 or workers < 1:
+            raise CommandError('--users, --teams, --batch-size and --workers must be positive')
+        
+        collections = {model: get_collection(model) for model in [User, Team, Activity, Leaderboard, Workout]}
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        
+        with self.phase('Clearing existing data'):
+            for collection in collections.values():
+                collection.delete_many({})
+            clear_archive()
+        
+        with self.phase('Creating teams') as phase:
+            collections[Team].insert_many(synthetic.make_teams(teams, now, users), ordered=False)
+            phase['rows'] = teams
+        
+        with self.phase('Creating users') as phase:
+            phase['rows'] = synthetic.insert_batches(
+                collections[User],
+                (synthetic.make_user(seed, index, teams, now) for index in range(users)),
+                batch_size,
+            )
+        
+        settings_dict = connections['default'].settings_dict
+        jobs = [
+            {
+                'client': dict(settings_dict.get('CLIENT', {})),
+                'db': settings_dict['NAME'],
+                'collection': Activity._meta.db_table,
+                'seed': seed,
+                'per_user': activities_per_user,
+                'now': now,
+                'batch_size': batch_size,
+                'start': start,
+                'stop': stop,
+            }
+            # Several shards per worker keeps the pool busy until the end
+            for start, stop in synthetic.shard_ranges(users, workers * 4)
+        ]
+        with self.phase('Creating activities') as phase:
+            if workers > 1:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    phase['rows'] = sum(pool.map(synthetic.load_activity_shard, jobs))
+            else:
+                phase['rows'] = sum(map(synthetic.load_activity_shard, jobs))
+            activities = phase['rows']
+        
+        with self.phase('Creating leaderboard entries') as phase:
+            phase['rows'] = rebuild_leaderboard()
+        
+        with self.phase('Creating activity rollups') as phase:
+            phase['rows'] = rebuild_rollups()
+        
+        with self.phase('Creating windowed leaderboards') as phase:
+            phase['rows'] = rebuild_windows()
+        
+        with self.phase('Creating workouts') as phase:
+            if workouts:
+                collections[Workout].insert_many(synthetic.make_workouts(seed, workouts), ordered=False)
+            invalidate('workouts')
+            phase['rows'] = workouts
+        
+        # A reload is not a delta: send pollers back to a full fetch
+        reset(*TRACKED)
+        
+        self.stdout.write(self.style.SUCCESS(f'Loaded {users} users and {activities} activities (seed {seed})'))
+
+    @contextmanager
+    def phase(self, label):
+        """Time one load phase; set ``phase['rows']`` inside it to report rows per second."""
+        self.stdout.write(f'{label}...', ending='')
+        self.stdout.flush()
+        stats = {'rows': None}
+        started = time.perf_counter()
+        yield stats
+        elapsed = time.perf_counter() - started
+        if stats['rows'] is None:
+            self.stdout.write(f' {elapsed:.2f}s')
+        else:
+            rate = stats['rows'] / elapsed if elapsed else float('inf')
+            self.stdout.write(f" {stats['rows']} rows in {elapsed:.2f}s ({rate:,.0f} rows/s)")
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from octofit_tracker.leaderboard import rebuild_leaderboard
+from datetime import timezone
+import time
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the leaderboard from activities with a server-side aggregation'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            help='Only rebuild users with activities dated or logged after this ISO timestamp',
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError(f"Invalid --since timestamp: {options['since']}")
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+        
+        self.stdout.write('Rebuilding leaderboard...')
+        started = time.perf_counter()
+        rows = rebuild_leaderboard(since=since)
+        elapsed = time.perf_counter() - started
+        
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} leaderboard entries in {elapsed:.2f}s'))
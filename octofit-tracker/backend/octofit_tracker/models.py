@@ -1,52 +1,102 @@
 from djongo import models
 
-class User(models.Model):
+
+class VersionedSave:
+    """
+    Model mixin running ``save()`` inside ``versions.writing()``.
+
+    The ``pre_save`` signal takes the change version; the block releases it
+    once the save and its ``post_save`` handlers are done, or as soon as
+    the save raises, so a failed write never holds back the watermark.
+    """
+
+    def save(self, *args, **kwargs):
+        # versions.py imports this module
+        from .versions import writing
+        with writing():
+            super().save(*args, **kwargs)
+
+
+class User(VersionedSave, models.Model):
     _id = models.ObjectIdField(db_column='_id', primary_key=True)
     name = models.CharField(max_length=200)
     email = models.EmailField(unique=True)
     team = models.CharField(max_length=100)
+    # Reference to the Team named by ``team``, see references.py
+    team_id = models.GenericObjectIdField(null=True, blank=True, editable=False)
     fitness_level = models.CharField(max_length=50)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Bumped on every write, see changes.py
+    change_version = models.BigIntegerField(default=0, editable=False)
     
     class Meta:
         db_table = 'users'
+        indexes = [
+            models.Index(fields=['team'], name='users_team_idx'),
+            models.Index(fields=['team_id'], name='users_team_ref_idx'),
+            # Admin changelist keyset, see changelists.py
+            models.Index(fields=['-created_at', '_id'], name='users_created_idx'),
+            models.Index(fields=['change_version'], name='users_version_idx'),
+        ]
         
     def __str__(self):
         return self.name
 
 
-class Team(models.Model):
+class Team(VersionedSave, models.Model):
     _id = models.ObjectIdField(db_column='_id', primary_key=True)
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # Maintained by teams.py on user and activity writes
     members_count = models.IntegerField(default=0)
+    total_calories = models.IntegerField(default=0)
+    total_distance = models.FloatField(default=0.0)
+    rank = models.IntegerField(default=0)
+    # Bumped on every write, see changes.py
+    change_version = models.BigIntegerField(default=0, editable=False)
     
     class Meta:
         db_table = 'teams'
+        indexes = [
+            models.Index(fields=['-total_calories', 'name'], name='teams_calories_idx'),
+            models.Index(fields=['change_version'], name='teams_version_idx'),
+        ]
         
     def __str__(self):
         return self.name
 
 
-class Activity(models.Model):
+class Activity(VersionedSave, models.Model):
     _id = models.ObjectIdField(db_column='_id', primary_key=True)
     user_email = models.EmailField()
+    # Reference to the User with ``user_email``, see references.py
+    user_id = models.GenericObjectIdField(null=True, blank=True, editable=False)
     activity_type = models.CharField(max_length=100)
     duration_minutes = models.IntegerField()
     calories_burned = models.IntegerField()
     distance_km = models.FloatField(null=True, blank=True)
     date = models.DateTimeField()
     notes = models.TextField(blank=True)
+    # Bumped on every write, see changes.py
+    change_version = models.BigIntegerField(default=0, editable=False)
     
     class Meta:
         db_table = 'activities'
+        indexes = [
+            models.Index(fields=['user_email', '-date'], name='activities_user_date_idx'),
+            models.Index(fields=['-date', '_id'], name='activities_date_idx'),
+            models.Index(fields=['user_id', '-date'], name='activities_user_ref_idx'),
+            # Admin changelist filtered by type, and the type facet's distinct
+            models.Index(fields=['activity_type', '-date', '_id'], name='activities_type_date_idx'),
+            models.Index(fields=['change_version'], name='activities_version_idx'),
+        ]
         
     def __str__(self):
         return f"{self.user_email} - {self.activity_type}"
 
 
-class Leaderboard(models.Model):
+class Leaderboard(VersionedSave, models.Model):
     _id = models.ObjectIdField(db_column='_id', primary_key=True)
     user_email = models.EmailField(unique=True)
     user_name = models.CharField(max_length=200)
@@ -55,16 +105,116 @@ class Leaderboard(models.Model):
     total_calories = models.IntegerField(default=0)
     total_distance = models.FloatField(default=0.0)
     rank = models.IntegerField(default=0)
+    # Bumped on every write, see changes.py
+    change_version = models.BigIntegerField(default=0, editable=False)
     
     class Meta:
         db_table = 'leaderboard'
         ordering = ['-total_calories']
+        indexes = [
+            models.Index(fields=['-total_calories', 'user_email'], name='leaderboard_calories_idx'),
+            models.Index(fields=['team', '-total_calories'], name='leaderboard_team_idx'),
+            models.Index(fields=['rank', '_id'], name='leaderboard_rank_idx'),
+            models.Index(fields=['change_version'], name='leaderboard_version_idx'),
+        ]
         
     def __str__(self):
         return f"{self.user_name} - Rank {self.rank}"
 
 
-class Workout(models.Model):
+# Maintained by windows.py
+class LeaderboardWindow(models.Model):
+    _id = models.ObjectIdField(db_column='_id', primary_key=True)
+    span = models.CharField(max_length=10)
+    # Start of the week or month; null for the rolling window
+    period_start = models.DateTimeField(null=True)
+    user_email = models.EmailField()
+    user_name = models.CharField(max_length=200)
+    team = models.CharField(max_length=100)
+    total_activities = models.IntegerField(default=0)
+    total_calories = models.IntegerField(default=0)
+    total_distance = models.FloatField(default=0.0)
+    rank = models.IntegerField(default=0)
+    
+    class Meta:
+        db_table = 'leaderboard_windows'
+        indexes = [
+            models.Index(fields=['span', 'period_start', '-total_calories', 'user_email'], name='windows_calories_idx'),
+            models.Index(fields=['span', 'period_start', 'team', '-total_calories'], name='windows_team_idx'),
+            models.Index(fields=['span', 'period_start', 'rank'], name='windows_rank_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['span', 'period_start', 'user_email'], name='windows_user_uniq'),
+        ]
+        
+    def __str__(self):
+        return f"{self.user_name} - {self.span} rank {self.rank}"
+
+
+# Maintained by rollups.py
+class ActivityRollup(models.Model):
+    _id = models.ObjectIdField(db_column='_id', primary_key=True)
+    scope = models.CharField(max_length=10)
+    # User email or team name, depending on scope
+    owner = models.CharField(max_length=200)
+    granularity = models.CharField(max_length=10)
+    bucket = models.DateTimeField()
+    activities = models.IntegerField(default=0)
+    calories = models.IntegerField(default=0)
+    distance = models.FloatField(default=0.0)
+    duration_minutes = models.IntegerField(default=0)
+    
+    class Meta:
+        db_table = 'activity_rollups'
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'owner', 'granularity', 'bucket'], name='rollups_bucket_uniq'),
+        ]
+        
+    def __str__(self):
+        return f"{self.scope} {self.owner} - {self.granularity} {self.bucket:%Y-%m-%d}"
+
+
+# Maintained by archive.py: per-user daily totals of each archived chunk
+class ArchivedDay(models.Model):
+    _id = models.ObjectIdField(db_column='_id', primary_key=True)
+    chunk = models.CharField(max_length=50)
+    user_email = models.EmailField()
+    # Start of the UTC day; named like the activity fields it totals for the rebuilds
+    date = models.DateTimeField()
+    activities = models.IntegerField(default=0)
+    calories_burned = models.IntegerField(default=0)
+    distance_km = models.FloatField(default=0.0)
+    duration_minutes = models.IntegerField(default=0)
+    
+    class Meta:
+        db_table = 'archived_days'
+        constraints = [
+            models.UniqueConstraint(fields=['chunk', 'user_email', 'date'], name='archived_days_uniq'),
+        ]
+        
+    def __str__(self):
+        return f"{self.user_email} - {self.date:%Y-%m-%d} in {self.chunk}"
+
+
+# Maintained by changes.py
+class ChangeTombstone(models.Model):
+    _id = models.ObjectIdField(db_column='_id', primary_key=True)
+    # db_table of the collection the document was deleted from
+    collection_name = models.CharField(max_length=50)
+    doc_id = models.CharField(max_length=50)
+    change_version = models.BigIntegerField()
+    
+    class Meta:
+        db_table = 'change_tombstones'
+        indexes = [
+            models.Index(fields=['collection_name', 'change_version'], name='tombstones_version_idx'),
+        ]
+        
+    def __str__(self):
+        return f"{self.collection_name} {self.doc_id} deleted at v{self.change_version}"
+
+
+class Workout(VersionedSave, models.Model):
     _id = models.ObjectIdField(db_column='_id', primary_key=True)
     name = models.CharField(max_length=200)
     description = models.TextField()
@@ -72,9 +222,16 @@ class Workout(models.Model):
     duration_minutes = models.IntegerField()
     category = models.CharField(max_length=100)
     exercises = models.JSONField()
+    # Bumped on every write, see changes.py
+    change_version = models.BigIntegerField(default=0, editable=False)
     
     class Meta:
         db_table = 'workouts'
+        indexes = [
+            models.Index(fields=['fitness_level'], name='workouts_fitness_level_idx'),
+            models.Index(fields=['category'], name='workouts_category_idx'),
+            models.Index(fields=['change_version'], name='workouts_version_idx'),
+        ]
         
     def __str__(self):
         return self.name
@@ -0,0 +1,41 @@
+"""
+Direct pymongo access to the database behind the djongo connection.
+
+The ORM goes through djongo's SQL translation on every call, which is fine for
+ordinary CRUD but too coarse for atomic updates, aggregations and bulk writes.
+Those go through a process-wide ``MongoClient`` (pooled by pymongo itself)
+pointed at whatever database the djongo connection is currently using, so the
+test runner's ``test_`` database is picked up automatically. The client is
+timezone-aware so datetimes read here match what the ORM hands out with
+``USE_TZ`` enabled.
+"""
+import threading
+
+from django.db import connections
+from pymongo import MongoClient
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(alias='default'):
+    """Return the shared ``MongoClient`` for a database alias."""
+    client = _clients.get(alias)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(alias)
+            if client is None:
+                client_settings = connections[alias].settings_dict.get('CLIENT', {})
+                client = MongoClient(tz_aware=True, **client_settings)
+                _clients[alias] = client
+    return client
+
+
+def get_db(alias='default'):
+    """Return the pymongo ``Database`` the ORM is using for ``alias``."""
+    return get_client(alias)[connections[alias].settings_dict['NAME']]
+
+
+def get_collection(model, alias='default'):
+    """Return the pymongo collection backing a djongo model."""
+    return get_db(alias)[model._meta.db_table]
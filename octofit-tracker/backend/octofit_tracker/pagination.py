@@ -0,0 +1,160 @@
+"""
+Keyset (cursor) pagination for the list endpoints.
+
+Each page is fetched with a range filter on the view's ``keyset_ordering``
+fields starting from the last row the client saw, so deep pages cost the
+same as the first one: there is never a skip/offset, only an indexed range
+scan plus ``LIMIT page_size + 1``. Cursors are opaque base64 tokens holding
+the boundary row's key values and the paging direction.
+"""
+import base64
+import json
+from collections import namedtuple
+from datetime import datetime
+
+from bson import ObjectId
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+Cursor = namedtuple('Cursor', ['keys', 'reverse'])
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination on a composite, unique key.
+
+    Views choose the key with a ``keyset_ordering`` tuple such as
+    ``('-date', '_id')``; the last field must be unique so every row has a
+    distinct position. ``?page_size=`` is honoured up to ``max_page_size``.
+    """
+    ordering = ('_id',)
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_ordering(self, request, queryset, view):
+        return tuple(getattr(view, 'keyset_ordering', self.ordering))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        cursor = self.prepare(request, queryset.model, view)
+        return self.page_of(queryset, cursor)
+
+    def page_of(self, queryset, cursor):
+        """Fetch the page of ``queryset`` following ``cursor``, or the first page for ``None``."""
+        reverse = cursor is not None and cursor.reverse
+        if reverse:
+            ordering = [name[1:] if name.startswith('-') else f'-{name}' for name in self.ordering]
+        else:
+            ordering = self.ordering
+
+        queryset = queryset.order_by(*ordering)
+        if cursor is not None:
+            queryset = queryset.filter(self.after(cursor.keys, reverse))
+        return self.finish_page(list(queryset[:self.page_size + 1]), cursor)
+
+    def prepare(self, request, model, view):
+        """Set up the paginator for a request and return its decoded cursor."""
+        self.base_url = request.build_absolute_uri()
+        self.request = request
+        self.configure(model, self.get_ordering(request, None, view))
+        return self.decode_cursor(request)
+
+    def configure(self, model, ordering):
+        """Set the model and keyset ordering; enough for ``page_of()`` and the token helpers."""
+        self.model = model
+        self.ordering = tuple(ordering)
+        self.key_fields = [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+
+    def finish_page(self, rows, cursor):
+        """Trim the ``page_size + 1`` rows fetched in paging order into the page."""
+        reverse = cursor is not None and cursor.reverse
+        has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        return self.page
+
+    def after(self, keys, reverse=False):
+        """Build the ``Q`` for rows strictly past ``keys`` in paging order."""
+        condition = Q()
+        equal = {}
+        for (name, descending), value in zip(self.key_fields, keys):
+            lookup = 'lt' if descending != reverse else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def mongo_sort(self, reverse=False):
+        """The keyset ordering as a pymongo sort specification."""
+        return [
+            (self.model._meta.get_field(name).column, -1 if descending != reverse else 1)
+            for name, descending in self.key_fields
+        ]
+
+    def mongo_after(self, keys, reverse=False):
+        """``after()`` as a raw MongoDB filter, for paths that bypass the ORM."""
+        clauses = []
+        equal = {}
+        for (name, descending), value in zip(self.key_fields, keys):
+            column = self.model._meta.get_field(name).column
+            operator = '$lt' if descending != reverse else '$gt'
+            clauses.append({**equal, column: {operator: value}})
+            equal[column] = value
+        return {'$or': clauses}
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(Cursor(self.row_keys(self.page[-1]), reverse=False))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(Cursor(self.row_keys(self.page[0]), reverse=True))
+
+    def row_keys(self, row):
+        return [getattr(row, name) for name, _ in self.key_fields]
+
+    def encode_cursor(self, cursor):
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_token(cursor))
+
+    def encode_token(self, cursor):
+        keys = [
+            value.isoformat() if isinstance(value, datetime)
+            else str(value) if isinstance(value, ObjectId)
+            else value
+            for value in cursor.keys
+        ]
+        payload = json.dumps({'k': keys, 'r': int(cursor.reverse)}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode('ascii')).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, request):
+        return self.decode_token(request.query_params.get(self.cursor_query_param))
+
+    def decode_token(self, token):
+        """Turn a cursor token back into a ``Cursor`` of typed key values, or ``None``."""
+        if not token:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+            raw_keys = payload['k']
+            if len(raw_keys) != len(self.key_fields):
+                raise ValueError(token)
+            keys = [
+                self.model._meta.get_field(name).to_python(value)
+                for (name, _), value in zip(self.key_fields, raw_keys)
+            ]
+            return Cursor(keys, reverse=bool(payload.get('r')))
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
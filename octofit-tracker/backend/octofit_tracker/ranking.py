@@ -0,0 +1,94 @@
+"""
+Rank bookkeeping shared by the leaderboard and the team standings.
+
+Both collections order rows by ``-total_calories`` with a unique string key
+as tie-breaker (``user_email`` for leaderboard rows, ``name`` for teams) and
+store ``rank`` as the 1-based position in that order. A change in one row's
+calories only moves the rows it overtakes or falls behind, so ranks are
+kept current with a couple of range updates instead of a renumbering.
+
+Collections holding several independent rankings (one per leaderboard
+window) pass a ``partition`` filter selecting the ranking to work on.
+
+Rows whose rank changes get a new change version (``versions.py``).
+"""
+from .versions import stamped, version_stages
+
+
+def ahead_of(calories, key, key_field, partition=None):
+    """Filter for rows ranked ahead of the row keyed ``(calories, key)``."""
+    return {**(partition or {}), '$or': [
+        {'total_calories': {'$gt': calories}},
+        {'total_calories': calories, key_field: {'$lt': key}},
+    ]}
+
+
+def behind(calories, key, key_field, partition=None):
+    """Filter for rows ranked behind the row keyed ``(calories, key)``."""
+    return {**(partition or {}), '$or': [
+        {'total_calories': {'$lt': calories}},
+        {'total_calories': calories, key_field: {'$gt': key}},
+    ]}
+
+
+def shift_ranks(collection, row_id, key_field, key, old_calories, new_calories, partition=None):
+    """Move row ``row_id`` from ``old_calories`` to ``new_calories`` in rank order."""
+    if new_calories > old_calories:
+        # Rows that were ahead of us and are now behind drop one place.
+        passed = {'$and': [ahead_of(old_calories, key, key_field, partition),
+                           behind(new_calories, key, key_field, partition)]}
+        shifted = collection.update_many(passed, stamped(collection.name, {'$inc': {'rank': 1}})).modified_count
+        if shifted:
+            collection.update_one({'_id': row_id}, stamped(collection.name, {'$inc': {'rank': -shifted}}))
+    elif new_calories < old_calories:
+        # Rows that were behind us and are now ahead move up one place.
+        passed = {'$and': [behind(old_calories, key, key_field, partition),
+                           ahead_of(new_calories, key, key_field, partition)]}
+        shifted = collection.update_many(passed, stamped(collection.name, {'$inc': {'rank': -1}})).modified_count
+        if shifted:
+            collection.update_one({'_id': row_id}, stamped(collection.name, {'$inc': {'rank': shifted}}))
+
+
+def slot_in(collection, row_id, key_field, key, calories, partition=None):
+    """Give a newly inserted row its rank, pushing the rows behind it down one place."""
+    collection.update_many(behind(calories, key, key_field, partition),
+                           stamped(collection.name, {'$inc': {'rank': 1}}))
+    rank = collection.count_documents(ahead_of(calories, key, key_field, partition)) + 1
+    collection.update_one({'_id': row_id}, stamped(collection.name, {'$set': {'rank': rank}}))
+
+
+def neighbourhood(collection, key_field, key, radius, projection, partition=None):
+    """
+    ``(rank, rows)`` for the row keyed ``key`` and the rows up to ``radius`` places either side of it.
+
+    Two indexed reads (the key, then a ``rank`` range), so the cost does not
+    grow with the ranking. Returns ``None`` if there is no such row.
+    """
+    partition = partition or {}
+    row = collection.find_one({**partition, key_field: key}, {'rank': 1})
+    if row is None:
+        return None
+    rank = row['rank']
+    rows = collection.find({**partition, 'rank': {'$gte': rank - radius, '$lte': rank + radius}}, projection)
+    return rank, list(rows.sort('rank', 1))
+
+
+def rank_stage(key_field):
+    """``$setWindowFields`` stage numbering rows in rank order."""
+    return {'$setWindowFields': {
+        'sortBy': {'total_calories': -1, key_field: 1},
+        'output': {'rank': {'$documentNumber': {}}},
+    }}
+
+
+def rerank(collection, key_field, partition=None):
+    """Renumber ``rank`` across a collection (or one partition of it) in one server-side pass."""
+    stages = [{'$match': partition}] if partition else []
+    stages += [
+        {'$project': {'total_calories': {'$ifNull': ['$total_calories', 0]}, key_field: 1}},
+        rank_stage(key_field),
+        {'$project': {'rank': 1}},
+        *version_stages(collection.name),
+        {'$merge': {'into': collection.name, 'on': '_id', 'whenMatched': 'merge', 'whenNotMatched': 'discard'}},
+    ]
+    collection.aggregate(stages, allowDiskUse=True)
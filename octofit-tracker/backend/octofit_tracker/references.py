@@ -0,0 +1,139 @@
+"""
+ObjectId references between activities, users and teams.
+
+``Activity.user_id`` points at the activity's user and ``User.team_id`` at
+the user's team. The ``user_email`` and ``team`` strings stay as
+denormalized copies for the existing indexes and filters, but joins go
+through the references: an enriched page of activities resolves its users
+and teams with one batched ``$in`` query each, and renaming a team finds
+its members through ``users.team_id`` instead of matching strings.
+
+Writes resolve references as they happen (``signals.py``, ``ingest.py``);
+``backfill_references()`` fills them in for documents written before.
+"""
+from pymongo import UpdateMany
+
+from .cache import invalidate
+from .models import Activity, ActivityRollup, Leaderboard, LeaderboardWindow, Team, User
+from .mongo import get_collection
+from .versions import stamped, writes
+
+
+def user_ids(emails):
+    """Map each of ``emails`` to its user's id (unknown emails are left out)."""
+    if not emails:
+        return {}
+    users = get_collection(User).find({'email': {'$in': list(emails)}}, {'email': 1})
+    return {user['email']: user['_id'] for user in users}
+
+
+def team_ids(names):
+    """Map each of ``names`` to its team's id (unknown names are left out)."""
+    if not names:
+        return {}
+    teams = get_collection(Team).find({'name': {'$in': list(names)}}, {'name': 1})
+    return {team['name']: team['_id'] for team in teams}
+
+
+def _by_id_or_key(collection, ids, key_field, keys, projection):
+    """Documents with one of ``ids``, or with ``key_field`` in ``keys`` for rows without a reference."""
+    clauses = [{'_id': {'$in': list(ids)}}] if ids else []
+    if keys:
+        clauses.append({key_field: {'$in': list(keys)}})
+    if not clauses:
+        return []
+    return list(collection.find({'$or': clauses}, projection))
+
+
+def enrich_activities(activities):
+    """
+    Attach ``user_summary`` and ``team_summary`` dicts to a page of activities.
+
+    Two queries whatever the page size: the users by ``user_id`` and the
+    teams by those users' ``team_id``. Rows not backfilled yet fall back to
+    matching ``user_email`` and the user's ``team`` name in the same
+    queries. Unknown users or teams give ``None``.
+    """
+    users = _by_id_or_key(
+        get_collection(User),
+        {activity.user_id for activity in activities if activity.user_id},
+        'email', {activity.user_email for activity in activities if not activity.user_id},
+        {'name': 1, 'email': 1, 'team': 1, 'team_id': 1},
+    )
+    users_by_id = {user['_id']: user for user in users}
+    users_by_email = {user['email']: user for user in users}
+
+    teams = _by_id_or_key(
+        get_collection(Team),
+        {user['team_id'] for user in users if user.get('team_id')},
+        'name', {user['team'] for user in users if not user.get('team_id') and user.get('team')},
+        {'name': 1},
+    )
+    teams_by_id = {team['_id']: team for team in teams}
+    teams_by_name = {team['name']: team for team in teams}
+
+    for activity in activities:
+        user = users_by_id.get(activity.user_id) or users_by_email.get(activity.user_email)
+        team = None
+        if user is not None:
+            team = teams_by_id.get(user.get('team_id')) or teams_by_name.get(user.get('team'))
+        activity.user_summary = user and {'id': str(user['_id']), 'name': user['name'], 'email': user['email']}
+        activity.team_summary = team and {'id': str(team['_id']), 'name': team['name']}
+    return activities
+
+
+def link_team_members(team_id, name):
+    """Point users that name a team at it; for teams created after their members."""
+    get_collection(User).update_many({'team': name, 'team_id': {'$ne': team_id}}, {'$set': {'team_id': team_id}})
+
+
+def unlink_team_members(team_id):
+    get_collection(User).update_many({'team_id': team_id}, {'$set': {'team_id': None}})
+
+
+@writes
+def team_renamed(team_id, old_name, new_name):
+    """Carry a team rename into the name copies, finding the members by reference."""
+    users = get_collection(User)
+    users.update_many({'team_id': team_id}, stamped(users.name, {'$set': {'team': new_name}}))
+    leaderboard = get_collection(Leaderboard)
+    leaderboard.update_many({'team': old_name}, stamped(leaderboard.name, {'$set': {'team': new_name}}))
+    get_collection(LeaderboardWindow).update_many({'team': old_name}, {'$set': {'team': new_name}})
+    get_collection(ActivityRollup).update_many({'scope': 'team', 'owner': old_name}, {'$set': {'owner': new_name}})
+    invalidate('leaderboard')
+
+
+def _run_batches(collection, operations, batch_size):
+    """``bulk_write`` an iterable of operations in unordered batches; returns the documents modified."""
+    modified, batch = 0, []
+    for operation in operations:
+        batch.append(operation)
+        if len(batch) >= batch_size:
+            modified += collection.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        modified += collection.bulk_write(batch, ordered=False).modified_count
+    return modified
+
+
+def backfill_references(batch_size=1000):
+    """
+    Set ``User.team_id`` and ``Activity.user_id`` from the name and email copies.
+
+    Works through teams and users in ``_id`` order, one ``UpdateMany`` per
+    team or user sent in unordered batches of ``batch_size``; documents
+    already pointing at the right id are skipped, so it can be re-run or
+    resumed. Returns the number of users and activities updated.
+    """
+    teams = get_collection(Team).find({}, {'name': 1}).sort('_id')
+    users_updated = _run_batches(get_collection(User), (
+        UpdateMany({'team': team['name'], 'team_id': {'$ne': team['_id']}}, {'$set': {'team_id': team['_id']}})
+        for team in teams
+    ), batch_size)
+
+    users = get_collection(User).find({}, {'email': 1}).sort('_id').batch_size(batch_size)
+    activities_updated = _run_batches(get_collection(Activity), (
+        UpdateMany({'user_email': user['email'], 'user_id': {'$ne': user['_id']}}, {'$set': {'user_id': user['_id']}})
+        for user in users
+    ), batch_size)
+    return {'users': users_updated, 'activities': activities_updated}
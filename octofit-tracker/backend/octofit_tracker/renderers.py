@@ -0,0 +1,111 @@
+"""
+Extra renderers for the API.
+
+``ORJSONRenderer`` is the default JSON renderer: compact UTF-8 output like
+DRF's ``JSONRenderer``, encoded by orjson. U+2028 and U+2029 are escaped as
+DRF does, since they end a line in JavaScript. The output is not
+byte-for-byte DRF's: floats in exponent form have no ``+`` or leading zero
+(``1e16``, not ``1e+16``), and NaN and infinities render as ``null``
+where DRF refuses them. Both parse to the same values. ``MessagePackRenderer`` adds
+``application/msgpack`` (``?format=msgpack``) for clients that want a
+smaller binary body. Both encode datetimes and ObjectIds themselves, so
+data that bypasses the serializers' string conversion still renders.
+
+The NDJSON and CSV renderers mainly exist so DRF's content negotiation
+(``?format=`` or ``Accept``) can select them for the streaming export
+endpoints, which write their own ``StreamingHttpResponse``. ``render()``
+covers the ordinary responses those endpoints can still return, such as
+validation errors.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+
+import msgpack
+import orjson
+from bson import ObjectId
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+_fallback = JSONEncoder()
+
+
+def encode_default(value):
+    """Types orjson and msgpack do not handle natively, as DRF's encoder would render them."""
+    if isinstance(value, ObjectId):
+        return str(value)
+    return _fallback.default(value)
+
+
+def orjson_dumps(data, indent=False):
+    """Compact UTF-8 JSON; UTC datetimes end in ``Z`` like DRF's encoder renders them."""
+    option = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+    if indent:
+        option |= orjson.OPT_INDENT_2
+    # orjson leaves the JavaScript line terminators unescaped
+    return orjson.dumps(data, default=encode_default, option=option) \
+        .replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class ORJSONRenderer(BaseRenderer):
+    """JSON encoded with orjson; indented when asked to be (e.g. by the browsable API)."""
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        indent = (renderer_context or {}).get('indent') or 'indent=' in (accepted_media_type or '')
+        return orjson_dumps(data, indent=bool(indent))
+
+
+def _msgpack_default(value):
+    if isinstance(value, datetime) and value.tzinfo is None:
+        # msgpack's timestamp extension needs an aware datetime
+        return _fallback.default(value)
+    return encode_default(value)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """MessagePack; aware datetimes use the msgpack timestamp extension."""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_msgpack_default, datetime=True, use_bin_type=True)
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Newline-delimited JSON: one object per line."""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(json.dumps(row, cls=JSONEncoder) + '\n' for row in rows).encode(self.charset)
+
+
+class CSVRenderer(BaseRenderer):
+    """Comma-separated values with a header row taken from the first row's keys."""
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not data:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+        return buffer.getvalue().encode(self.charset)
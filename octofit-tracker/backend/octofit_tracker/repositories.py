@@ -0,0 +1,90 @@
+"""
+Direct-to-Mongo read paths for the hottest API endpoints.
+
+Each function runs a single indexed pymongo query on the shared client from
+``mongo.py`` and turns the documents into ordinary model instances with
+``Model.from_db``, so the existing serializers render them exactly as they
+would ORM results. This skips djongo's per-call SQL parsing
+and translation, which dominates the cost of these small reads.
+"""
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING
+
+from .models import Activity, Leaderboard, Team, User
+from .mongo import get_collection
+from .ranking import neighbourhood
+
+
+def model_projection(model, names=None):
+    """Projection selecting a model's concrete fields, or only those in ``names``."""
+    return {field.column: 1 for field in model._meta.concrete_fields if names is None or field.name in names}
+
+
+def model_instance(model, doc):
+    """Build a model instance from a raw document, as if the ORM had loaded it."""
+    fields = model._meta.concrete_fields
+    return model.from_db('default', [field.attname for field in fields],
+                         [doc.get(field.column) for field in fields])
+
+
+def model_instances(model, cursor):
+    return [model_instance(model, doc) for doc in cursor]
+
+
+def top_leaderboard(limit, names=None):
+    """Top ``limit`` leaderboard rows in leaderboard order, optionally loading only fields ``names``."""
+    cursor = get_collection(Leaderboard).find({}, model_projection(Leaderboard, names)).sort(
+        [('total_calories', DESCENDING), ('user_email', ASCENDING)]).limit(limit)
+    return model_instances(Leaderboard, cursor)
+
+
+def leaderboard_around(email, radius):
+    """``(rank, rows)`` for a user and the ``radius`` leaderboard rows either side, or ``None``."""
+    found = neighbourhood(get_collection(Leaderboard), 'user_email', email, radius, model_projection(Leaderboard))
+    if found is None:
+        return None
+    rank, documents = found
+    return rank, model_instances(Leaderboard, documents)
+
+
+def recent_activities(limit, names=None):
+    """The ``limit`` most recent activities across all users."""
+    cursor = get_collection(Activity).find({}, model_projection(Activity, names)).sort(
+        [('date', DESCENDING), ('_id', ASCENDING)]).limit(limit)
+    return model_instances(Activity, cursor)
+
+
+def activities_for_user(email, names=None):
+    """All activities of one user, newest first."""
+    cursor = get_collection(Activity).find({'user_email': email}, model_projection(Activity, names)).sort(
+        'date', DESCENDING)
+    return model_instances(Activity, cursor)
+
+
+def user_by_email(email):
+    """The user with ``email``, or ``None``."""
+    doc = get_collection(User).find_one({'email': email}, model_projection(User))
+    return model_instance(User, doc) if doc is not None else None
+
+
+def team_by_id(pk):
+    """One team by primary key, or ``None`` (also for a malformed id)."""
+    try:
+        object_id = ObjectId(pk)
+    except (InvalidId, TypeError):
+        return None
+    doc = get_collection(Team).find_one({'_id': object_id}, model_projection(Team))
+    return model_instance(Team, doc) if doc is not None else None
+
+
+def team_standings():
+    """Every team in rank order, from the denormalized aggregates."""
+    cursor = get_collection(Team).find({}, model_projection(Team)).sort(
+        [('total_calories', DESCENDING), ('name', ASCENDING)])
+    return model_instances(Team, cursor)
+
+
+def users_in_team(name):
+    """Members of a team, via the ``users.team`` index."""
+    return model_instances(User, get_collection(User).find({'team': name}, model_projection(User)))
@@ -0,0 +1,204 @@
+"""
+Time-bucketed activity rollups.
+
+``activity_rollups`` holds one document per ``(scope, owner, granularity,
+bucket)``: the activity count, calories, distance and duration of a user
+(``scope='user'``, owner = email) or a team (``scope='team'``, owner = team
+name) over one UTC day, ISO week (starting Monday) or calendar month. Trend
+queries read only those documents, so their cost follows the number of
+buckets in the range rather than the activity volume.
+
+Activity writes are folded in as signed deltas with one unordered
+``bulk_write`` of ``$inc`` upserts (``record_activities()``). An activity
+counts towards its owner's current team, as in a rebuild: when a user
+joins, leaves or changes team, ``move_team_rollups()`` carries the user's
+buckets across, so later deltas for older activities land on the team
+that holds them. ``rebuild_rollups()`` recomputes buckets from the activities collection
+and the archived daily totals (``archive.py``) with ``$dateTrunc``
+aggregations, for backfilling and repairing drift.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING, UpdateOne
+
+from .archive import union_stage
+from .indexes import ensure_indexes
+from .models import Activity, ActivityRollup, User
+from .mongo import get_collection
+from .repositories import model_instances, model_projection
+
+SCOPES = ('user', 'team')
+GRANULARITIES = ('day', 'week', 'month')
+TOTALS = ('activities', 'calories', 'distance', 'duration_minutes')
+
+
+def bucket_start(date, granularity):
+    """Start of the UTC day, ISO week or month containing ``date``."""
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    day = datetime(*date.astimezone(timezone.utc).timetuple()[:3], tzinfo=timezone.utc)
+    if granularity == 'day':
+        return day
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    raise ValueError(f'Unknown granularity: {granularity}')
+
+
+def user_teams(emails):
+    """Map each of ``emails`` to its user's team (missing users are left out)."""
+    if not emails:
+        return {}
+    users = get_collection(User).find({'email': {'$in': list(emails)}}, {'email': 1, 'team': 1})
+    return {user['email']: user.get('team', '') for user in users}
+
+
+def record_activities(entries):
+    """
+    Fold activity deltas into the rollups.
+
+    ``entries`` are ``(user_email, date, activities, calories, distance,
+    duration_minutes)`` tuples, negative for removals. Deltas landing in
+    the same bucket are combined first, so an edit that does not move an
+    activity between buckets writes only the difference.
+    """
+    totals = defaultdict(lambda: [0, 0, 0.0, 0])
+    entries = list(entries)
+    teams = user_teams({entry[0] for entry in entries})
+    for email, date, *delta in entries:
+        owners = [('user', email)]
+        if teams.get(email):
+            owners.append(('team', teams[email]))
+        for granularity in GRANULARITIES:
+            bucket = bucket_start(date, granularity)
+            for scope, owner in owners:
+                total = totals[(scope, owner, granularity, bucket)]
+                for position, value in enumerate(delta):
+                    total[position] += value
+
+    operations = [
+        UpdateOne(
+            {'scope': scope, 'owner': owner, 'granularity': granularity, 'bucket': bucket},
+            {'$inc': {
+                'activities': activities,
+                'calories': calories,
+                'distance': distance,
+                'duration_minutes': duration,
+            }},
+            upsert=True,
+        )
+        for (scope, owner, granularity, bucket), (activities, calories, distance, duration) in totals.items()
+        if activities or calories or distance or duration
+    ]
+    if operations:
+        get_collection(ActivityRollup).bulk_write(operations, ordered=False)
+
+
+def move_team_rollups(email, old_team, new_team):
+    """Move a user's share of the team buckets from ``old_team`` to ``new_team`` (either may be empty)."""
+    if old_team == new_team:
+        return
+    rollups = get_collection(ActivityRollup)
+    operations = []
+    for bucket in rollups.find({'scope': 'user', 'owner': email}):
+        for team, sign in [(old_team, -1), (new_team, 1)]:
+            if not team:
+                continue
+            operations.append(UpdateOne(
+                {'scope': 'team', 'owner': team, 'granularity': bucket['granularity'], 'bucket': bucket['bucket']},
+                {'$inc': {field: sign * bucket.get(field, 0) for field in TOTALS}},
+                upsert=True,
+            ))
+    if operations:
+        rollups.bulk_write(operations, ordered=False)
+        if old_team:
+            # Buckets left without activities are not rebuilt either
+            rollups.delete_many({'scope': 'team', 'owner': old_team, 'activities': {'$lte': 0}})
+
+
+def _bucket_pipeline(scope, granularity, start=None):
+    """Aggregation over activities, archived days included, producing one granularity's buckets for one scope."""
+    match = {'date': {'$gte': start}} if start else None
+    stages = [{'$match': match}] if match else []
+    stages.append(union_stage(match))
+    if scope == 'team':
+        stages += [
+            {'$lookup': {
+                'from': User._meta.db_table,
+                'localField': 'user_email',
+                'foreignField': 'email',
+                'pipeline': [{'$project': {'_id': 0, 'team': 1}}],
+                'as': 'user',
+            }},
+            {'$set': {'owner': {'$ifNull': [{'$first': '$user.team'}, '']}}},
+            {'$match': {'owner': {'$ne': ''}}},
+        ]
+    else:
+        stages.append({'$set': {'owner': '$user_email'}})
+
+    truncate = {'date': '$date', 'unit': granularity}
+    if granularity == 'week':
+        truncate['startOfWeek'] = 'monday'
+    stages += [
+        {'$group': {
+            '_id': {'owner': '$owner', 'bucket': {'$dateTrunc': truncate}},
+            'activities': {'$sum': {'$ifNull': ['$activities', 1]}},
+            'calories': {'$sum': '$calories_burned'},
+            'distance': {'$sum': {'$ifNull': ['$distance_km', 0]}},
+            'duration_minutes': {'$sum': '$duration_minutes'},
+        }},
+        {'$project': {
+            '_id': 0,
+            'scope': {'$literal': scope},
+            'owner': '$_id.owner',
+            'granularity': {'$literal': granularity},
+            'bucket': '$_id.bucket',
+            'activities': 1,
+            'calories': 1,
+            'distance': 1,
+            'duration_minutes': 1,
+        }},
+        {'$merge': {
+            'into': ActivityRollup._meta.db_table,
+            'on': ['scope', 'owner', 'granularity', 'bucket'],
+            'whenMatched': 'replace',
+            'whenNotMatched': 'insert',
+        }},
+    ]
+    return stages
+
+
+def rebuild_rollups(since=None):
+    """
+    Recompute rollup buckets from the activities collection.
+
+    With a ``since`` datetime only buckets from the one containing it
+    onwards are rebuilt. Requires the ``rollups_bucket_uniq`` index, which
+    ``$merge`` matches on; it is created if missing. Returns the number of
+    rollup documents afterwards.
+    """
+    rollups = get_collection(ActivityRollup)
+    ensure_indexes(ActivityRollup)
+    activities = get_collection(Activity)
+    for granularity in GRANULARITIES:
+        start = bucket_start(since, granularity) if since else None
+        rollups.delete_many({'granularity': granularity, **({'bucket': {'$gte': start}} if start else {})})
+        for scope in SCOPES:
+            activities.aggregate(_bucket_pipeline(scope, granularity, start), allowDiskUse=True)
+    return rollups.estimated_document_count()
+
+
+def timeseries(scope, owner, granularity, start=None, end=None):
+    """Rollup documents of one owner in bucket order, for buckets overlapping ``[start, end]``."""
+    query = {'scope': scope, 'owner': owner, 'granularity': granularity}
+    bounds = {}
+    if start is not None:
+        bounds['$gte'] = bucket_start(start, granularity)
+    if end is not None:
+        bounds['$lte'] = end
+    if bounds:
+        query['bucket'] = bounds
+    cursor = get_collection(ActivityRollup).find(query, model_projection(ActivityRollup)).sort('bucket', ASCENDING)
+    return model_instances(ActivityRollup, cursor)
@@ -0,0 +1,320 @@
+"""
+In-memory search over users, teams and workouts.
+
+Each process holds an inverted index from normalised tokens (lowercased,
+accents stripped, split on anything that is not a letter or digit) to the
+documents containing them, weighted by field: a match in a name counts for
+more than one in an email, team, description or category. A query term
+matches indexed tokens exactly, as a prefix (through a sorted token list
+and ``bisect``, expanding to at most ``MAX_EXPANSIONS`` tokens), or with
+one typo: an insertion, deletion, substitution or transposition, found
+through a map of single-character deletions. Every term must match;
+documents are ranked by their summed scores. A single term is answered by
+lazily merging its tokens' postings, kept in rank order, until ``limit``
+results are found; several terms intersect their postings as sets and
+score only the documents left. ``limit=None`` returns every match, with
+prefixes expanded to all their tokens (the admin filters on the complete
+set). No query touches MongoDB.
+
+The index is built on first use (``wsgi.py``/``asgi.py`` warm it at
+startup in a background thread). ORM saves and deletes in this process
+update it through signals. Writes made by other processes or by raw
+pymongo code are picked up from the per-collection change versions
+(``versions.py``): at most once every ``REFRESH_SECONDS`` a query reads
+the three counters and applies the changed documents and tombstones since
+the versions it holds, or reloads a collection after a bulk reset.
+"""
+import bisect
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict, namedtuple
+
+from .changes import changes_since
+from .models import Team, User, Workout
+from .mongo import get_collection, get_db
+from .versions import VERSIONS_COLLECTION, state_from
+
+# kind: (model, {field: weight}, field shown under the name in results)
+KINDS = {
+    'users': (User, {'name': 3, 'email': 2, 'team': 1}, 'email'),
+    'teams': (Team, {'name': 3, 'description': 1}, 'description'),
+    'workouts': (Workout, {'name': 3, 'description': 1, 'category': 1}, 'category'),
+}
+EXACT = 1.0
+FUZZY = 0.4
+MAX_EXPANSIONS = 50
+MIN_FUZZY_LENGTH = 4
+REFRESH_SECONDS = 1.0
+DEFAULT_LIMIT = 20
+
+Entry = namedtuple('Entry', ['kind', 'doc_id', 'name', 'subtitle', 'weights'])
+
+
+def tokenize(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+    return re.findall(r'[^\W_]+', text)
+
+
+def _variants(token):
+    """The token and its single-character deletions, for typo matching."""
+    if len(token) < MIN_FUZZY_LENGTH:
+        return {token}
+    return {token} | {token[:index] + token[index + 1:] for index in range(len(token))}
+
+
+def within_one_edit(a, b):
+    """Whether ``a`` and ``b`` differ by at most one insertion, deletion, substitution or transposition."""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        diffs = [index for index in range(len(a)) if a[index] != b[index]]
+        if len(diffs) <= 1:
+            return True
+        first, second = diffs[0], diffs[-1]
+        return len(diffs) == 2 and second == first + 1 and a[first] == b[second] and a[second] == b[first]
+    if len(a) > len(b):
+        a, b = b, a
+    index = 0
+    while index < len(a) and a[index] == b[index]:
+        index += 1
+    return a[index:] == b[index + 1:]
+
+
+class SearchIndex:
+    """
+    Inverted index of ``(kind, id)`` documents; every method is thread-safe.
+
+    Postings refer to documents by a small integer number rather than the
+    ``(kind, id)`` key, so the set operations of a query hash ints.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.numbers = {}
+            self.documents = {}
+            self.next_number = 0
+            self.postings = {}
+            self.tokens = []
+            self.variants = defaultdict(set)
+            # token: postings in rank order, built on first single-term query
+            self.ranked = {}
+            self.versions = {}
+            self.checked = 0.0
+
+    @property
+    def built(self):
+        return len(self.versions) == len(KINDS)
+
+    def add(self, kind, doc_id, fields, bulk=False):
+        """
+        Index (or re-index) a document from a dict or object holding its fields.
+
+        ``bulk`` leaves the sorted token list stale; the caller re-sorts it
+        once with ``self.tokens = sorted(self.postings)`` when done.
+        """
+        get = fields.get if isinstance(fields, dict) else lambda name: getattr(fields, name, None)
+        _, field_weights, subtitle = KINDS[kind]
+        weights = {}
+        for field, weight in field_weights.items():
+            for token in tokenize(get(field)):
+                weights[token] = max(weights.get(token, 0), weight)
+
+        with self.lock:
+            self.remove(kind, doc_id, bulk)
+            number = self.numbers[(kind, str(doc_id))] = self.next_number
+            self.next_number += 1
+            self.documents[number] = Entry(kind, str(doc_id), get('name') or '', get(subtitle) or '', weights)
+            for token, weight in weights.items():
+                postings = self.postings.get(token)
+                if postings is None:
+                    postings = self.postings[token] = {}
+                    if not bulk:
+                        bisect.insort(self.tokens, token)
+                    for variant in _variants(token):
+                        self.variants[variant].add(token)
+                postings[number] = weight
+                self.ranked.pop(token, None)
+
+    def remove(self, kind, doc_id, bulk=False):
+        with self.lock:
+            number = self.numbers.pop((kind, str(doc_id)), None)
+            if number is None:
+                return
+            entry = self.documents.pop(number)
+            for token in entry.weights:
+                self.ranked.pop(token, None)
+                postings = self.postings[token]
+                del postings[number]
+                if postings:
+                    continue
+                del self.postings[token]
+                if not bulk:
+                    del self.tokens[bisect.bisect_left(self.tokens, token)]
+                for variant in _variants(token):
+                    self.variants[variant].discard(token)
+                    if not self.variants[variant]:
+                        del self.variants[variant]
+
+    def _matches(self, term, expansions=MAX_EXPANSIONS):
+        """``{token: quality}`` of indexed tokens matching ``term`` exactly, as a prefix or with one typo."""
+        matches = {}
+        start = bisect.bisect_left(self.tokens, term)
+        end = None if expansions is None else start + expansions
+        for token in self.tokens[start:end]:
+            if not token.startswith(term):
+                break
+            # Prefixes rank below exact matches, closer to them the more of the token they cover
+            matches[token] = EXACT if token == term else 0.5 + 0.4 * len(term) / len(token)
+        if len(term) >= MIN_FUZZY_LENGTH:
+            for variant in _variants(term):
+                for token in self.variants.get(variant, ()):
+                    if token not in matches and within_one_edit(term, token):
+                        matches[token] = FUZZY
+        return matches
+
+    def _ranked_postings(self, token, quality):
+        """A token's postings as ``(-score, name, number)`` in rank order; the order is cached per token."""
+        ranked = self.ranked.get(token)
+        if ranked is None:
+            ranked = self.ranked[token] = sorted(
+                (-weight, self.documents[number].name, number) for number, weight in self.postings[token].items())
+        return ((weight * quality, name, number) for weight, name, number in ranked)
+
+    def _top_one(self, matches, kinds, limit):
+        """Top documents for a single term: a lazy merge of its tokens' ranked postings, stopped at ``limit``."""
+        streams = [self._ranked_postings(token, quality) for token, quality in matches.items()]
+        top, seen = [], set()
+        for negated, _, number in heapq.merge(*streams):
+            # A document's first appearance is its best-scoring token
+            if number in seen or (kinds is not None and self.documents[number].kind not in kinds):
+                continue
+            seen.add(number)
+            top.append((number, -negated))
+            if len(top) == limit:
+                break
+        return top
+
+    def _top_all(self, matched, kinds, limit):
+        """Top documents matching every term: set intersections first, then scoring of what is left."""
+        ordered = sorted(matched, key=lambda matches: sum(len(self.postings[token]) for token in matches))
+        candidates = set().union(*(self.postings[token].keys() for token in ordered[0]))
+        for matches in ordered[1:]:
+            # dict-view & set iterates whichever side is smaller
+            candidates = set().union(*(self.postings[token].keys() & candidates for token in matches))
+            if not candidates:
+                return []
+
+        scores = {}
+        for number in candidates:
+            entry = self.documents[number]
+            if kinds is not None and entry.kind not in kinds:
+                continue
+            weights = entry.weights
+            scores[number] = sum(
+                max(matches[token] * weight for token, weight in weights.items() if token in matches)
+                for matches in matched
+            )
+
+        def rank(item):
+            return -item[1], self.documents[item[0]].name, item[0]
+
+        if limit is None:
+            return sorted(scores.items(), key=rank)
+        return heapq.nsmallest(limit, scores.items(), key=rank)
+
+    def search(self, query, kinds=None, limit=DEFAULT_LIMIT):
+        """Ranked result dicts for ``query``, optionally limited to some kinds; ``limit=None`` for every match."""
+        expansions = MAX_EXPANSIONS if limit is not None else None
+        with self.lock:
+            matched = [self._matches(term, expansions) for term in dict.fromkeys(tokenize(query))]
+            if not matched or not all(matched):
+                return []
+            if len(matched) == 1:
+                ranked = self._top_one(matched[0], kinds, limit)
+            else:
+                ranked = self._top_all(matched, kinds, limit)
+            entries = [(self.documents[number], score) for number, score in ranked]
+            return [
+                {'type': entry.kind, 'id': entry.doc_id, 'name': entry.name, 'subtitle': entry.subtitle,
+                 'score': round(score, 3)}
+                for entry, score in entries
+            ]
+
+    def ensure_current(self):
+        """Build the index, or apply other processes' writes if the counters were last read long enough ago."""
+        if self.built and time.monotonic() - self.checked < REFRESH_SECONDS:
+            return
+        with self.lock:
+            if self.built and time.monotonic() - self.checked < REFRESH_SECONDS:
+                return
+            tables = {model._meta.db_table: kind for kind, (model, _, _) in KINDS.items()}
+            states = {
+                document['_id']: state_from(document)
+                for document in get_db()[VERSIONS_COLLECTION].find({'_id': {'$in': list(tables)}})
+            }
+            for table, kind in tables.items():
+                self._catch_up(kind, *states.get(table, state_from(None)))
+            self.checked = time.monotonic()
+
+    def _catch_up(self, kind, version, modified, floor):
+        seen = self.versions.get(kind)
+        if seen == version and seen >= floor:
+            return
+        model, field_weights, subtitle = KINDS[kind]
+        names = sorted({'name', subtitle, *field_weights})
+        found = changes_since(model, seen, names) if seen is not None and seen >= floor else None
+        if found is None:
+            self._load(kind, model, names)
+        else:
+            instances, deleted = found
+            for instance in instances:
+                self.add(kind, instance.pk, instance)
+            for doc_id in deleted:
+                self.remove(kind, doc_id)
+        self.versions[kind] = version
+
+    def _load(self, kind, model, names):
+        for key in [key for key in self.numbers if key[0] == kind]:
+            self.remove(*key, bulk=True)
+        for document in get_collection(model).find({}, {name: 1 for name in names}):
+            self.add(kind, document['_id'], document, bulk=True)
+        self.tokens = sorted(self.postings)
+
+
+index = SearchIndex()
+
+
+def search(query, kinds=None, limit=DEFAULT_LIMIT):
+    index.ensure_current()
+    return index.search(query, kinds, limit)
+
+
+def kind_of(model):
+    for kind, (indexed, _, _) in KINDS.items():
+        if indexed is model:
+            return kind
+    return None
+
+
+def document_saved(model, instance):
+    """Signal hook: re-index a saved document, if the index has been built."""
+    if index.built:
+        index.add(kind_of(model), instance.pk, instance)
+
+
+def document_deleted(model, instance):
+    if index.built:
+        index.remove(kind_of(model), instance.pk)
+
+
+def warm_in_background():
+    """Build the index in a daemon thread, so the first search does not wait for it."""
+    threading.Thread(target=index.ensure_current, name='search-index-warmup', daemon=True).start()
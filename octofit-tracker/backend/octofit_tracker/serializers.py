@@ -1,43 +1,153 @@
-from rest_framework import serializers
-from .models import User, Team, Activity, Leaderboard, Workout
+from operator import attrgetter
 
+from django.db import models
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+from .fieldsets import SparseFieldsMixin
+from .instrumentation import timed
+from .models import User, Team, Activity, Leaderboard, Workout, ActivityRollup
 
-class UserSerializer(serializers.ModelSerializer):
-    id = serializers.SerializerMethodField()
+
+class ObjectIdField(serializers.Field):
+    """Read-only field rendering a MongoDB ObjectId as its hex string."""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return str(value)
+
+
+# Fields whose to_representation is a plain type conversion, so list
+# serialization can call the conversion directly instead of the bound method.
+PLAIN_CONVERSIONS = {
+    ObjectIdField: str,
+    serializers.CharField: str,
+    serializers.EmailField: str,
+    serializers.IntegerField: int,
+    serializers.FloatField: float,
+}
+
+
+def datetime_conversion(field):
+    """
+    Precompiled ISO 8601 conversion matching ``DateTimeField.to_representation``.
+
+    Aware datetimes are converted inline; anything unusual (naive values,
+    strings, custom output formats) goes through the field itself.
+    """
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if output_format is None or output_format.lower() != ISO_8601 or field_timezone is None:
+        return field.to_representation
+
+    def convert(value):
+        if isinstance(value, str) or value.tzinfo is None:
+            return field.to_representation(value)
+        text = value.astimezone(field_timezone).isoformat()
+        return text[:-6] + 'Z' if text.endswith('+00:00') else text
+    return convert
+
+
+class TimedSerializerMixin:
+    """Reports ``to_representation`` time as the request's serialize phase."""
+
+    def to_representation(self, instance):
+        with timed('serialize'):
+            return super().to_representation(instance)
+
+
+class RowListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    """
+    List serializer that compiles the child's fields once per list.
+
+    Each readable field becomes an ``attrgetter`` for its source (unless the
+    field customises ``get_attribute``) plus a conversion: a builtin for
+    plain fields, ``datetime_conversion()`` for datetimes and the field's own
+    ``to_representation`` otherwise. Every row is built from that plan, and
+    the output is the same as serializing each row with the child
+    serializer.
+    """
+
+    def get_row_plan(self):
+        plan = []
+        for field in self.child._readable_fields:
+            if field.source == '*' or type(field).get_attribute is not serializers.Field.get_attribute:
+                # e.g. ModelField, which hands the whole instance to to_representation
+                getter = field.get_attribute
+            else:
+                getter = attrgetter('.'.join(field.source_attrs))
+            if type(field) is serializers.DateTimeField:
+                convert = datetime_conversion(field)
+            else:
+                convert = PLAIN_CONVERSIONS.get(type(field), field.to_representation)
+            plan.append((field.field_name, getter, convert))
+        return plan
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        plan = self.get_row_plan()
+        rows = []
+        for item in iterable:
+            row = {}
+            for name, getter, convert in plan:
+                value = getter(item)
+                row[name] = None if value is None else convert(value)
+            rows.append(row)
+        return rows
+
+
+class UserSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
+    id = ObjectIdField(source='_id')
     
     class Meta:
         model = User
         fields = ['id', 'name', 'email', 'team', 'fitness_level', 'created_at']
-    
-    def get_id(self, obj):
-        return str(obj._id)
+        list_serializer_class = RowListSerializer
 
 
-class TeamSerializer(serializers.ModelSerializer):
-    id = serializers.SerializerMethodField()
+class TeamSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
+    id = ObjectIdField(source='_id')
     member_count = serializers.IntegerField(source='members_count', read_only=True)
     
     class Meta:
         model = Team
-        fields = ['id', 'name', 'description', 'created_at', 'members_count', 'member_count']
+        fields = ['id', 'name', 'description', 'created_at', 'members_count', 'member_count',
+                  'total_calories', 'total_distance', 'rank']
+        read_only_fields = ['members_count', 'total_calories', 'total_distance', 'rank']
+        list_serializer_class = RowListSerializer
+
+
+class TeamStatsSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
+    id = ObjectIdField(source='_id')
     
-    def get_id(self, obj):
-        return str(obj._id)
+    class Meta:
+        model = Team
+        fields = ['id', 'name', 'members_count', 'total_calories', 'total_distance', 'rank']
+        list_serializer_class = RowListSerializer
 
 
-class ActivitySerializer(serializers.ModelSerializer):
-    id = serializers.SerializerMethodField()
+class ActivitySerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
+    id = ObjectIdField(source='_id')
     
     class Meta:
         model = Activity
         fields = ['id', 'user_email', 'activity_type', 'duration_minutes', 'calories_burned', 'distance_km', 'date', 'notes']
+        list_serializer_class = RowListSerializer
+
+
+class EnrichedActivitySerializer(ActivitySerializer):
+    # Attached by references.enrich_activities()
+    user = serializers.DictField(source='user_summary', read_only=True)
+    team = serializers.DictField(source='team_summary', read_only=True)
     
-    def get_id(self, obj):
-        return str(obj._id)
+    class Meta(ActivitySerializer.Meta):
+        fields = ActivitySerializer.Meta.fields + ['user', 'team']
 
 
-class LeaderboardSerializer(serializers.ModelSerializer):
-    id = serializers.SerializerMethodField()
+class LeaderboardSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
+    id = ObjectIdField(source='_id')
     # Add aliases for frontend compatibility
     total_points = serializers.IntegerField(source='total_calories', read_only=True)
     points = serializers.IntegerField(source='total_calories', read_only=True)
@@ -47,19 +157,23 @@ class LeaderboardSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Leaderboard
-        fields = ['id', 'user_email', 'user_name', 'name', 'team', 'total_activities', 'activities_count', 
+        fields = ['id', 'user_email', 'user_name', 'name', 'team', 'total_activities', 'activities_count',
                   'activity_count', 'total_calories', 'total_points', 'points', 'total_distance', 'rank']
-    
-    def get_id(self, obj):
-        return str(obj._id)
+        list_serializer_class = RowListSerializer
 
 
-class WorkoutSerializer(serializers.ModelSerializer):
-    id = serializers.SerializerMethodField()
+class WorkoutSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
+    id = ObjectIdField(source='_id')
     
     class Meta:
         model = Workout
         fields = ['id', 'name', 'description', 'fitness_level', 'duration_minutes', 'category', 'exercises']
+        list_serializer_class = RowListSerializer
+
+
+class ActivityRollupSerializer(SparseFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     
-    def get_id(self, obj):
-        return str(obj._id)
+    class Meta:
+        model = ActivityRollup
+        fields = ['bucket', 'activities', 'calories', 'distance', 'duration_minutes']
+        list_serializer_class = RowListSerializer
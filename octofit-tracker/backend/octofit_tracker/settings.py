@@ -47,6 +47,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Outermost body-handling middleware, so it compresses the final response
+    'octofit_tracker.compression.CompressionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,8 +56,29 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Keep last so its render timing is not padded by other middleware
+    'octofit_tracker.instrumentation.InstrumentationMiddleware',
 ]
 
+# Share of requests that get the detailed per-phase breakdown (Server-Timing
+# header and log line); request durations are always recorded for /api/_metrics.
+# Raise it (up to 1.0) while investigating a slow endpoint
+OCTOFIT_INSTRUMENTATION_SAMPLE_RATE = float(os.environ.get('OCTOFIT_INSTRUMENTATION_SAMPLE_RATE', 0.01))
+
+# Serve the read endpoints with async views on Motor (see async_views.py).
+# asgi.py turns this on; under WSGI the sync viewsets handle everything.
+OCTOFIT_ASYNC_READS = os.environ.get('OCTOFIT_ASYNC_READS', '0') == '1'
+
+# Responses smaller than this are sent uncompressed even if the client
+# accepts br/gzip; the saving does not pay for the CPU and headers
+OCTOFIT_COMPRESS_MIN_BYTES = int(os.environ.get('OCTOFIT_COMPRESS_MIN_BYTES', 1024))
+
+# Column files of activities moved out of MongoDB by archive_activities
+OCTOFIT_ARCHIVE_DIR = os.environ.get('OCTOFIT_ARCHIVE_DIR', str(BASE_DIR / 'archive'))
+
+# How long admin list filters reuse the distinct values of a field
+OCTOFIT_ADMIN_FACET_SECONDS = int(os.environ.get('OCTOFIT_ADMIN_FACET_SECONDS', 600))
+
 ROOT_URLCONF = 'octofit_tracker.urls'
 
 TEMPLATES = [
@@ -93,6 +116,36 @@ DATABASES = {
     }
 }
 
+# Caches
+# 'api' holds cached responses for read-mostly endpoints (see octofit_tracker/cache.py).
+# Entries are keyed on the MongoDB change versions, so invalidation reaches
+# every process; point it at a shared backend (e.g. FileBasedCache) to also
+# share the entries themselves.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': {
+        'BACKEND': os.environ.get('OCTOFIT_API_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('OCTOFIT_API_CACHE_LOCATION', 'octofit-api'),
+        'TIMEOUT': None,
+    },
+}
+
+# Django REST framework settings
+# List endpoints use keyset pagination; see octofit_tracker/pagination.py
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'octofit_tracker.renderers.ORJSONRenderer',
+        'octofit_tracker.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'octofit_tracker.pagination.KeysetPagination',
+    'PAGE_SIZE': int(os.environ.get('OCTOFIT_PAGE_SIZE', 50)),
+}
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_METHODS = [
@@ -111,6 +164,27 @@ if os.environ.get('CODESPACE_NAME'):
     CSRF_TRUSTED_ORIGINS.append(f"https://{os.environ.get('CODESPACE_NAME')}-8000.app.github.dev")
 
 
+# Logging
+# Request instrumentation emits one JSON line per sampled request
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'octofit_tracker.instrumentation': {
+            'handlers': ['console'],
+            'level': os.environ.get('OCTOFIT_INSTRUMENTATION_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
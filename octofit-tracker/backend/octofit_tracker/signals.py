@@ -0,0 +1,94 @@
+"""
+Model signal handlers.
+
+ORM writes (API, admin, management commands) arrive here; raw pymongo writes
+in ``leaderboard.py`` call the same hooks directly.
+"""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Activity, Leaderboard, Team, User, Workout
+from .mongo import get_collection
+from . import search
+from .references import link_team_members, team_ids, team_renamed, unlink_team_members, user_ids
+from .teams import (member_joined, member_left, member_moved, membership, refresh_team, rerank_teams,
+                    stored_membership)
+from .versions import next_version, record_deletion
+
+VERSIONED_MODELS = [User, Team, Activity, Leaderboard, Workout]
+SEARCHED_MODELS = [User, Team, Workout]
+
+
+@receiver(pre_save)
+def stamp_version(sender, instance, **kwargs):
+    # Released by the VersionedSave.save() around this signal
+    if sender in VERSIONED_MODELS:
+        instance.change_version = next_version(sender._meta.db_table)
+
+
+@receiver(post_delete)
+def record_version_deletion(sender, instance, **kwargs):
+    if sender in VERSIONED_MODELS:
+        record_deletion(sender._meta.db_table, instance.pk)
+
+
+@receiver(post_save)
+def index_for_search(sender, instance, **kwargs):
+    if sender in SEARCHED_MODELS:
+        search.document_saved(sender, instance)
+
+
+@receiver(post_delete)
+def unindex_for_search(sender, instance, **kwargs):
+    if sender in SEARCHED_MODELS:
+        search.document_deleted(sender, instance)
+
+
+@receiver(pre_save, sender=Activity)
+def activity_saving(sender, instance, **kwargs):
+    instance.user_id = user_ids([instance.user_email]).get(instance.user_email)
+
+
+@receiver(pre_save, sender=User)
+def user_saving(sender, instance, **kwargs):
+    # Remember the stored membership so post_save can move the user's totals
+    instance._stored_membership = stored_membership(instance._id) if instance._id is not None else None
+    instance.team_id = team_ids([instance.team]).get(instance.team) if instance.team else None
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_stored_membership', None)
+    if created or previous is None:
+        member_joined(membership(instance))
+    else:
+        member_moved(previous, membership(instance))
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    member_left(membership(instance))
+
+
+@receiver(pre_save, sender=Team)
+def team_saving(sender, instance, **kwargs):
+    # Remember the stored name so post_save can carry a rename to the members
+    stored = get_collection(Team).find_one({'_id': instance._id}, {'name': 1}) if instance._id is not None else None
+    instance._stored_name = stored and stored['name']
+
+
+@receiver(post_save, sender=Team)
+def team_saved(sender, instance, **kwargs):
+    previous = getattr(instance, '_stored_name', None)
+    if previous is not None and previous != instance.name:
+        team_renamed(instance._id, previous, instance.name)
+    link_team_members(instance._id, instance.name)
+    # Users may already name the team, and an ORM save writes stale aggregates
+    for field, value in refresh_team(instance.name).items():
+        setattr(instance, field, value)
+
+
+@receiver(post_delete, sender=Team)
+def team_deleted(sender, instance, **kwargs):
+    unlink_team_members(instance._id)
+    rerank_teams()
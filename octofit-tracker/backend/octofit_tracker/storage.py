@@ -0,0 +1,131 @@
+"""
+Storage layout of the activities collection.
+
+Activities live in a plain collection by default. They can instead be moved
+into a MongoDB time-series collection with ``date`` as the time field and
+``user_email`` as the meta field (``migrate_activity_storage``). The server
+then groups each user's activities into compressed buckets, which is the
+monthly bucketing done for us: granularity ``hours`` lets a bucket span up
+to 30 days of one user. Per-user range and recency queries read a few
+buckets instead of one document per activity, and the collection takes a
+fraction of the disk.
+
+The ORM and pymongo code is the same for both layouts; the differences are
+handled here:
+
+* a time-series collection has no ``_id`` index, so ``storage_indexes()``
+  adds a plain (non-unique) one for detail lookups and keyset cursors;
+* without a unique ``_id`` index, replayed idempotency keys are not
+  rejected by the server, so ``ingest.py`` looks them up before inserting;
+* edits and deletes of single activities need MongoDB 7.0, the first
+  release to accept arbitrary filters on time-series updates and deletes,
+  so ``migrate_activity_storage`` refuses older servers.
+
+The layout is read from the server once per process; restart the app
+servers after migrating.
+"""
+import time
+
+from pymongo import ASCENDING
+
+from .models import Activity
+from .mongo import get_client, get_db
+
+PLAIN = 'collection'
+TIMESERIES = 'timeseries'
+LAYOUTS = (PLAIN, TIMESERIES)
+TIMESERIES_OPTIONS = {'timeField': 'date', 'metaField': 'user_email', 'granularity': 'hours'}
+MIN_TIMESERIES_SERVER = (7, 0)
+
+_layouts = {}
+
+
+def collection_layout(model):
+    """``PLAIN`` or ``TIMESERIES`` for the collection behind ``model``; cached per process."""
+    db = get_db()
+    key = (db.name, model._meta.db_table)
+    if key not in _layouts:
+        info = next(db.list_collections(filter={'name': model._meta.db_table}), None)
+        _layouts[key] = TIMESERIES if info is not None and info.get('type') == 'timeseries' else PLAIN
+    return _layouts[key]
+
+
+def is_timeseries(model):
+    return collection_layout(model) == TIMESERIES
+
+
+def forget_layouts():
+    _layouts.clear()
+
+
+def storage_indexes(model, layout=None):
+    """``[(name, keys, unique)]`` a layout needs on top of the model's declared indexes."""
+    if model is not Activity:
+        return []
+    if (layout or collection_layout(model)) == TIMESERIES:
+        return [(f'{model._meta.db_table}_id_idx', [('_id', ASCENDING)], False)]
+    return []
+
+
+def create_collection(db, name, layout):
+    if layout == TIMESERIES:
+        return db.create_collection(name, timeseries=TIMESERIES_OPTIONS)
+    return db.create_collection(name)
+
+
+def copy_documents(source, target, batch_size):
+    """Copy every document of ``source`` into ``target`` in ``_id`` order; returns the count."""
+    copied, batch = 0, []
+    for document in source.find({}).sort('_id', ASCENDING).batch_size(batch_size):
+        batch.append(document)
+        if len(batch) >= batch_size:
+            target.insert_many(batch, ordered=False)
+            copied += len(batch)
+            batch = []
+    if batch:
+        target.insert_many(batch, ordered=False)
+        copied += len(batch)
+    return copied
+
+
+def server_supports_timeseries():
+    return tuple(get_client().server_info()['versionArray'][:2]) >= MIN_TIMESERIES_SERVER
+
+
+def migrate_activities(layout, batch_size=10000):
+    """
+    Move the activities into the ``layout`` collection, copying in batches.
+
+    Time-series collections cannot be renamed, so going to ``TIMESERIES``
+    renames the plain collection to a timestamped backup, creates the
+    time-series collection in its place and copies the backup into it; the
+    backup is returned for the caller to drop once satisfied. Going back
+    copies into a plain staging collection that then replaces the
+    time-series one. Writes made during the copy land in the new collection
+    but reads see it partially filled, so run it in a maintenance window.
+
+    Returns ``{'copied', 'backup'}``, or ``None`` when already in ``layout``.
+    Indexes are left to ``ensure_indexes``.
+    """
+    if collection_layout(Activity) == layout:
+        return None
+    db = get_db()
+    name = Activity._meta.db_table
+    exists = name in db.list_collection_names()
+    backup = None
+
+    if layout == TIMESERIES:
+        if exists:
+            backup = f'{name}_backup_{int(time.time())}'
+            db[name].rename(backup)
+        create_collection(db, name, TIMESERIES)
+        copied = copy_documents(db[backup], db[name], batch_size) if backup else 0
+    else:
+        staging = f'{name}_staging'
+        db.drop_collection(staging)
+        create_collection(db, staging, PLAIN)
+        copied = copy_documents(db[name], db[staging], batch_size)
+        db[staging].rename(name, dropTarget=True)
+
+    forget_layouts()
+    return {'copied': copied, 'backup': backup}
@@ -0,0 +1,162 @@
+"""
+Seeded synthetic data for load testing (``populate_db --users N ...``).
+
+Every user's data comes from its own RNG seeded with ``(seed, user index)``,
+so a dataset is reproducible whatever the batch size or number of worker
+processes. Documents are written straight to MongoDB with ``insert_many`` in
+large unordered batches; activities are generated and inserted in shards of
+users, optionally in a process pool. Shard workers open their own
+``MongoClient`` because pymongo clients must not be shared across a fork.
+Users and teams get ids derived from their index, so activities and users
+carry their ``user_id``/``team_id`` references without a lookup.
+"""
+import hashlib
+import random
+from datetime import timedelta
+
+from bson import ObjectId
+from pymongo import MongoClient
+
+FIRST_NAMES = ['Tony', 'Steve', 'Natasha', 'Bruce', 'Thor', 'Peter', 'Clark', 'Diana', 'Barry', 'Arthur',
+               'Hal', 'Wanda', 'Carol', 'Scott', 'Hope', 'Selina', 'Victor', 'Kara', 'Billy', 'Jessica']
+LAST_NAMES = ['Stark', 'Rogers', 'Romanoff', 'Banner', 'Odinson', 'Parker', 'Kent', 'Prince', 'Allen', 'Curry',
+              'Jordan', 'Maximoff', 'Danvers', 'Lang', 'Van Dyne', 'Kyle', 'Stone', 'Zor-El', 'Batson', 'Jones']
+FITNESS_LEVELS = ['beginner', 'intermediate', 'advanced', 'expert']
+ACTIVITY_TYPES = ['Running', 'Cycling', 'Swimming', 'Weight Training', 'Yoga', 'HIIT', 'Boxing', 'Martial Arts']
+DISTANCE_TYPES = {'Running', 'Cycling', 'Swimming'}
+WORKOUT_CATEGORIES = ['Strength', 'Cardio', 'Agility', 'Full Body', 'Flexibility']
+EXERCISES = ['Push-ups', 'Squats', 'Plank', 'Burpees', 'Lunges', 'Deadlifts', 'Pull-ups', 'Box Jumps',
+             'Kettlebell Swings', 'Mountain Climbers', 'Sprint Intervals', 'Yoga Flow']
+
+
+def rng_for(seed, *parts):
+    """Independent RNG for one entity of a seeded dataset."""
+    return random.Random(f'{seed}:' + ':'.join(str(part) for part in parts))
+
+
+def derived_id(kind, index):
+    """Stable ObjectId of the ``index``-th synthetic entity of a kind."""
+    return ObjectId(hashlib.sha1(f'{kind}:{index}'.encode('utf-8')).digest()[:12])
+
+
+def team_name(index):
+    return f'Team {index + 1:03d}'
+
+
+def user_email(index):
+    return f'hero{index:07d}@octofit.example'
+
+
+def make_teams(count, created_at, users):
+    """Team documents, with members_count matching ``make_user``'s assignment."""
+    return [
+        {
+            '_id': derived_id('team', index),
+            'name': team_name(index),
+            'description': f'Synthetic load-test team {index + 1}',
+            'created_at': created_at,
+            'members_count': len(range(index, users, count)),
+        }
+        for index in range(count)
+    ]
+
+
+def make_user(seed, index, teams, created_at):
+    rng = rng_for(seed, 'user', index)
+    return {
+        '_id': derived_id('user', index),
+        'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+        'email': user_email(index),
+        'team': team_name(index % teams),
+        'team_id': derived_id('team', index % teams),
+        'fitness_level': rng.choice(FITNESS_LEVELS),
+        'created_at': created_at,
+    }
+
+
+def make_activities(seed, index, count, now):
+    """Activities for one user, spread over the year before ``now``."""
+    rng = rng_for(seed, 'activities', index)
+    email = user_email(index)
+    user_id = derived_id('user', index)
+    activities = []
+    for _ in range(count):
+        activity_type = rng.choice(ACTIVITY_TYPES)
+        duration = rng.randint(20, 120)
+        activities.append({
+            'user_email': email,
+            'user_id': user_id,
+            'activity_type': activity_type,
+            'duration_minutes': duration,
+            'calories_burned': duration * rng.randint(5, 12),
+            'distance_km': round(rng.uniform(1.0, 15.0), 2) if activity_type in DISTANCE_TYPES else None,
+            'date': now - timedelta(minutes=rng.randint(0, 365 * 24 * 60)),
+            'notes': f'{activity_type} session',
+        })
+    return activities
+
+
+def make_workouts(seed, count):
+    workouts = []
+    for index in range(count):
+        rng = rng_for(seed, 'workout', index)
+        category = rng.choice(WORKOUT_CATEGORIES)
+        workouts.append({
+            'name': f'{category} Drill {index + 1}',
+            'description': f'Synthetic {category.lower()} workout',
+            'fitness_level': rng.choice(FITNESS_LEVELS),
+            'duration_minutes': rng.choice([20, 30, 40, 45, 60]),
+            'category': category,
+            'exercises': [
+                {'name': name, 'sets': rng.randint(2, 5), 'reps': rng.randint(8, 20)}
+                for name in rng.sample(EXERCISES, 3)
+            ],
+        })
+    return workouts
+
+
+def shard_ranges(total, shards):
+    """Split ``range(total)`` into at most ``shards`` contiguous ``(start, stop)`` pairs."""
+    shards = max(1, min(shards, total))
+    size, extra = divmod(total, shards)
+    ranges, start = [], 0
+    for shard in range(shards):
+        stop = start + size + (1 if shard < extra else 0)
+        ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+def insert_batches(collection, documents, batch_size):
+    """Insert an iterable of documents in unordered batches; returns the count."""
+    inserted, batch = 0, []
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            collection.insert_many(batch, ordered=False)
+            inserted += len(batch)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+        inserted += len(batch)
+    return inserted
+
+
+def load_activity_shard(job):
+    """
+    Generate and insert the activities of users ``job['start']..job['stop']``.
+
+    Runs in a worker process; ``job`` is a plain dict so it pickles cleanly.
+    Returns the number of activities inserted.
+    """
+    client = MongoClient(**job['client'])
+    try:
+        collection = client[job['db']][job['collection']]
+        documents = (
+            activity
+            for index in range(job['start'], job['stop'])
+            for activity in make_activities(job['seed'], index, job['per_user'], job['now'])
+        )
+        return insert_batches(collection, documents, job['batch_size'])
+    finally:
+        client.close()
@@ -0,0 +1,168 @@
+"""
+Denormalized team aggregates.
+
+Every team document carries ``members_count``, ``total_calories``,
+``total_distance`` and ``rank`` (1-based position by ``-total_calories``,
+then ``name``), so a team's standing is a single document read. They are
+maintained as deltas:
+
+* user writes (``signals.py``) move a member, and the member's leaderboard
+  totals and rollup buckets, between teams;
+* every leaderboard delta (``leaderboard.apply_delta``) is folded into the
+  owner's team;
+* team writes recompute that one team from the indexed ``users.team`` and
+  ``leaderboard.team`` fields.
+
+``rebuild_team_stats()`` recomputes every team with one server-side
+aggregation, for seeding and for repairing drift.
+"""
+from pymongo import ReturnDocument
+
+from .cache import invalidate
+from .models import Leaderboard, LeaderboardWindow, Team, User
+from .mongo import get_collection
+from .ranking import rank_stage, rerank, shift_ranks
+from .rollups import move_team_rollups
+from .versions import stamped, version_stages, writes
+
+STATS_FIELDS = ['members_count', 'total_calories', 'total_distance', 'rank']
+
+
+@writes
+def team_delta(team, members=0, calories=0, distance=0.0):
+    """Apply a delta to one team's aggregates and fix up team ranks."""
+    if not team or not (members or calories or distance):
+        return
+    teams = get_collection(Team)
+    before = teams.find_one_and_update(
+        {'name': team},
+        stamped(teams.name, {'$inc': {
+            'members_count': members,
+            'total_calories': calories,
+            'total_distance': distance,
+        }}),
+        projection={'total_calories': 1},
+        return_document=ReturnDocument.BEFORE,
+    )
+    if before is None:
+        # Users may name a team that has no document yet; it is counted when created.
+        return
+    old_calories = before.get('total_calories', 0)
+    shift_ranks(teams, before['_id'], 'name', team, old_calories, old_calories + calories)
+
+
+def membership(user):
+    """The fields of a user that decide which team it counts towards."""
+    return user.email, user.team
+
+
+def stored_membership(user_id):
+    """``membership()`` of a user as currently stored, or ``None``."""
+    document = get_collection(User).find_one({'_id': user_id}, {'email': 1, 'team': 1})
+    if document is None:
+        return None
+    return document['email'], document['team']
+
+
+@writes
+def member_joined(current):
+    """Count a user, and its leaderboard totals, towards its team."""
+    email, team = current
+    calories, distance = _member_totals(email, team)
+    team_delta(team, members=1, calories=calories, distance=distance)
+    move_team_rollups(email, '', team)
+
+
+@writes
+def member_left(previous):
+    """Remove a user, and its leaderboard totals, from the team it was counted under."""
+    email, team = previous
+    calories, distance = _member_totals(email, '')
+    team_delta(team, members=-1, calories=-calories, distance=-distance)
+    move_team_rollups(email, team, '')
+
+
+@writes
+def member_moved(previous, current):
+    """Fold a user edit into the team aggregates given before/after ``membership()``."""
+    if previous != current:
+        member_left(previous)
+        member_joined(current)
+
+
+def _member_totals(email, team):
+    """Point the user's leaderboard rows at ``team`` and return its all-time calories and distance."""
+    get_collection(LeaderboardWindow).update_many({'user_email': email}, {'$set': {'team': team}})
+    leaderboard = get_collection(Leaderboard)
+    row = leaderboard.find_one_and_update(
+        {'user_email': email},
+        stamped(leaderboard.name, {'$set': {'team': team}}),
+        projection={'total_calories': 1, 'total_distance': 1},
+    )
+    if row is None:
+        return 0, 0.0
+    invalidate('leaderboard')
+    return row.get('total_calories', 0), row.get('total_distance', 0.0)
+
+
+def _stats_pipeline(match=None):
+    """Aggregation stages computing each team's members and totals from indexed lookups."""
+    stages = [{'$match': match}] if match else []
+    stages += [
+        {'$lookup': {
+            'from': User._meta.db_table,
+            'localField': 'name',
+            'foreignField': 'team',
+            'pipeline': [{'$count': 'count'}],
+            'as': 'members',
+        }},
+        {'$lookup': {
+            'from': Leaderboard._meta.db_table,
+            'localField': 'name',
+            'foreignField': 'team',
+            'pipeline': [{'$group': {
+                '_id': None,
+                'calories': {'$sum': '$total_calories'},
+                'distance': {'$sum': '$total_distance'},
+            }}],
+            'as': 'totals',
+        }},
+        {'$project': {
+            'name': 1,
+            'members_count': {'$ifNull': [{'$first': '$members.count'}, 0]},
+            'total_calories': {'$ifNull': [{'$first': '$totals.calories'}, 0]},
+            'total_distance': {'$round': [{'$ifNull': [{'$first': '$totals.distance'}, 0]}, 2]},
+        }},
+    ]
+    return stages
+
+
+def _merge_stage(teams):
+    return {'$merge': {'into': teams.name, 'on': '_id', 'whenMatched': 'merge', 'whenNotMatched': 'discard'}}
+
+
+@writes
+def refresh_team(name):
+    """
+    Recompute one team's aggregates and re-rank the teams.
+
+    Used when a team is created, renamed or edited, since users may already
+    name it. Returns the team's stored ``STATS_FIELDS`` as a dict.
+    """
+    teams = get_collection(Team)
+    teams.aggregate(_stats_pipeline({'name': name}) + version_stages(teams.name) + [_merge_stage(teams)])
+    rerank(teams, 'name')
+    document = teams.find_one({'name': name}, {field: 1 for field in STATS_FIELDS}) or {}
+    return {field: document[field] for field in STATS_FIELDS if field in document}
+
+
+@writes
+def rerank_teams():
+    rerank(get_collection(Team), 'name')
+
+
+@writes
+def rebuild_team_stats():
+    """Recompute every team's aggregates and rank in one server-side pass."""
+    teams = get_collection(Team)
+    teams.aggregate(_stats_pipeline() + [rank_stage('name'), *version_stages(teams.name), _merge_stage(teams)])
@@ -1,8 +1,48 @@
-from django.test import TestCase
-from rest_framework.test import APITestCase
+import asyncio
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import brotli
+import msgpack
+from unittest import mock
+from bson import ObjectId
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError
+from django.db.models import Q
+from django.db.models.signals import pre_save
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from rest_framework.exceptions import NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
 from rest_framework import status
-from datetime import datetime
+from datetime import datetime, timedelta, timezone as dt_timezone
 from .models import User, Team, Activity, Leaderboard, Workout
+from .admin import ActivityAdmin
+from .archive import PENDING, _write_chunk, archive_activities, archived_documents, archived_summary, clear_archive
+from .cache import collection_version, etag_matches, get_cache, invalidate
+from .changelists import distinct_values
+from .compression import CompressionMiddleware, accepted_encoding
+from .fieldsets import projected_fields
+from .indexes import declared_indexes
+from .ingest import idempotent_id
+from .instrumentation import Histogram
+from .leaderboard import rebuild_leaderboard
+from .mongo import get_collection
+from .pagination import Cursor, KeysetPagination
+from .ranking import ahead_of
+from .renderers import MessagePackRenderer, ORJSONRenderer
+from .search import SearchIndex, tokenize, within_one_edit
+from .references import backfill_references
+from .rollups import bucket_start, rebuild_rollups
+from .serializers import ActivitySerializer, LeaderboardSerializer, WorkoutSerializer
+from .storage import PLAIN, TIMESERIES, migrate_activities, server_supports_timeseries, storage_indexes
+from .versions import collection_state, next_version, release, reset, stamped, writing
+from .windows import ROLLING, _partition_for, rebuild_windows, window_partition
+from . import search, synthetic
 
 
 class UserModelTest(TestCase):
@@ -27,6 +67,9 @@ class TeamModelTest(TestCase):
     """Test cases for Team model."""
     
     def setUp(self):
+        for index in range(2):
+            User.objects.create(name=f"Member {index}", email=f"member{index}@example.com", team="Test Team",
+                                fitness_level="Beginner")
         self.team = Team.objects.create(
             name="Test Team",
             description="A test team",
@@ -34,9 +77,10 @@ class TeamModelTest(TestCase):
         )
     
     def test_team_creation(self):
-        """Test team is created correctly."""
+        """Test team is created correctly, with its member count derived from its users."""
         self.assertEqual(self.team.name, "Test Team")
-        self.assertEqual(self.team.members_count, 5)
+        self.assertEqual(self.team.members_count, 2)
+        self.assertEqual(Team.objects.get(pk=self.team.pk).members_count, 2)
         self.assertEqual(str(self.team), "Test Team")
 
 
@@ -197,3 +241,1099 @@ class WorkoutAPITest(APITestCase):
         }
         response = self.client.post('/api/workouts/', data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class IncrementalLeaderboardTest(APITestCase):
+    """Test cases for leaderboard maintenance on activity writes."""
+    
+    def setUp(self):
+        User.objects.create(name="Runner One", email="one@example.com", team="Team A", fitness_level="Beginner")
+        User.objects.create(name="Runner Two", email="two@example.com", team="Team B", fitness_level="Beginner")
+    
+    def post_activity(self, email, calories, distance=None):
+        data = {
+            'user_email': email,
+            'activity_type': 'Running',
+            'duration_minutes': 30,
+            'calories_burned': calories,
+            'distance_km': distance,
+            'date': datetime.now().isoformat()
+        }
+        response = self.client.post('/api/activities/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+    
+    def test_create_activity_updates_totals(self):
+        """Test creating activities accumulates the owner's totals."""
+        self.post_activity('one@example.com', 300, 5.0)
+        self.post_activity('one@example.com', 200, 2.5)
+        entry = Leaderboard.objects.get(user_email='one@example.com')
+        self.assertEqual(entry.user_name, "Runner One")
+        self.assertEqual(entry.team, "Team A")
+        self.assertEqual(entry.total_activities, 2)
+        self.assertEqual(entry.total_calories, 500)
+        self.assertAlmostEqual(entry.total_distance, 7.5)
+        self.assertEqual(entry.rank, 1)
+    
+    def test_ranks_follow_calorie_changes(self):
+        """Test overtaking and falling behind only swaps the affected ranks."""
+        self.post_activity('one@example.com', 300)
+        second = self.post_activity('two@example.com', 100)
+        self.assertEqual(Leaderboard.objects.get(user_email='two@example.com').rank, 2)
+        
+        response = self.client.patch(f'/api/activities/{second}/', {'calories_burned': 400}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Leaderboard.objects.get(user_email='two@example.com').rank, 1)
+        self.assertEqual(Leaderboard.objects.get(user_email='one@example.com').rank, 2)
+        
+        response = self.client.delete(f'/api/activities/{second}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        entry = Leaderboard.objects.get(user_email='two@example.com')
+        self.assertEqual(entry.total_activities, 0)
+        self.assertEqual(entry.total_calories, 0)
+        self.assertEqual(entry.rank, 2)
+        self.assertEqual(Leaderboard.objects.get(user_email='one@example.com').rank, 1)
+    
+    def test_around_returns_rank_and_neighbours(self):
+        """Test the around endpoint returns a user's rank and the entries either side."""
+        User.objects.create(name="Runner Three", email="three@example.com", team="Team B", fitness_level="Beginner")
+        self.post_activity('one@example.com', 300)
+        self.post_activity('two@example.com', 200)
+        self.post_activity('three@example.com', 100)
+        
+        response = self.client.get('/api/leaderboard/around/', {'email': 'two@example.com', 'radius': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['rank'], 2)
+        self.assertEqual([entry['user_email'] for entry in response.data['entries']],
+                         ['one@example.com', 'two@example.com', 'three@example.com'])
+        
+        response = self.client.get('/api/leaderboard/around/', {'email': 'one@example.com', 'radius': 1})
+        self.assertEqual([entry['rank'] for entry in response.data['entries']], [1, 2])
+        
+        response = self.client.get('/api/leaderboard/around/', {'email': 'nobody@example.com'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class RebuildLeaderboardTest(TestCase):
+    """Test cases for the server-side leaderboard rebuild."""
+    
+    def setUp(self):
+        User.objects.create(name="Runner One", email="one@example.com", team="Team A", fitness_level="Beginner")
+        for calories, email in [(300, "one@example.com"), (200, "one@example.com"), (700, "two@example.com")]:
+            Activity.objects.create(
+                user_email=email,
+                activity_type="Cycling",
+                duration_minutes=45,
+                calories_burned=calories,
+                distance_km=10.0,
+                date=datetime(2024, 1, 1)
+            )
+    
+    def test_full_rebuild(self):
+        """Test a full rebuild aggregates totals, joins users and ranks rows."""
+        self.assertEqual(rebuild_leaderboard(), 2)
+        first = Leaderboard.objects.get(user_email="two@example.com")
+        second = Leaderboard.objects.get(user_email="one@example.com")
+        self.assertEqual((first.rank, first.total_calories, first.user_name), (1, 700, "two@example.com"))
+        self.assertEqual((second.rank, second.total_activities, second.team), (2, 2, "Team A"))
+        self.assertAlmostEqual(second.total_distance, 20.0)
+    
+    def test_rebuild_since_only_touches_recent_users(self):
+        """Test a partial rebuild picks up new activities and re-ranks everyone."""
+        rebuild_leaderboard()
+        Activity.objects.create(
+            user_email="one@example.com",
+            activity_type="Running",
+            duration_minutes=60,
+            calories_burned=1000,
+            date=datetime(2024, 2, 1)
+        )
+        rebuild_leaderboard(since=datetime(2024, 1, 15, tzinfo=dt_timezone.utc))
+        entry = Leaderboard.objects.get(user_email="one@example.com")
+        self.assertEqual((entry.rank, entry.total_calories), (1, 1500))
+        self.assertEqual(Leaderboard.objects.get(user_email="two@example.com").rank, 2)
+
+
+class TeamAggregatesTest(APITestCase):
+    """Test cases for denormalized team aggregates and the stats endpoint."""
+    
+    def setUp(self):
+        self.team_a = Team.objects.create(name="Team A", description="First")
+        self.team_b = Team.objects.create(name="Team B", description="Second")
+        self.user = User.objects.create(name="Runner One", email="one@example.com", team="Team A", fitness_level="Beginner")
+        User.objects.create(name="Runner Two", email="two@example.com", team="Team B", fitness_level="Beginner")
+    
+    def stats(self, team):
+        response = self.client.get(f'/api/teams/{team._id}/stats/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+    
+    def test_activity_writes_update_team_totals_and_rank(self):
+        """Test activities move their owner's team totals and team ranks."""
+        for email, calories in [("one@example.com", 300), ("two@example.com", 500)]:
+            self.client.post('/api/activities/', {
+                'user_email': email,
+                'activity_type': 'Running',
+                'duration_minutes': 30,
+                'calories_burned': calories,
+                'distance_km': 5.0,
+                'date': '2024-01-10T08:00:00Z',
+            }, format='json')
+        stats = self.stats(self.team_a)
+        self.assertEqual((stats['members_count'], stats['total_calories'], stats['rank']), (1, 300, 2))
+        self.assertEqual(self.stats(self.team_b)['rank'], 1)
+    
+    def test_moving_a_user_moves_its_totals(self):
+        """Test changing a user's team moves the member and its calories."""
+        Activity.objects.create(user_email="one@example.com", activity_type="Yoga", duration_minutes=30,
+                                calories_burned=200, date=datetime(2024, 1, 5))
+        rebuild_leaderboard()
+        self.user.team = "Team B"
+        self.user.save()
+        self.assertEqual((self.stats(self.team_a)['members_count'], self.stats(self.team_a)['total_calories']), (0, 0))
+        self.assertEqual((self.stats(self.team_b)['members_count'], self.stats(self.team_b)['total_calories']), (2, 200))
+    
+    def test_stats_unknown_team(self):
+        """Test the stats endpoint returns 404 for a missing team."""
+        response = self.client.get(f'/api/teams/{ObjectId()}/stats/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ReferencesAPITest(APITestCase):
+    """Test cases for the user and team ObjectId references."""
+    
+    def setUp(self):
+        self.user = User.objects.create(name="Runner One", email="one@example.com", team="Team A", fitness_level="Beginner")
+        self.team = Team.objects.create(name="Team A", description="First")
+        self.activity = Activity.objects.create(user_email="one@example.com", activity_type="Yoga", duration_minutes=30,
+                                                calories_burned=200, date=datetime(2024, 1, 5))
+    
+    def test_writes_resolve_references(self):
+        """Test saves set user_id, and a team created after its members links them."""
+        self.assertEqual(self.activity.user_id, self.user._id)
+        self.assertEqual(User.objects.get(email="one@example.com").team_id, self.team._id)
+    
+    def test_enriched_activities(self):
+        """Test the enriched list embeds each activity's user and team."""
+        response = self.client.get('/api/activities/enriched/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        row = response.data['results'][0]
+        self.assertEqual(row['user'], {'id': str(self.user._id), 'name': "Runner One", 'email': "one@example.com"})
+        self.assertEqual(row['team'], {'id': str(self.team._id), 'name': "Team A"})
+    
+    def test_team_rename_reaches_members(self):
+        """Test renaming a team updates its members' team name through the reference."""
+        self.team.name = "Team Renamed"
+        self.team.save()
+        self.assertEqual(User.objects.get(email="one@example.com").team, "Team Renamed")
+    
+    def test_backfill_references(self):
+        """Test the backfill restores cleared references and is idempotent."""
+        Activity.objects.filter(pk=self.activity.pk).update(user_id=None)
+        User.objects.filter(pk=self.user.pk).update(team_id=None)
+        self.assertEqual(backfill_references(batch_size=1), {'users': 1, 'activities': 1})
+        self.assertEqual(Activity.objects.get(pk=self.activity.pk).user_id, self.user._id)
+        self.assertEqual(backfill_references(batch_size=1), {'users': 0, 'activities': 0})
+
+
+class RollupBucketTest(SimpleTestCase):
+    """Test cases for rollup bucket boundaries."""
+    
+    def test_bucket_starts(self):
+        """Test days, ISO weeks and months start at UTC midnight, Monday and the 1st."""
+        moment = datetime(2024, 3, 14, 23, 30, tzinfo=dt_timezone.utc)
+        self.assertEqual(bucket_start(moment, 'day'), datetime(2024, 3, 14, tzinfo=dt_timezone.utc))
+        self.assertEqual(bucket_start(moment, 'week'), datetime(2024, 3, 11, tzinfo=dt_timezone.utc))
+        self.assertEqual(bucket_start(moment, 'month'), datetime(2024, 3, 1, tzinfo=dt_timezone.utc))
+
+
+class TimeseriesAPITest(APITestCase):
+    """Test cases for the rollup-backed timeseries endpoint."""
+    
+    def setUp(self):
+        User.objects.create(name="Runner One", email="one@example.com", team="Team A", fitness_level="Beginner")
+        for day in [4, 5, 12]:
+            self.client.post('/api/activities/', {
+                'user_email': 'one@example.com',
+                'activity_type': 'Running',
+                'duration_minutes': 30,
+                'calories_burned': 100,
+                'distance_km': 5.0,
+                'date': f'2024-03-{day:02d}T08:00:00Z',
+            }, format='json')
+    
+    def test_weekly_buckets_follow_writes(self):
+        """Test activity writes land in the user's and team's weekly buckets."""
+        response = self.client.get('/api/stats/timeseries/', {'scope': 'team', 'key': 'Team A', 'granularity': 'week'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['calories'] for row in response.data['buckets']], [200, 100])
+        
+        response = self.client.get('/api/stats/timeseries/', {
+            'scope': 'user', 'key': 'one@example.com', 'granularity': 'day', 'from': '2024-03-05', 'to': '2024-03-31',
+        })
+        self.assertEqual([row['activities'] for row in response.data['buckets']], [1, 1])
+    
+    def test_backfill_matches_incremental(self):
+        """Test rebuilding from history reproduces the incrementally maintained buckets."""
+        params = {'scope': 'user', 'key': 'one@example.com', 'granularity': 'month'}
+        before = self.client.get('/api/stats/timeseries/', params).data['buckets']
+        rebuild_rollups()
+        self.assertEqual(self.client.get('/api/stats/timeseries/', params).data['buckets'], before)
+    
+    def test_team_change_moves_buckets(self):
+        """Test a user's buckets follow a team change, so removing older activities matches a rebuild."""
+        user = User.objects.get(email="one@example.com")
+        user.team = "Team B"
+        user.save()
+        activity = Activity.objects.get(date=datetime(2024, 3, 4, 8, tzinfo=dt_timezone.utc))
+        self.client.delete(f'/api/activities/{activity.pk}/')
+        
+        params = {'scope': 'team', 'granularity': 'week'}
+        team_b = self.client.get('/api/stats/timeseries/', {**params, 'key': 'Team B'}).data['buckets']
+        self.assertEqual([row['calories'] for row in team_b], [100, 100])
+        self.assertEqual(self.client.get('/api/stats/timeseries/', {**params, 'key': 'Team A'}).data['buckets'], [])
+        rebuild_rollups()
+        self.assertEqual(self.client.get('/api/stats/timeseries/', {**params, 'key': 'Team B'}).data['buckets'], team_b)
+    
+    def test_rejects_bad_granularity(self):
+        """Test unknown granularities are rejected."""
+        response = self.client.get('/api/stats/timeseries/', {'key': 'one@example.com', 'granularity': 'year'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class WindowPartitionTest(SimpleTestCase):
+    """Test cases for leaderboard window partitions."""
+    
+    def test_partitions(self):
+        """Test dates map to the current week, month and rolling partitions only."""
+        now = datetime(2024, 3, 14, 12, 0, tzinfo=dt_timezone.utc)
+        self.assertEqual(window_partition('week', now)['period_start'], datetime(2024, 3, 11, tzinfo=dt_timezone.utc))
+        self.assertEqual(window_partition(ROLLING, now), {'span': ROLLING, 'period_start': None})
+        
+        last_week = datetime(2024, 3, 8, tzinfo=dt_timezone.utc)
+        self.assertIsNone(_partition_for('week', last_week, now))
+        self.assertIsNotNone(_partition_for('month', last_week, now))
+        self.assertIsNotNone(_partition_for(ROLLING, datetime(2024, 2, 14, tzinfo=dt_timezone.utc), now))
+        self.assertIsNone(_partition_for(ROLLING, datetime(2024, 2, 13, tzinfo=dt_timezone.utc), now))
+    
+    def test_partition_scopes_rank_filters(self):
+        """Test rank filters stay inside the given partition."""
+        partition = {'span': 'week', 'period_start': None}
+        query = ahead_of(100, 'a@example.com', 'user_email', partition)
+        self.assertEqual(query['span'], 'week')
+        self.assertIn('$or', query)
+
+
+class WindowedLeaderboardAPITest(APITestCase):
+    """Test cases for the week, month and rolling 30-day leaderboards."""
+    
+    def setUp(self):
+        User.objects.create(name="Runner One", email="one@example.com", team="Team A", fitness_level="Beginner")
+        User.objects.create(name="Runner Two", email="two@example.com", team="Team A", fitness_level="Beginner")
+        now = datetime.now(dt_timezone.utc)
+        for email, calories, date in [
+            ('one@example.com', 100, now),
+            ('two@example.com', 300, now - timedelta(days=60)),
+        ]:
+            self.client.post('/api/activities/', {
+                'user_email': email,
+                'activity_type': 'Running',
+                'duration_minutes': 30,
+                'calories_burned': calories,
+                'date': date.isoformat(),
+            }, format='json')
+    
+    def test_window_only_counts_recent_activities(self):
+        """Test windowed leaderboards only rank activities inside the window."""
+        response = self.client.get('/api/leaderboard/top/', {'window': 'week'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(row['user_email'], row['rank']) for row in response.data], [('one@example.com', 1)])
+        
+        response = self.client.get('/api/leaderboard/by_team/', {'team': 'Team A', 'window': '30d'})
+        self.assertEqual([row['user_email'] for row in response.data], ['one@example.com'])
+        
+        response = self.client.get('/api/leaderboard/top/')
+        self.assertEqual(response.data[0]['user_email'], 'two@example.com')
+    
+    def test_rebuild_matches_incremental(self):
+        """Test rebuilding the windows from the rollups reproduces the incremental rows."""
+        before = self.client.get('/api/leaderboard/top/', {'window': 'month'}).data
+        rebuild_windows()
+        self.assertEqual(self.client.get('/api/leaderboard/top/', {'window': 'month'}).data, before)
+    
+    def test_rejects_unknown_window(self):
+        """Test unknown windows are rejected."""
+        response = self.client.get('/api/leaderboard/top/', {'window': 'year'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class KeysetPaginationTest(SimpleTestCase):
+    """Test cases for keyset cursor encoding and range filters."""
+    
+    def setUp(self):
+        self.paginator = KeysetPagination()
+        self.paginator.model = Activity
+        self.paginator.key_fields = [('date', True), ('_id', False)]
+        self.paginator.base_url = 'http://testserver/api/activities/'
+        self.keys = [datetime(2024, 1, 1, 8, 30, tzinfo=dt_timezone.utc), ObjectId()]
+    
+    def decode(self, url):
+        return self.paginator.decode_cursor(Request(APIRequestFactory().get(url)))
+    
+    def test_cursor_round_trip(self):
+        """Test cursors decode back to typed key values and direction."""
+        link = self.paginator.encode_cursor(Cursor(self.keys, reverse=True))
+        self.assertEqual(self.decode(link), Cursor(self.keys, reverse=True))
+    
+    def test_invalid_cursor(self):
+        """Test a tampered cursor is rejected."""
+        with self.assertRaises(NotFound):
+            self.decode('http://testserver/api/activities/?cursor=bm90LWpzb24')
+    
+    def test_after_filter(self):
+        """Test the range filter continues past the boundary row in both directions."""
+        date, _id = self.keys
+        self.assertEqual(self.paginator.after(self.keys), Q(date__lt=date) | Q(date=date, _id__gt=_id))
+        self.assertEqual(self.paginator.after(self.keys, reverse=True), Q(date__gt=date) | Q(date=date, _id__lt=_id))
+    
+    def test_mongo_filter_and_sort(self):
+        """Test the raw Mongo filter and sort used by the async views mirror the ORM ones."""
+        date, _id = self.keys
+        self.assertEqual(self.paginator.mongo_after(self.keys), {'$or': [
+            {'date': {'$lt': date}},
+            {'date': date, '_id': {'$gt': _id}},
+        ]})
+        self.assertEqual(self.paginator.mongo_sort(), [('date', -1), ('_id', 1)])
+        self.assertEqual(self.paginator.mongo_sort(reverse=True), [('date', 1), ('_id', -1)])
+
+
+class ActivityPaginationAPITest(APITestCase):
+    """Test cases for paging through the activities list."""
+    
+    def setUp(self):
+        for day in range(1, 6):
+            Activity.objects.create(
+                user_email="pager@example.com",
+                activity_type="Yoga",
+                duration_minutes=30,
+                calories_burned=100,
+                date=datetime(2024, 1, day)
+            )
+    
+    def test_pages_follow_cursors(self):
+        """Test next and previous cursors walk the list newest first without overlap."""
+        response = self.client.get('/api/activities/', {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data['previous'])
+        seen = [row['date'] for row in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            seen += [row['date'] for row in response.data['results']]
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+        
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([row['date'] for row in response.data['results']], seen[2:4])
+    
+    def test_sparse_fieldset_pages(self):
+        """Test ?fields= trims rows and the cursors keep working."""
+        response = self.client.get('/api/activities/', {'page_size': 3, 'fields': 'id,calories_burned'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'calories_burned'})
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 2)
+
+
+class DeclaredIndexesTest(SimpleTestCase):
+    """Test cases for index declarations read from model Meta."""
+    
+    def test_compound_index_directions(self):
+        """Test descending fields map to descending Mongo keys."""
+        indexes = {name: (keys, unique) for name, keys, unique in declared_indexes(Activity)}
+        self.assertEqual(indexes['activities_user_date_idx'], ([('user_email', 1), ('date', -1)], False))
+    
+    def test_unique_fields_are_declared(self):
+        """Test unique model fields produce unique indexes."""
+        indexes = declared_indexes(Leaderboard)
+        self.assertIn(('leaderboard_user_email_uniq', [('user_email', 1)], True), indexes)
+
+
+class RepositoryReadPathTest(APITestCase):
+    """Test cases for the direct pymongo read paths."""
+    
+    def setUp(self):
+        self.user = User.objects.create(name="Fast Reader", email="fast@example.com", team="Team A", fitness_level="Beginner")
+        for day in range(1, 4):
+            Activity.objects.create(
+                user_email="fast@example.com",
+                activity_type="Running",
+                duration_minutes=20,
+                calories_burned=100 * day,
+                distance_km=float(day),
+                date=datetime(2024, 1, day)
+            )
+    
+    def test_by_user_matches_orm(self):
+        """Test by_user renders the same JSON as serializing ORM results."""
+        response = self.client.get('/api/activities/by_user/', {'email': 'fast@example.com'})
+        expected = ActivitySerializer(Activity.objects.filter(user_email='fast@example.com').order_by('-date'), many=True).data
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), [dict(row) for row in expected])
+    
+    def test_by_email(self):
+        """Test by_email finds a user and 404s on unknown emails."""
+        response = self.client.get('/api/users/by_email/', {'email': 'fast@example.com'})
+        self.assertEqual(response.data['id'], str(self.user._id))
+        response = self.client.get('/api/users/by_email/', {'email': 'missing@example.com'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CollectionVersionTest(TestCase):
+    """Test cases for write-driven cache versions."""
+    
+    def test_invalidate_bumps_only_that_collection(self):
+        """Test invalidating one collection leaves the others' versions alone."""
+        leaderboard_version = collection_version('leaderboard')
+        workouts_version = collection_version('workouts')
+        invalidate('leaderboard')
+        self.assertNotEqual(collection_version('leaderboard'), leaderboard_version)
+        self.assertEqual(collection_version('workouts'), workouts_version)
+    
+    def test_etag_matching(self):
+        """Test weak and strong If-None-Match forms both match."""
+        self.assertTrue(etag_matches('W/"abc"', 'W/"abc"'))
+        self.assertTrue(etag_matches('"xyz", "abc"', 'W/"abc"'))
+        self.assertTrue(etag_matches('*', 'W/"abc"'))
+        self.assertFalse(etag_matches('W/"old"', 'W/"abc"'))
+
+
+class CachedResponseAPITest(APITestCase):
+    """Test cases for cached workout responses and conditional requests."""
+    
+    def setUp(self):
+        self.workout = Workout.objects.create(
+            name="Cached Workout",
+            description="Served from cache",
+            fitness_level="Beginner",
+            duration_minutes=15,
+            category="Cardio",
+            exercises={"exercises": ["jumping jacks"]}
+        )
+    
+    def test_not_modified_until_write(self):
+        """Test pollers get 304 until a workout changes."""
+        url = '/api/workouts/by_category/'
+        response = self.client.get(url, {'category': 'Cardio'})
+        self.assertEqual(len(response.data), 1)
+        etag = response['ETag']
+        
+        response = self.client.get(url, {'category': 'Cardio'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        
+        self.workout.name = "Renamed Workout"
+        self.workout.save()
+        response = self.client.get(url, {'category': 'Cardio'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['name'], "Renamed Workout")
+    
+    def test_write_outside_the_request_path(self):
+        """Test a raw write, as from a management command or another worker, retires cached responses."""
+        url = '/api/workouts/by_category/'
+        self.assertEqual(self.client.get(url, {'category': 'Cardio'}).data[0]['name'], "Cached Workout")
+        workouts = get_collection(Workout)
+        with writing():
+            workouts.update_one({'_id': self.workout._id}, stamped(workouts.name, {'$set': {'name': "Raw Rename"}}))
+        self.assertEqual(self.client.get(url, {'category': 'Cardio'}).data[0]['name'], "Raw Rename")
+
+
+class ChangeVersionAPITest(APITestCase):
+    """Test cases for change versions, conditional lists and ?since_version= deltas."""
+    
+    def create_workout(self, name):
+        return Workout.objects.create(name=name, description="Versioned", fitness_level="Beginner",
+                                      duration_minutes=15, category="Cardio", exercises=[])
+    
+    def test_conditional_list(self):
+        """Test lists carry validators and answer 304 until the collection changes."""
+        self.create_workout("First")
+        response = self.client.get('/api/workouts/')
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+        
+        response = self.client.get('/api/workouts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        
+        self.create_workout("Second")
+        response = self.client.get('/api/workouts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+    
+    def test_delta_since_version(self):
+        """Test deltas hold only documents written and ids deleted after the version."""
+        kept = self.create_workout("Kept")
+        dropped = self.create_workout("Dropped")
+        version = int(self.client.get('/api/workouts/')['X-Change-Version'])
+        
+        kept.name = "Kept and renamed"
+        kept.save()
+        dropped.delete()
+        self.create_workout("Added")
+        
+        response = self.client.get('/api/workouts/', {'since_version': version})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['name'] for row in response.data['changed']], ["Kept and renamed", "Added"])
+        self.assertEqual(response.data['deleted'], [str(dropped._id)])
+        
+        response = self.client.get('/api/workouts/', {'since_version': response.data['version']})
+        self.assertEqual((response.data['changed'], response.data['deleted']), ([], []))
+    
+    def test_interleaved_writers(self):
+        """Test a write finishing before an earlier-numbered one is not reported until both are done."""
+        version = int(self.client.get('/api/workouts/')['X-Change-Version'])
+        slow = next_version('workouts')
+        fast = self.create_workout("Fast")
+        self.assertGreater(fast.change_version, slow)
+        self.assertEqual(collection_state('workouts')[0], slow - 1)
+        response = self.client.get('/api/workouts/', {'since_version': version})
+        self.assertEqual(response.data['version'], slow - 1)
+        
+        # The slow writer stores its document only now, stamped with its earlier version
+        get_collection(Workout).insert_one({'name': "Slow", 'description': "Versioned", 'fitness_level': "Beginner",
+                                            'duration_minutes': 15, 'category': "Cardio", 'exercises': [],
+                                            'change_version': slow})
+        release('workouts', slow)
+        response = self.client.get('/api/workouts/', {'since_version': response.data['version']})
+        self.assertEqual([row['name'] for row in response.data['changed']], ["Slow", "Fast"])
+        self.assertGreaterEqual(response.data['version'], fast.change_version)
+    
+    def test_failed_save_releases_version(self):
+        """Test a save that raises after taking its version does not hold the watermark back."""
+        def fail(sender, **kwargs):
+            raise DatabaseError("write failed")
+        pre_save.connect(fail, sender=Workout)
+        try:
+            with self.assertRaises(DatabaseError):
+                self.create_workout("Failed")
+        finally:
+            pre_save.disconnect(fail, sender=Workout)
+        added = self.create_workout("Added")
+        self.assertGreaterEqual(collection_state('workouts')[0], added.change_version)
+        response = self.client.get('/api/workouts/')
+        self.assertGreaterEqual(int(response['X-Change-Version']), added.change_version)
+    
+    def test_reset_retires_old_versions(self):
+        """Test deltas from before a bulk reload are refused."""
+        self.create_workout("Before")
+        reset('workouts')
+        response = self.client.get('/api/workouts/', {'since_version': 0})
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+
+class RowListSerializerTest(SimpleTestCase):
+    """Test cases for the precompiled list serializer."""
+    
+    def test_list_matches_per_row_serialization(self):
+        """Test list output equals serializing each row on its own."""
+        activities = [
+            Activity(_id=ObjectId(), user_email="row@example.com", activity_type="Running", duration_minutes=30,
+                     calories_burned=300, distance_km=5.0, date=datetime(2024, 1, 1, 6, tzinfo=dt_timezone.utc), notes="Aware"),
+            Activity(_id=ObjectId(), user_email="row@example.com", activity_type="Yoga", duration_minutes=45,
+                     calories_burned=150, distance_km=None, date=datetime(2024, 1, 2, 7), notes=""),
+        ]
+        workouts = [
+            Workout(_id=ObjectId(), name="Row Workout", description="Rows", fitness_level="Beginner",
+                    duration_minutes=20, category="Strength", exercises=[{"name": "Push-ups", "reps": 10}]),
+        ]
+        for serializer_class, instances in [(ActivitySerializer, activities), (WorkoutSerializer, workouts)]:
+            expected = [serializer_class(instance).data for instance in instances]
+            self.assertEqual(serializer_class(instances, many=True).data, expected)
+
+
+class SparseFieldsetTest(SimpleTestCase):
+    """Test cases for ?fields= and ?omit= sparse fieldsets."""
+    
+    def setUp(self):
+        self.activity = Activity(_id=ObjectId(), user_email="row@example.com", activity_type="Running",
+                                 duration_minutes=30, calories_burned=300, distance_km=5.0,
+                                 date=datetime(2024, 1, 1, 6, tzinfo=dt_timezone.utc), notes="Long notes")
+    
+    def test_fields_and_omit_limit_output(self):
+        """Test the query selects keys for single objects and lists alike."""
+        request = Request(APIRequestFactory().get('/api/activities/', {'fields': 'id,calories_burned,bogus'}))
+        data = ActivitySerializer([self.activity], many=True, context={'request': request}).data
+        self.assertEqual(data, [{'id': str(self.activity._id), 'calories_burned': 300}])
+        
+        data = ActivitySerializer(self.activity, omit={'notes', 'date'}).data
+        self.assertNotIn('notes', data)
+        self.assertEqual(data['activity_type'], 'Running')
+    
+    def test_projection_follows_sources(self):
+        """Test aliases project onto their model field and keyset fields are always loaded."""
+        serializer = LeaderboardSerializer(fields={'points', 'name'})
+        self.assertEqual(projected_fields(serializer), ['_id', 'total_calories', 'user_name'])
+        self.assertEqual(projected_fields(ActivitySerializer(fields={'notes'}), ('-date', '_id')),
+                         ['_id', 'date', 'notes'])
+        self.assertIsNone(projected_fields(ActivitySerializer()))
+
+
+class RendererTest(SimpleTestCase):
+    """Test cases for the orjson and MessagePack renderers."""
+    
+    def test_orjson_matches_drf_json(self):
+        """Test the orjson renderer produces the same bytes as DRF's JSON renderer."""
+        activity = Activity(_id=ObjectId(), user_email="row@example.com", activity_type="Running",
+                            duration_minutes=30, calories_burned=300, distance_km=5.0,
+                            date=datetime(2024, 1, 1, 6, tzinfo=dt_timezone.utc), notes="Ünïcode")
+        data = ActivitySerializer([activity], many=True).data
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+    
+    def test_line_separators_escaped(self):
+        """Test U+2028 and U+2029 are escaped as DRF's JSON renderer escapes them."""
+        data = {'notes': "one\u2028two\u2029three"}
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertIn(b'\\u2028', ORJSONRenderer().render(data))
+    
+    def test_native_types(self):
+        """Test ObjectIds and datetimes render without going through a serializer."""
+        object_id = ObjectId()
+        moment = datetime(2024, 1, 1, 6, tzinfo=dt_timezone.utc)
+        data = {'id': object_id, 'date': moment}
+        self.assertEqual(json.loads(ORJSONRenderer().render(data)),
+                         {'id': str(object_id), 'date': '2024-01-01T06:00:00Z'})
+        self.assertEqual(msgpack.unpackb(MessagePackRenderer().render(data), timestamp=3),
+                         {'id': str(object_id), 'date': moment})
+
+
+class CompressionMiddlewareTest(SimpleTestCase):
+    """Test cases for Accept-Encoding negotiation and compression."""
+    
+    def respond(self, body, accept_encoding):
+        request = RequestFactory().get('/api/activities/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        return CompressionMiddleware(lambda request: HttpResponse(body))(request)
+    
+    def test_negotiates_encoding(self):
+        """Test brotli wins ties, q-values are honoured and q=0 refuses a coding."""
+        self.assertEqual(accepted_encoding('gzip, deflate, br'), 'br')
+        self.assertEqual(accepted_encoding('br;q=0.5, gzip'), 'gzip')
+        self.assertEqual(accepted_encoding('*;q=0.1, br;q=0'), 'gzip')
+        self.assertIsNone(accepted_encoding('identity'))
+    
+    def test_compresses_above_threshold(self):
+        """Test large bodies are compressed and small ones are sent as they are."""
+        body = b'{"calories_burned":300}' * 500
+        response = self.respond(body, 'gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), body)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        
+        response = self.respond(body, 'br')
+        self.assertEqual(brotli.decompress(response.content), body)
+        
+        response = self.respond(b'{}', 'br')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class ActivityExportAPITest(APITestCase):
+    """Test cases for streaming activity exports."""
+    
+    def setUp(self):
+        for day, email in [(1, "first@example.com"), (2, "second@example.com"), (3, "first@example.com")]:
+            Activity.objects.create(
+                user_email=email,
+                activity_type="Running",
+                duration_minutes=30,
+                calories_burned=250,
+                distance_km=4.2,
+                date=datetime(2024, 3, day)
+            )
+    
+    def test_ndjson_export(self):
+        """Test NDJSON export streams one filtered row per line, oldest first."""
+        response = self.client.get('/api/activities/export/', {'format': 'ndjson', 'user_email': 'first@example.com'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual([row['date'][:10] for row in rows], ['2024-03-01', '2024-03-03'])
+    
+    def test_csv_export_since(self):
+        """Test CSV export has a header and honours since."""
+        response = self.client.get('/api/activities/export/', {'format': 'csv', 'since': '2024-03-02T00:00:00'})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], ','.join(ActivitySerializer.Meta.fields))
+        self.assertEqual(len(lines), 3)
+
+
+class ArchiveChunkTest(SimpleTestCase):
+    """Test cases for the column-file activity archive."""
+    
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.documents = [
+            {'_id': ObjectId(), 'user_email': email, 'activity_type': activity_type, 'duration_minutes': 30,
+             'calories_burned': calories, 'distance_km': distance, 'date': datetime(2023, 1, day, tzinfo=dt_timezone.utc),
+             'notes': ''}
+            for day, email, activity_type, calories, distance in [
+                (2, "one@example.com", "Running", 300, 5.25),
+                (3, "two@example.com", "Yoga", 100, None),
+                (4, "one@example.com", "Running", 200, 3.5),
+            ]
+        ]
+        chunk = _write_chunk(self.root, '2023-01', self.documents)
+        os.remove(os.path.join(chunk.path, PENDING))
+    
+    def test_documents_round_trip(self):
+        """Test archived documents read back as written, filtered by user and date."""
+        self.assertEqual(list(archived_documents(root=self.root)), self.documents)
+        since = datetime(2023, 1, 3, tzinfo=dt_timezone.utc)
+        self.assertEqual(list(archived_documents(since, "one@example.com", root=self.root)), self.documents[2:])
+    
+    def test_summary_by_type(self):
+        """Test the memory-mapped scan totals each activity type."""
+        totals = archived_summary(root=self.root)
+        self.assertEqual(totals['Running'], [2, 500, 8.75, 60])
+        self.assertEqual(totals['Yoga'], [1, 100, 0.0, 30])
+        self.assertEqual(archived_summary(user_email="nobody@example.com", root=self.root), {})
+
+
+class ArchiveAPITest(APITestCase):
+    """Test cases for moving activities to the archive."""
+    
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        User.objects.create(name="Runner One", email="one@example.com", team="Team A", fitness_level="Beginner")
+        for date, calories in [(datetime(2023, 1, 5, tzinfo=dt_timezone.utc), 300),
+                               (datetime(2024, 6, 1, tzinfo=dt_timezone.utc), 200)]:
+            Activity.objects.create(user_email="one@example.com", activity_type="Running", duration_minutes=30,
+                                    calories_burned=calories, distance_km=5.0, date=date)
+        rebuild_leaderboard()
+    
+    def test_archive_keeps_totals_stats_and_exports(self):
+        """Test archived activities leave the hot collection but not rebuilds, stats or exports."""
+        with override_settings(OCTOFIT_ARCHIVE_DIR=self.root):
+            result = archive_activities(datetime(2024, 1, 1, tzinfo=dt_timezone.utc))
+            self.assertEqual((result['archived'], result['chunks']), (1, 1))
+            self.assertEqual(Activity.objects.count(), 1)
+            
+            rebuild_leaderboard()
+            self.assertEqual(Leaderboard.objects.get(user_email="one@example.com").total_calories, 500)
+            response = self.client.get('/api/stats/by_type/', {'user_email': 'one@example.com'})
+            self.assertEqual(response.data['types'][0]['activities'], 2)
+            response = self.client.get('/api/activities/export/', {'format': 'ndjson'})
+            rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+            self.assertEqual([row['date'][:10] for row in rows], ['2023-01-05', '2024-06-01'])
+    
+    def test_clear_archive(self):
+        """Test clearing the archive, as populate_db does, keeps old activities out of new totals."""
+        with override_settings(OCTOFIT_ARCHIVE_DIR=self.root):
+            archive_activities(datetime(2024, 1, 1, tzinfo=dt_timezone.utc))
+            clear_archive()
+            self.assertEqual(os.listdir(self.root), [])
+            self.assertEqual(list(archived_documents()), [])
+            rebuild_leaderboard()
+            self.assertEqual(Leaderboard.objects.get(user_email="one@example.com").total_calories, 200)
+
+
+class SearchIndexTest(SimpleTestCase):
+    """Test cases for the in-memory search index."""
+    
+    def setUp(self):
+        self.index = SearchIndex()
+        self.index.add('users', 'u1', {'name': "Tony Stark", 'email': "tony@example.com", 'team': "Avengers"})
+        self.index.add('users', 'u2', {'name': "Toni Morrison", 'email': "toni@example.com", 'team': "Writers"})
+        self.index.add('teams', 't1', {'name': "Avengers", 'description': "Earth's mightiest heroes"})
+    
+    def test_tokenize(self):
+        """Test tokens are lowercased, accent-free and split on punctuation."""
+        self.assertEqual(tokenize("Zoë O'Brien-Smith"), ['zoe', 'o', 'brien', 'smith'])
+        self.assertTrue(within_one_edit('tnoy', 'tony'))
+        self.assertFalse(within_one_edit('tnoy', 'tommy'))
+    
+    def test_exact_prefix_and_typo(self):
+        """Test a term matches whole tokens, prefixes and one-typo spellings."""
+        self.assertEqual([hit['id'] for hit in self.index.search("stark")], ['u1'])
+        self.assertEqual([hit['id'] for hit in self.index.search("ton")], ['u2', 'u1'])
+        self.assertEqual([hit['id'] for hit in self.index.search("Tnoy Strak")], ['u1'])
+    
+    def test_ranking_and_kinds(self):
+        """Test name matches outrank team matches and results can be limited to kinds."""
+        self.assertEqual([hit['id'] for hit in self.index.search("avengers")], ['t1', 'u1'])
+        self.assertEqual([hit['id'] for hit in self.index.search("avengers", kinds={'users'})], ['u1'])
+        self.assertEqual(self.index.search("avengers", limit=1)[0]['subtitle'], "Earth's mightiest heroes")
+    
+    def test_unlimited(self):
+        """Test limit=None returns every match, past the prefix expansion cap."""
+        for number in range(search.MAX_EXPANSIONS + 5):
+            self.index.add('users', f'x{number}', {'name': f"Tonx{number:03d} Member"})
+        self.assertEqual(len(self.index.search("ton", limit=None)), search.MAX_EXPANSIONS + 7)
+        self.assertEqual(len(self.index.search("ton member", limit=None)), search.MAX_EXPANSIONS + 5)
+        self.assertEqual(len(self.index.search("ton", limit=5)), 5)
+    
+    def test_reindex_and_remove(self):
+        """Test re-adding a document replaces its tokens and removing it drops them."""
+        self.index.add('users', 'u1', {'name': "Anthony Edward Stark", 'email': "tony@example.com"})
+        self.assertEqual(self.index.search("avengers", kinds={'users'}), [])
+        self.index.remove('users', 'u1')
+        self.assertEqual(self.index.search("stark"), [])
+        self.assertEqual(self.index.search("edward"), [])
+
+
+class SearchAPITest(APITestCase):
+    """Test cases for the search endpoint."""
+    
+    def setUp(self):
+        search.index.clear()
+        User.objects.create(name="Tony Stark", email="tony@example.com", team="Avengers", fitness_level="Advanced")
+        Team.objects.create(name="Avengers", description="Earth's mightiest heroes")
+        Workout.objects.create(name="Stark Intervals", description="Sprints", fitness_level="Advanced",
+                               duration_minutes=20, category="Cardio", exercises={"exercises": []})
+    
+    def test_search_all_kinds(self):
+        """Test a query finds users, teams and workouts."""
+        response = self.client.get('/api/search/', {'q': "stark"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual({hit['type'] for hit in response.data['results']}, {'users', 'workouts'})
+        response = self.client.get('/api/search/', {'q': "avengers", 'types': "teams"})
+        self.assertEqual([hit['name'] for hit in response.data['results']], ["Avengers"])
+    
+    def test_saves_update_the_index(self):
+        """Test renames and deletes are reflected in later searches."""
+        self.client.get('/api/search/', {'q': "stark"})
+        Workout.objects.filter(name="Stark Intervals").delete()
+        user = User.objects.get(email="tony@example.com")
+        user.name = "Pepper Potts"
+        user.save()
+        response = self.client.get('/api/search/', {'q': "stark"})
+        self.assertEqual(response.data['results'], [])
+        response = self.client.get('/api/search/', {'q': "peper"})
+        self.assertEqual([hit['name'] for hit in response.data['results']], ["Pepper Potts"])
+    
+    def test_invalid_parameters(self):
+        """Test a missing query, unknown type or bad limit is rejected."""
+        self.assertEqual(self.client.get('/api/search/').status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/api/search/', {'q': "stark", 'types': "planets"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/api/search/', {'q': "stark", 'limit': "0"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ActivityChangelistTest(TestCase):
+    """Test cases for the keyset-paged activity admin changelist."""
+    
+    def setUp(self):
+        get_cache().clear()
+        admin_user = get_user_model().objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(admin_user)
+        for day, activity_type in [(1, "Running"), (2, "Yoga"), (3, "Running")]:
+            Activity.objects.create(user_email="one@example.com", activity_type=activity_type, duration_minutes=30,
+                                    calories_burned=100, date=datetime(2024, 1, day, tzinfo=dt_timezone.utc))
+    
+    def changelist(self, query=''):
+        with mock.patch.object(ActivityAdmin, 'list_per_page', 2):
+            response = self.client.get(f'/admin/octofit_tracker/activity/{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+    
+    def test_pages_by_cursor(self):
+        """Test pages follow the -date keyset forwards and back."""
+        first = self.changelist()
+        self.assertEqual([row.date.day for row in first.result_list], [3, 2])
+        self.assertEqual(first.result_count, 3)
+        self.assertIsNone(first.previous_url)
+        second = self.changelist(first.next_url)
+        self.assertEqual([row.date.day for row in second.result_list], [1])
+        self.assertIsNone(second.next_url)
+        self.assertEqual([row.date.day for row in self.changelist(second.previous_url).result_list], [3, 2])
+    
+    def test_filtered_list_and_cached_facets(self):
+        """Test type filters page and count exactly, with choices served from the cached distinct."""
+        filtered = self.changelist('?activity_type=Running')
+        self.assertEqual([row.date.day for row in filtered.result_list], [3, 1])
+        self.assertEqual(filtered.result_count, 2)
+        Activity.objects.create(user_email="one@example.com", activity_type="Swimming", duration_minutes=30,
+                                calories_burned=100, date=datetime(2024, 1, 4, tzinfo=dt_timezone.utc))
+        field = Activity._meta.get_field('activity_type')
+        self.assertEqual(distinct_values(Activity, field), ["Running", "Yoga"])
+        get_cache().clear()
+        self.assertEqual(distinct_values(Activity, field), ["Running", "Swimming", "Yoga"])
+    
+    def test_invalid_cursor(self):
+        """Test a malformed cursor falls back to the admin's error redirect."""
+        response = self.client.get('/admin/octofit_tracker/activity/?cursor=garbage')
+        self.assertEqual(response.status_code, 302)
+
+
+class IdempotentIdTest(SimpleTestCase):
+    """Test cases for idempotency-key derived activity ids."""
+    
+    def test_same_key_same_id(self):
+        """Test retries map to the same id and other users' keys do not collide."""
+        date = datetime(2024, 5, 1, 7, 30, tzinfo=dt_timezone.utc)
+        first = idempotent_id("sync@example.com", date, "watch-123")
+        self.assertEqual(first, idempotent_id("sync@example.com", date, "watch-123"))
+        self.assertNotEqual(first, idempotent_id("other@example.com", date, "watch-123"))
+        self.assertEqual(first.generation_time, date)
+
+
+class BulkIngestAPITest(APITestCase):
+    """Test cases for bulk activity ingestion."""
+    
+    def activity(self, key=None, **overrides):
+        data = {
+            'user_email': 'sync@example.com',
+            'activity_type': 'Cycling',
+            'duration_minutes': 40,
+            'calories_burned': 350,
+            'distance_km': 12.0,
+            'date': '2024-05-01T07:30:00Z',
+        }
+        if key:
+            data['idempotency_key'] = key
+        data.update(overrides)
+        return data
+    
+    def test_per_item_results(self):
+        """Test valid items are created while invalid ones are reported."""
+        payload = [self.activity(), self.activity(calories_burned='lots')]
+        response = self.client.post('/api/activities/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['created'], response.data['invalid']), (1, 1))
+        self.assertIn('calories_burned', response.data['results'][1]['errors'])
+        self.assertEqual(Leaderboard.objects.get(user_email='sync@example.com').total_calories, 350)
+    
+    def test_retried_sync_is_idempotent(self):
+        """Test resending an NDJSON sync with the same keys creates nothing new."""
+        body = '\n'.join(json.dumps(self.activity(key=f'k{i}', calories_burned=100 + i)) for i in range(3))
+        first = self.client.post('/api/activities/bulk/', body, content_type='application/x-ndjson')
+        retry = self.client.post('/api/activities/bulk/', body, content_type='application/x-ndjson')
+        self.assertEqual(first.data['created'], 3)
+        self.assertEqual((retry.data['created'], retry.data['duplicates']), (0, 3))
+        self.assertEqual([r['id'] for r in retry.data['results']], [r['id'] for r in first.data['results']])
+        self.assertEqual(Activity.objects.filter(user_email='sync@example.com').count(), 3)
+
+
+class StorageIndexesTest(SimpleTestCase):
+    """Test cases for the indexes a storage layout adds."""
+    
+    def test_timeseries_activities_get_an_id_index(self):
+        """Test only time-series activities need an explicit _id index."""
+        self.assertEqual(storage_indexes(Activity, TIMESERIES), [('activities_id_idx', [('_id', 1)], False)])
+        self.assertEqual(storage_indexes(Activity, PLAIN), [])
+        self.assertEqual(storage_indexes(User, TIMESERIES), [])
+
+
+class TimeseriesActivityAPITest(APITestCase):
+    """Test cases for the activity API on a time-series collection."""
+    
+    def setUp(self):
+        if not server_supports_timeseries():
+            self.skipTest('time-series activities need MongoDB 7.0')
+        User.objects.create(name="Runner One", email="one@example.com", team="Team A", fitness_level="Beginner")
+        Activity.objects.create(user_email="one@example.com", activity_type="Yoga", duration_minutes=30,
+                                calories_burned=200, date=datetime(2024, 1, 5, tzinfo=dt_timezone.utc))
+        migrate_activities(TIMESERIES)
+    
+    def tearDown(self):
+        migrate_activities(PLAIN)
+    
+    def test_api_contract_unchanged(self):
+        """Test migrated activities are listed, filtered, edited and deduplicated as before."""
+        response = self.client.get('/api/activities/by_user/?email=one@example.com')
+        self.assertEqual([row['activity_type'] for row in response.data], ['Yoga'])
+        activity_id = response.data[0]['id']
+        response = self.client.patch(f'/api/activities/{activity_id}/', {'notes': 'Stretching'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(f'/api/activities/{activity_id}/').data['notes'], 'Stretching')
+        
+        item = {'user_email': 'one@example.com', 'activity_type': 'Running', 'duration_minutes': 20,
+                'calories_burned': 150, 'date': '2024-01-06T08:00:00Z', 'idempotency_key': 'sync-1'}
+        self.assertEqual(self.client.post('/api/activities/bulk/', [item, item], format='json').data['created'], 1)
+        self.assertEqual(self.client.post('/api/activities/bulk/', [item], format='json').data['duplicates'], 1)
+        self.assertEqual(len(self.client.get('/api/activities/').data['results']), 2)
+
+
+class SyntheticDataTest(SimpleTestCase):
+    """Test cases for the seeded synthetic data generator."""
+    
+    def test_seeded_generation_is_reproducible(self):
+        """Test the same seed and user index always produce the same activities."""
+        now = datetime(2024, 6, 1, tzinfo=dt_timezone.utc)
+        self.assertEqual(synthetic.make_activities(7, 42, 5, now), synthetic.make_activities(7, 42, 5, now))
+        self.assertNotEqual(synthetic.make_activities(7, 42, 5, now), synthetic.make_activities(8, 42, 5, now))
+    
+    def test_shard_ranges_cover_all_users(self):
+        """Test shards are contiguous, balanced and cover every user once."""
+        ranges = synthetic.shard_ranges(10, 4)
+        self.assertEqual(ranges, [(0, 3), (3, 6), (6, 8), (8, 10)])
+        self.assertEqual(synthetic.shard_ranges(2, 8), [(0, 1), (1, 2)])
+    
+    def test_team_member_counts_match_assignment(self):
+        """Test members_count agrees with how users are assigned to teams."""
+        now = datetime(2024, 6, 1, tzinfo=dt_timezone.utc)
+        teams = synthetic.make_teams(3, now, 10)
+        assigned = [synthetic.make_user(0, index, 3, now)['team'] for index in range(10)]
+        self.assertEqual([team['members_count'] for team in teams], [assigned.count(team['name']) for team in teams])
+    
+    def test_references_match_derived_ids(self):
+        """Test users and activities reference the ids their team and user are inserted with."""
+        now = datetime(2024, 6, 1, tzinfo=dt_timezone.utc)
+        teams = synthetic.make_teams(3, now, 10)
+        user = synthetic.make_user(0, 4, 3, now)
+        self.assertEqual(user['team_id'], next(team['_id'] for team in teams if team['name'] == user['team']))
+        self.assertEqual({activity['user_id'] for activity in synthetic.make_activities(0, 4, 3, now)}, {user['_id']})
+
+
+class InstrumentationTest(SimpleTestCase):
+    """Test cases for request instrumentation and metrics exposition."""
+    
+    @override_settings(OCTOFIT_INSTRUMENTATION_SAMPLE_RATE=1.0)
+    def test_server_timing_header(self):
+        """Test sampled responses carry every phase in Server-Timing."""
+        response = self.client.get('/api/')
+        phases = [entry.split(';')[0].strip() for entry in response['Server-Timing'].split(',')]
+        self.assertEqual(phases, ['orm', 'mongo', 'serialize', 'render', 'total'])
+    
+    @override_settings(OCTOFIT_INSTRUMENTATION_SAMPLE_RATE=0.0)
+    def test_unsampled_requests(self):
+        """Test unsampled responses skip the breakdown."""
+        self.assertNotIn('Server-Timing', self.client.get('/api/'))
+    
+    def test_metrics_endpoint(self):
+        """Test /api/_metrics serves histograms labelled by view."""
+        self.client.get('/api/')
+        response = self.client.get('/api/_metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('# TYPE octofit_request_duration_seconds histogram', response.content.decode())
+        self.assertIn('octofit_request_duration_seconds_count{view="api-root"}', response.content.decode())
+    
+    def test_histogram_buckets_are_cumulative(self):
+        """Test bucket counts accumulate and values above the last bound land in +Inf."""
+        histogram = Histogram('test_seconds', 'Test.', (0.1, 1.0))
+        for value in [0.05, 0.1, 0.5, 3.0]:
+            histogram.observe('view', value)
+        lines = histogram.exposition()
+        self.assertIn('test_seconds_bucket{view="view",le="0.1"} 2', lines)
+        self.assertIn('test_seconds_bucket{view="view",le="1.0"} 3', lines)
+        self.assertIn('test_seconds_bucket{view="view",le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_count{view="view"} 4', lines)
+
+
+class AsyncClientTest(SimpleTestCase):
+    """Test cases for the per-event-loop Motor clients of the async views."""
+    
+    def test_closed_loop_clients_are_dropped(self):
+        """Test a new event loop closes and drops the client left by a finished one."""
+        # Loaded on demand, as urls.py does, so only the async tests need Motor
+        from . import async_views
+        
+        async def current_client():
+            return async_views.get_async_db().client
+        
+        first = asyncio.run(current_client())
+        second = asyncio.run(current_client())
+        self.addCleanup(async_views.close_stale_clients)
+        self.assertIsNot(first, second)
+        self.assertEqual(list(async_views._clients.values()), [second])
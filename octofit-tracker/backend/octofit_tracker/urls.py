@@ -14,12 +14,14 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.conf import settings
+from django.urls import path, re_path, include
 from rest_framework import routers
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
-from .views import UserViewSet, TeamViewSet, ActivityViewSet, LeaderboardViewSet, WorkoutViewSet
+from .views import UserViewSet, TeamViewSet, ActivityViewSet, LeaderboardViewSet, WorkoutViewSet, StatsViewSet, SearchViewSet
+from .instrumentation import metrics_view
 import os
 
 # Create a router and register our viewsets with it
@@ -29,6 +31,8 @@ router.register(r'teams', TeamViewSet)
 router.register(r'activities', ActivityViewSet)
 router.register(r'leaderboard', LeaderboardViewSet)
 router.register(r'workouts', WorkoutViewSet)
+router.register(r'stats', StatsViewSet, basename='stats')
+router.register(r'search', SearchViewSet, basename='search')
 
 
 @api_view(['GET'])
@@ -46,6 +50,7 @@ def api_root(request, format=None):
         'activities': reverse('activity-list', request=request, format=format),
         'leaderboard': reverse('leaderboard-list', request=request, format=format),
         'workouts': reverse('workout-list', request=request, format=format),
+        'search': reverse('search-list', request=request, format=format),
         'base_url': base_url,
     })
 
@@ -54,5 +59,24 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', api_root, name='api-root'),
     path('api/', api_root, name='api-root'),
+    path('api/_metrics', metrics_view, name='metrics'),
+]
+
+if settings.OCTOFIT_ASYNC_READS:
+    # Async read paths take precedence over the router; they hand anything
+    # they do not serve (writes, browsable API) back to the same viewsets.
+    from . import async_views
+
+    resources = '|'.join(async_views.VIEWSETS)
+    urlpatterns += [
+        path('api/leaderboard/top/', async_views.leaderboard_top, name='async-leaderboard-top'),
+        path('api/leaderboard/by_team/', async_views.leaderboard_by_team, name='async-leaderboard-by-team'),
+        path('api/activities/recent/', async_views.activities_recent, name='async-activity-recent'),
+        path('api/activities/by_user/', async_views.activities_by_user, name='async-activity-by-user'),
+        re_path(rf'^api/(?P<resource>{resources})/$', async_views.collection, name='async-list'),
+        re_path(rf'^api/(?P<resource>{resources})/(?P<pk>[0-9a-f]{{24}})/$', async_views.item, name='async-detail'),
+    ]
+
+urlpatterns += [
     path('api/', include(router.urls)),
 ]
@@ -0,0 +1,168 @@
+"""
+Change-version counters for the API collections (see ``changes.py``).
+
+``change_versions`` holds one counter document per tracked collection,
+``{_id: <collection>, version, modified, floor, in_flight}``. Every write
+bumps it atomically and stamps the written documents with the new value in
+``change_version``. ORM writes are stamped by the signal handlers inside
+the ``writing()`` block of ``models.VersionedSave``; raw pymongo writes run
+inside ``writing()`` and wrap their update in ``stamped()``, or add
+``version_stages()`` to an aggregation that writes. Deletions leave a
+``ChangeTombstone``.
+
+A version is taken before its write runs, so two writers can finish out of
+order: version 11 may be stored while 10 is still being written. Each
+version is therefore listed in ``in_flight`` until its write is done
+(``release()``, or the end of the ``writing()`` block), and readers get a
+watermark instead of the raw counter: one below the oldest version still
+in flight. Everything at or below the watermark is stored, so a poller
+resuming from it never skips a write. A version whose writer died is
+ignored after ``IN_FLIGHT_SECONDS``.
+"""
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from pymongo import ReturnDocument
+
+from .models import ChangeTombstone
+from .mongo import get_collection, get_db
+
+TRACKED = ('users', 'teams', 'activities', 'leaderboard', 'workouts')
+VERSIONS_COLLECTION = 'change_versions'
+# Versions in flight for longer than this are taken to belong to a failed write
+IN_FLIGHT_SECONDS = 60
+
+_scope = threading.local()
+
+
+def next_version(collection):
+    """
+    Bump a collection's change version and return the new value.
+
+    The version stays in flight until the enclosing ``writing()`` block
+    exits or, outside one, until the caller ``release()``s it.
+    """
+    state = get_db()[VERSIONS_COLLECTION].find_one_and_update(
+        {'_id': collection},
+        [
+            {'$set': {'version': {'$add': [{'$ifNull': ['$version', 0]}, 1]}, 'modified': '$$NOW'}},
+            {'$set': {'in_flight': {'$concatArrays': [
+                {'$ifNull': ['$in_flight', []]},
+                [{'version': '$version', 'at': {'$literal': time.time()}}],
+            ]}}},
+        ],
+        projection={'version': 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    held = getattr(_scope, 'held', None)
+    if held is not None:
+        held.append((collection, state['version']))
+    return state['version']
+
+
+def release(collection, version):
+    """Mark ``version``'s write as done, also dropping versions abandoned by failed writers."""
+    get_db()[VERSIONS_COLLECTION].update_one({'_id': collection}, {'$pull': {'in_flight': {'$or': [
+        {'version': version},
+        {'at': {'$lt': time.time() - IN_FLIGHT_SECONDS}},
+    ]}}})
+
+
+@contextmanager
+def writing():
+    """
+    Scope for raw writes: versions taken inside it are released when it exits.
+
+    Blocks nest; only the outermost one releases, so a helper can open one
+    whether or not its caller already has.
+    """
+    if hasattr(_scope, 'held'):
+        yield
+        return
+    _scope.held = []
+    try:
+        yield
+    finally:
+        held = _scope.held
+        del _scope.held
+        for collection, version in held:
+            release(collection, version)
+
+
+def writes(function):
+    """Run ``function`` inside ``writing()``."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with writing():
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def _scoped_version(collection):
+    if not hasattr(_scope, 'held'):
+        raise RuntimeError('stamped() and version_stages() must be used inside versions.writing()')
+    return next_version(collection)
+
+
+def stamped(collection, update):
+    """``update`` (an update document) also setting a new ``change_version`` on a tracked collection."""
+    if collection not in TRACKED:
+        return update
+    return {**update, '$set': {**update.get('$set', {}), 'change_version': _scoped_version(collection)}}
+
+
+def version_stages(collection):
+    """Aggregation stages setting a new ``change_version`` on documents written to ``collection``."""
+    if collection not in TRACKED:
+        return []
+    return [{'$set': {'change_version': {'$literal': _scoped_version(collection)}}}]
+
+
+def record_deletion(collection, doc_id):
+    version = next_version(collection)
+    get_collection(ChangeTombstone).insert_one({
+        'collection_name': collection,
+        'doc_id': str(doc_id),
+        'change_version': version,
+    })
+    release(collection, version)
+
+
+def reset(*collections):
+    """Retire all earlier versions of ``collections`` after a bulk reload."""
+    for collection in collections:
+        version = next_version(collection)
+        get_db()[VERSIONS_COLLECTION].update_one({'_id': collection}, {'$set': {'floor': version}})
+        get_collection(ChangeTombstone).delete_many({'collection_name': collection})
+        release(collection, version)
+
+
+def collection_state(collection):
+    """``(version, modified, floor)``: zero and ``None`` before the first write."""
+    return state_from(get_db()[VERSIONS_COLLECTION].find_one({'_id': collection}))
+
+
+def collection_states(collections):
+    """``collection_state()`` of several collections, read with one query."""
+    documents = get_db()[VERSIONS_COLLECTION].find({'_id': {'$in': list(collections)}})
+    found = {document['_id']: document for document in documents}
+    return {collection: state_from(found.get(collection)) for collection in collections}
+
+
+def state_from(document):
+    """
+    ``collection_state()`` from a counter document read some other way (e.g. with Motor).
+
+    ``version`` is the watermark: the counter, or one below the oldest
+    version still in flight.
+    """
+    document = document or {}
+    version = document.get('version', 0)
+    cutoff = time.time() - IN_FLIGHT_SECONDS
+    pending = [entry['version'] for entry in document.get('in_flight', ()) if entry['at'] >= cutoff]
+    if pending:
+        version = min(pending) - 1
+    return version, document.get('modified'), document.get('floor', 0)
@@ -1,122 +1,370 @@
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_date, parse_datetime
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 from .models import User, Team, Activity, Leaderboard, Workout
-from .serializers import UserSerializer, TeamSerializer, ActivitySerializer, LeaderboardSerializer, WorkoutSerializer
+from .serializers import (UserSerializer, TeamSerializer, TeamStatsSerializer, ActivitySerializer,
+                          EnrichedActivitySerializer, LeaderboardSerializer, WorkoutSerializer, ActivityRollupSerializer)
+from .leaderboard import activity_created, activity_updated, activity_deleted, activity_totals
+from . import repositories
+from .archive import activity_summary
+from .cache import cached_response
+from .changes import ChangeVersionMixin
+from .exports import activity_rows, csv_stream, ndjson_stream
+from .fieldsets import SparseFieldsViewMixin
+from .ingest import MAX_BATCH_SIZE, ingest_activities
+from .parsers import NDJSONParser
+from .references import enrich_activities
+from .renderers import CSVRenderer, NDJSONRenderer
+from .rollups import GRANULARITIES, SCOPES, timeseries
+from .search import KINDS, search
+from .windows import WINDOWS, current_windows, window_around, window_team, window_top
+from collections import Counter
+from datetime import datetime, time, timezone
 
+MAX_AROUND_RADIUS = 50
+MAX_SEARCH_LIMIT = 100
 
-class UserViewSet(viewsets.ModelViewSet):
+
+def parse_moment(value, end_of_day=False):
+    """Parse an ISO datetime or date query parameter as UTC; ``None`` if malformed."""
+    try:
+        day = parse_date(value)
+        moment = parse_datetime(value) if day is None else None
+    except ValueError:
+        return None
+    if day is not None:
+        moment = datetime.combine(day, time.max if end_of_day else time.min)
+    if moment is None:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment
+
+
+class UserViewSet(ChangeVersionMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows users to be viewed or edited.
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    keyset_ordering = ('_id',)
     
     @action(detail=False, methods=['get'])
     def by_email(self, request):
         """Get user by email."""
         email = request.query_params.get('email', None)
         if email:
-            try:
-                user = User.objects.get(email=email)
-                serializer = self.get_serializer(user)
-                return Response(serializer.data)
-            except User.DoesNotExist:
+            user = repositories.user_by_email(email)
+            if user is None:
                 return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+            serializer = self.get_serializer(user)
+            return Response(serializer.data)
         return Response({'error': 'Email parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class TeamViewSet(viewsets.ModelViewSet):
+class TeamViewSet(ChangeVersionMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows teams to be viewed or edited.
     """
     queryset = Team.objects.all()
     serializer_class = TeamSerializer
+    keyset_ordering = ('_id',)
     
     @action(detail=True, methods=['get'])
     def members(self, request, pk=None):
         """Get all members of a team."""
         team = self.get_object()
-        users = User.objects.filter(team=team.name)
-        serializer = UserSerializer(users, many=True)
+        users = repositories.users_in_team(team.name)
+        serializer = UserSerializer(users, many=True, context=self.get_serializer_context())
+        return Response(serializer.data)
+    
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        """Get a team's member count, totals and rank."""
+        team = repositories.team_by_id(pk)
+        if team is None:
+            return Response({'error': 'Team not found'}, status=status.HTTP_404_NOT_FOUND)
+        serializer = TeamStatsSerializer(team, context=self.get_serializer_context())
+        return Response(serializer.data)
+    
+    @action(detail=False, methods=['get'])
+    def standings(self, request):
+        """Get every team's stats in rank order."""
+        serializer = TeamStatsSerializer(repositories.team_standings(), many=True,
+                                         context=self.get_serializer_context())
         return Response(serializer.data)
 
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class ActivityViewSet(ChangeVersionMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows activities to be viewed or edited.
     """
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
+    keyset_ordering = ('-date', '_id')
+    
+    def get_serializer_class(self):
+        if self.action == 'enriched':
+            return EnrichedActivitySerializer
+        return super().get_serializer_class()
+    
+    def sparse_fields(self):
+        names = super().sparse_fields()
+        if names is not None and self.action == 'enriched':
+            # enrich_activities() joins on these whatever fields are shown
+            names = sorted({*names, 'user_id', 'user_email'})
+        return names
+    
+    def perform_create(self, serializer):
+        activity = serializer.save()
+        activity_created(activity)
+    
+    def perform_update(self, serializer):
+        previous = activity_totals(serializer.instance)
+        activity = serializer.save()
+        activity_updated(previous, activity_totals(activity))
+    
+    def perform_destroy(self, instance):
+        previous = activity_totals(instance)
+        instance.delete()
+        activity_deleted(previous)
     
     @action(detail=False, methods=['get'])
     def by_user(self, request):
         """Get all activities for a specific user."""
         email = request.query_params.get('email', None)
         if email:
-            activities = Activity.objects.filter(user_email=email).order_by('-date')
+            activities = repositories.activities_for_user(email, self.sparse_fields())
             serializer = self.get_serializer(activities, many=True)
             return Response(serializer.data)
         return Response({'error': 'Email parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
     
+    @action(detail=False, methods=['get'])
+    def enriched(self, request):
+        """Activities with their user and team, resolved with one batched query each per page."""
+        page = self.paginate_queryset(self.get_queryset())
+        serializer = self.get_serializer(enrich_activities(page), many=True)
+        return self.get_paginated_response(serializer.data)
+    
     @action(detail=False, methods=['get'])
     def recent(self, request):
         """Get most recent activities across all users."""
         limit = int(request.query_params.get('limit', 10))
-        activities = Activity.objects.all().order_by('-date')[:limit]
+        activities = repositories.recent_activities(limit, self.sparse_fields())
         serializer = self.get_serializer(activities, many=True)
         return Response(serializer.data)
+    
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        """Create many activities from a JSON array or an NDJSON body, with per-item results."""
+        items = request.data
+        if not isinstance(items, list):
+            return Response({'error': 'Expected a list of activities'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > MAX_BATCH_SIZE:
+            return Response({'error': f'At most {MAX_BATCH_SIZE} activities per request'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        results = ingest_activities(items)
+        counts = Counter(result['status'] for result in results)
+        return Response({
+            'created': counts['created'],
+            'duplicates': counts['duplicate'],
+            'invalid': counts['invalid'],
+            'results': results,
+        })
+    
+    @action(detail=False, methods=['get'], renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request):
+        """Stream activities as NDJSON or CSV (?format=ndjson|csv&since=&user_email=)."""
+        since = request.query_params.get('since', None)
+        if since:
+            since = parse_moment(since)
+            if since is None:
+                return Response({'error': 'Invalid since timestamp'}, status=status.HTTP_400_BAD_REQUEST)
+        rows = activity_rows(since=since, user_email=request.query_params.get('user_email', None))
+        
+        renderer = request.accepted_renderer
+        stream = csv_stream(rows) if renderer.format == 'csv' else ndjson_stream(rows)
+        response = StreamingHttpResponse(stream, content_type=f'{renderer.media_type}; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="activities.{renderer.format}"'
+        return response
 
 
-class LeaderboardViewSet(viewsets.ModelViewSet):
+class LeaderboardViewSet(ChangeVersionMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows leaderboard to be viewed or edited.
     """
     queryset = Leaderboard.objects.all()
     serializer_class = LeaderboardSerializer
+    keyset_ordering = ('rank', '_id')
     
     @action(detail=False, methods=['get'])
+    @current_windows
+    @cached_response('leaderboard')
     def top(self, request):
-        """Get top N users from leaderboard."""
+        """Get top N users from leaderboard, all-time or for a ?window=week|month|30d."""
         limit = int(request.query_params.get('limit', 10))
-        leaderboard = Leaderboard.objects.all()[:limit]
+        window = request.query_params.get('window', None)
+        if window:
+            if window not in WINDOWS:
+                return Response({'error': f'window must be one of {", ".join(WINDOWS)}'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            leaderboard = window_top(window, limit)
+        else:
+            leaderboard = repositories.top_leaderboard(limit, self.sparse_fields())
         serializer = self.get_serializer(leaderboard, many=True)
         return Response(serializer.data)
     
     @action(detail=False, methods=['get'])
+    @current_windows
+    @cached_response('leaderboard')
     def by_team(self, request):
-        """Get leaderboard filtered by team."""
+        """Get leaderboard filtered by team, all-time or for a ?window=week|month|30d."""
         team = request.query_params.get('team', None)
+        window = request.query_params.get('window', None)
+        if window and window not in WINDOWS:
+            return Response({'error': f'window must be one of {", ".join(WINDOWS)}'},
+                            status=status.HTTP_400_BAD_REQUEST)
         if team:
-            leaderboard = Leaderboard.objects.filter(team=team)
+            leaderboard = window_team(window, team) if window else self.get_queryset().filter(team=team)
             serializer = self.get_serializer(leaderboard, many=True)
             return Response(serializer.data)
         return Response({'error': 'Team parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    @action(detail=False, methods=['get'])
+    @current_windows
+    @cached_response('leaderboard')
+    def around(self, request):
+        """Get a user's current rank and the ?radius= entries above and below them."""
+        email = request.query_params.get('email', None)
+        window = request.query_params.get('window', None)
+        if not email:
+            return Response({'error': 'Email parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if window and window not in WINDOWS:
+            return Response({'error': f'window must be one of {", ".join(WINDOWS)}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            radius = int(request.query_params.get('radius', 5))
+        except ValueError:
+            return Response({'error': 'radius must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        radius = max(0, min(radius, MAX_AROUND_RADIUS))
+        
+        found = window_around(window, email, radius) if window else repositories.leaderboard_around(email, radius)
+        if found is None:
+            return Response({'error': 'User is not on the leaderboard'}, status=status.HTTP_404_NOT_FOUND)
+        rank, entries = found
+        serializer = self.get_serializer(entries, many=True)
+        return Response({'user_email': email, 'rank': rank, 'entries': serializer.data})
 
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+class WorkoutViewSet(ChangeVersionMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows workouts to be viewed or edited.
     """
     queryset = Workout.objects.all()
     serializer_class = WorkoutSerializer
+    keyset_ordering = ('_id',)
     
     @action(detail=False, methods=['get'])
+    @cached_response('workouts')
     def by_fitness_level(self, request):
         """Get workouts filtered by fitness level."""
         fitness_level = request.query_params.get('fitness_level', None)
         if fitness_level:
-            workouts = Workout.objects.filter(fitness_level=fitness_level)
+            workouts = self.get_queryset().filter(fitness_level=fitness_level)
             serializer = self.get_serializer(workouts, many=True)
             return Response(serializer.data)
         return Response({'error': 'Fitness level parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
     
     @action(detail=False, methods=['get'])
+    @cached_response('workouts')
     def by_category(self, request):
         """Get workouts filtered by category."""
         category = request.query_params.get('category', None)
         if category:
-            workouts = Workout.objects.filter(category=category)
+            workouts = self.get_queryset().filter(category=category)
             serializer = self.get_serializer(workouts, many=True)
             return Response(serializer.data)
         return Response({'error': 'Category parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class StatsViewSet(viewsets.ViewSet):
+    """
+    API endpoint for aggregated activity statistics.
+    """
+    
+    @action(detail=False, methods=['get'])
+    def timeseries(self, request):
+        """Get per-bucket totals (?scope=user|team&key=&granularity=day|week|month&from=&to=)."""
+        scope = request.query_params.get('scope', 'user')
+        key = request.query_params.get('key', None)
+        granularity = request.query_params.get('granularity', 'day')
+        if scope not in SCOPES:
+            return Response({'error': f'scope must be one of {", ".join(SCOPES)}'}, status=status.HTTP_400_BAD_REQUEST)
+        if granularity not in GRANULARITIES:
+            return Response({'error': f'granularity must be one of {", ".join(GRANULARITIES)}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not key:
+            return Response({'error': 'Key parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        bounds = {}
+        for name in ['from', 'to']:
+            value = request.query_params.get(name, None)
+            if value:
+                bounds[name] = parse_moment(value, end_of_day=name == 'to')
+                if bounds[name] is None:
+                    return Response({'error': f'Invalid {name} timestamp'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        buckets = timeseries(scope, key, granularity, bounds.get('from'), bounds.get('to'))
+        return Response({
+            'scope': scope,
+            'key': key,
+            'granularity': granularity,
+            'buckets': ActivityRollupSerializer(buckets, many=True, context={'request': request}).data,
+        })
+    
+    @action(detail=False, methods=['get'])
+    def by_type(self, request):
+        """Get per-activity-type totals over all history, archive included (?user_email=&from=&to=)."""
+        bounds = {}
+        for name in ['from', 'to']:
+            value = request.query_params.get(name, None)
+            if value:
+                bounds[name] = parse_moment(value, end_of_day=name == 'to')
+                if bounds[name] is None:
+                    return Response({'error': f'Invalid {name} timestamp'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        user_email = request.query_params.get('user_email', None)
+        return Response({
+            'user_email': user_email,
+            'types': activity_summary(bounds.get('from'), bounds.get('to'), user_email),
+        })
+
+
+class SearchViewSet(viewsets.ViewSet):
+    """
+    API endpoint for searching users, teams and workouts.
+    """
+    
+    def list(self, request):
+        """Ranked, typo-tolerant matches for ?q= (&types=users,teams,workouts&limit=)."""
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'q parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
+        kinds = None
+        if request.query_params.get('types'):
+            kinds = {kind.strip() for kind in request.query_params['types'].split(',') if kind.strip()}
+            if not kinds or not kinds <= set(KINDS):
+                return Response({'error': f'types must be drawn from {", ".join(KINDS)}'},
+                                status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = int(request.query_params.get('limit', 20))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= MAX_SEARCH_LIMIT:
+            return Response({'error': f'limit must be between 1 and {MAX_SEARCH_LIMIT}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({'query': query, 'results': search(query, kinds, limit)})
@@ -0,0 +1,319 @@
+"""
+Time-windowed leaderboards: this ISO week, this month and the last 30 days.
+
+``leaderboard_windows`` holds one ranked row per user and window partition:
+``('week', <week start>)``, ``('month', <month start>)`` and ``('30d',
+None)``. Rows look like leaderboard rows, ranks included, so a windowed
+``top`` or ``by_team`` is the same indexed top-N read as the all-time one.
+
+Activity writes inside a current window are folded in as deltas, ranked
+the same way as the leaderboard (``ranking.py``). Windows roll over once
+per UTC day in ``advance_windows()``:
+
+* week and month rows key on the period start, so a new period simply
+  starts a new, empty partition; finished periods are dropped;
+* the rolling window subtracts the days that left it and adds the days
+  that entered it (activities may be dated ahead), using the daily
+  per-user rollups, then re-ranks its partition. A state document with a
+  compare-and-set on the window start makes one process do each roll.
+
+``rebuild_windows()`` recomputes the current partitions from the rollups.
+"""
+import functools
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from .cache import invalidate
+from .indexes import ensure_indexes
+from .models import ActivityRollup, Leaderboard, LeaderboardWindow, User
+from .mongo import get_collection, get_db
+from .ranking import neighbourhood, rank_stage, rerank, shift_ranks, slot_in
+from .repositories import model_instances, model_projection
+from .rollups import bucket_start
+
+ROLLING = '30d'
+ROLLING_DAYS = 30
+WINDOWS = ('week', 'month', ROLLING)
+STATE_COLLECTION = 'leaderboard_window_state'
+
+_advanced_day = None
+
+
+def _today(now=None):
+    return bucket_start(now or datetime.now(timezone.utc), 'day')
+
+
+def window_partition(span, now=None):
+    """Filter selecting the current partition of a window."""
+    if span == ROLLING:
+        return {'span': span, 'period_start': None}
+    return {'span': span, 'period_start': bucket_start(now or datetime.now(timezone.utc), span)}
+
+
+def _partition_for(span, date, now=None):
+    """The current partition of ``span`` that ``date`` falls in, or ``None``."""
+    if span == ROLLING:
+        today = _today(now)
+        day = bucket_start(date, 'day')
+        in_window = today - timedelta(days=ROLLING_DAYS - 1) <= day <= today
+        return window_partition(span) if in_window else None
+    partition = window_partition(span, now)
+    return partition if bucket_start(date, span) == partition['period_start'] else None
+
+
+def record_window_activities(entries, now=None):
+    """
+    Fold dated activity deltas into the current windows.
+
+    ``entries`` are ``(user_email, date, activities, calories, distance,
+    ...)`` tuples as given to ``rollups.record_activities()``; deltas for
+    dates outside every current window are ignored.
+    """
+    advance_windows(now)
+    totals = defaultdict(lambda: [0, 0, 0.0])
+    for email, date, activities, calories, distance, *_ in entries:
+        for span in WINDOWS:
+            partition = _partition_for(span, date, now)
+            if partition is None:
+                continue
+            total = totals[(span, partition['period_start'], email)]
+            total[0] += activities
+            total[1] += calories
+            total[2] += distance
+
+    changed = False
+    for (span, period_start, email), (activities, calories, distance) in totals.items():
+        if activities or calories or distance:
+            _apply_window_delta({'span': span, 'period_start': period_start}, email, activities, calories, distance)
+            changed = True
+    if changed:
+        invalidate('leaderboard')
+
+
+def _apply_window_delta(partition, user_email, activities, calories, distance):
+    windows = get_collection(LeaderboardWindow)
+    before = windows.find_one_and_update(
+        {**partition, 'user_email': user_email},
+        {'$inc': {
+            'total_activities': activities,
+            'total_calories': calories,
+            'total_distance': distance,
+        }},
+        projection={'total_calories': 1},
+        return_document=ReturnDocument.BEFORE,
+    )
+    if before is not None:
+        old_calories = before['total_calories']
+        shift_ranks(windows, before['_id'], 'user_email', user_email, old_calories, old_calories + calories,
+                    partition)
+        return
+
+    user = get_collection(User).find_one({'email': user_email}, {'name': 1, 'team': 1}) or {}
+    row = {
+        **partition,
+        'user_email': user_email,
+        'user_name': user.get('name', user_email),
+        'team': user.get('team', ''),
+        'total_activities': activities,
+        'total_calories': calories,
+        'total_distance': distance,
+        'rank': 0,
+    }
+    try:
+        windows.insert_one(row)
+    except DuplicateKeyError:
+        # Another writer created the row first; fold into it instead.
+        _apply_window_delta(partition, user_email, activities, calories, distance)
+        return
+    slot_in(windows, row['_id'], 'user_email', user_email, calories, partition)
+
+
+def advance_windows(now=None):
+    """
+    Roll the windows forward to today; cheap after the first call of a day.
+
+    Retires every response cached on the leaderboard the first time each
+    process sees a new day, since windowed results change with the date.
+    """
+    global _advanced_day
+    today = _today(now)
+    if _advanced_day == today:
+        return
+
+    states = get_db()[STATE_COLLECTION]
+    state = states.find_one({'_id': ROLLING})
+    start = today - timedelta(days=ROLLING_DAYS - 1)
+    if state is None:
+        rebuild_windows(now)
+    elif state['start'] < start:
+        claimed = states.find_one_and_update({'_id': ROLLING, 'start': state['start']}, {'$set': {'start': start}})
+        if claimed is not None:
+            _roll(state['start'], start)
+            windows = get_collection(LeaderboardWindow)
+            for span in WINDOWS:
+                if span != ROLLING:
+                    current = window_partition(span, now)['period_start']
+                    windows.delete_many({'span': span, 'period_start': {'$lt': current}})
+    _advanced_day = today
+    invalidate('leaderboard')
+
+
+def _roll(old_start, new_start):
+    """Move the rolling window from ``old_start`` to ``new_start`` using the daily rollups."""
+    old_end = old_start + timedelta(days=ROLLING_DAYS)
+    new_end = new_start + timedelta(days=ROLLING_DAYS)
+    leaving = {'$gte': old_start, '$lt': min(new_start, old_end)}
+    entering = {'$gte': max(old_end, new_start), '$lt': new_end}
+    # Days before the new start are leaving the window, the rest are entering it.
+    sign = {'$cond': [{'$lt': ['$bucket', new_start]}, -1, 1]}
+    deltas = get_collection(ActivityRollup).aggregate([
+        {'$match': {'scope': 'user', 'granularity': 'day', '$or': [{'bucket': leaving}, {'bucket': entering}]}},
+        {'$group': {
+            '_id': '$owner',
+            'activities': {'$sum': {'$multiply': [sign, '$activities']}},
+            'calories': {'$sum': {'$multiply': [sign, '$calories']}},
+            'distance': {'$sum': {'$multiply': [sign, '$distance']}},
+        }},
+    ])
+    partition = window_partition(ROLLING)
+    windows = get_collection(LeaderboardWindow)
+    operations = [
+        UpdateOne(
+            {**partition, 'user_email': delta['_id']},
+            {
+                '$inc': {
+                    'total_activities': delta['activities'],
+                    'total_calories': delta['calories'],
+                    'total_distance': delta['distance'],
+                },
+                '$setOnInsert': {'user_name': delta['_id'], 'team': '', 'rank': 0},
+            },
+            upsert=True,
+        )
+        for delta in deltas
+    ]
+    if not operations:
+        return
+    windows.bulk_write(operations, ordered=False)
+    windows.delete_many({**partition, 'total_activities': {'$lte': 0}})
+    _fill_user_details(windows, partition)
+    rerank(windows, 'user_email', partition)
+
+
+def _fill_user_details(windows, partition):
+    """Set name and team on rows inserted without them."""
+    rows = windows.find({**partition, 'team': ''}, {'user_email': 1})
+    emails = [row['user_email'] for row in rows]
+    if not emails:
+        return
+    users = get_collection(User).find({'email': {'$in': emails}}, {'email': 1, 'name': 1, 'team': 1})
+    operations = [
+        UpdateOne({**partition, 'user_email': user['email']},
+                  {'$set': {'user_name': user.get('name', user['email']), 'team': user.get('team', '')}})
+        for user in users
+    ]
+    if operations:
+        windows.bulk_write(operations, ordered=False)
+
+
+def _window_rows(partition):
+    """Stages turning ``user_email``/totals documents into ranked window rows of ``partition``."""
+    return [
+        {'$match': {'total_activities': {'$gt': 0}}},
+        {'$lookup': {
+            'from': User._meta.db_table,
+            'localField': 'user_email',
+            'foreignField': 'email',
+            'pipeline': [{'$project': {'_id': 0, 'name': 1, 'team': 1}}],
+            'as': 'user',
+        }},
+        {'$set': {
+            'span': {'$literal': partition['span']},
+            'period_start': {'$literal': partition['period_start']},
+            'user_name': {'$ifNull': [{'$first': '$user.name'}, '$user_email']},
+            'team': {'$ifNull': [{'$first': '$user.team'}, '']},
+        }},
+        {'$unset': 'user'},
+        rank_stage('user_email'),
+        {'$merge': {'into': LeaderboardWindow._meta.db_table, 'whenNotMatched': 'insert'}},
+    ]
+
+
+def rebuild_windows(now=None):
+    """
+    Recompute the current partition of every window from the per-user rollups.
+
+    Run after ``rollups.rebuild_rollups()``. Returns the number of window rows.
+    """
+    ensure_indexes(LeaderboardWindow)
+    rollups = get_collection(ActivityRollup)
+    windows = get_collection(LeaderboardWindow)
+    windows.delete_many({})
+    today = _today(now)
+
+    for span in WINDOWS:
+        partition = window_partition(span, now)
+        if span == ROLLING:
+            start = today - timedelta(days=ROLLING_DAYS - 1)
+            match = {'scope': 'user', 'granularity': 'day', 'bucket': {'$gte': start, '$lte': today}}
+        else:
+            match = {'scope': 'user', 'granularity': span, 'bucket': partition['period_start']}
+        rollups.aggregate([
+            {'$match': match},
+            {'$group': {
+                '_id': '$owner',
+                'total_activities': {'$sum': '$activities'},
+                'total_calories': {'$sum': '$calories'},
+                'total_distance': {'$sum': '$distance'},
+            }},
+            {'$project': {'_id': 0, 'user_email': '$_id', 'total_activities': 1, 'total_calories': 1,
+                          'total_distance': 1}},
+        ] + _window_rows(partition), allowDiskUse=True)
+
+    get_db()[STATE_COLLECTION].replace_one(
+        {'_id': ROLLING}, {'start': today - timedelta(days=ROLLING_DAYS - 1)}, upsert=True)
+    invalidate('leaderboard')
+    return windows.estimated_document_count()
+
+
+def window_top(span, limit):
+    """Top ``limit`` rows of a window's current partition, as leaderboard instances."""
+    cursor = get_collection(LeaderboardWindow).find(window_partition(span), model_projection(Leaderboard)).sort(
+        [('total_calories', DESCENDING), ('user_email', ASCENDING)]).limit(limit)
+    return model_instances(Leaderboard, cursor)
+
+
+def window_team(span, team):
+    """A team's rows in a window's current partition, as leaderboard instances."""
+    cursor = get_collection(LeaderboardWindow).find(
+        {**window_partition(span), 'team': team}, model_projection(Leaderboard)).sort(
+        [('total_calories', DESCENDING), ('user_email', ASCENDING)])
+    return model_instances(Leaderboard, cursor)
+
+
+def window_around(span, email, radius):
+    """``(rank, rows)`` for a user and the ``radius`` rows either side in a window, or ``None``."""
+    found = neighbourhood(get_collection(LeaderboardWindow), 'user_email', email, radius,
+                          model_projection(Leaderboard), window_partition(span))
+    if found is None:
+        return None
+    rank, documents = found
+    return rank, model_instances(Leaderboard, documents)
+
+
+def current_windows(view_method):
+    """
+    Roll the windows forward before a ``?window=`` request is answered.
+
+    Place it between ``@action`` and ``@cached_response`` so the roll-over
+    retires stale cached responses before the cache is consulted.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if request.query_params.get('window'):
+            advance_windows()
+        return view_method(self, request, *args, **kwargs)
+    return wrapper
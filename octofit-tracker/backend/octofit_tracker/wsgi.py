@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
 
 application = get_wsgi_application()
+
+# Build the search index now rather than on the first search
+from octofit_tracker.search import warm_in_background  # noqa: E402
+
+warm_in_background()